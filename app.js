@@ -24,7 +24,10 @@ const feedbackCsrfInput = document.getElementById("feedbackCsrf");
 let feedbackCsrfToken = null;
 let feedbackEnabled = false;
 let convo = []; // {role, content, sources?, pending?}
+let conversationId = null; // server-side session; only new turns are posted once it exists
 let historyItems = JSON.parse(localStorage.getItem("history") || "[]"); // [{q,a,ts}]
+const ASK_TIMEOUT_SECONDS = 90; // sent as X-Request-Timeout so the server stops generating when we give up
+let askController = null; // aborts the in-flight answer; the server then cancels the upstream call
 let settings;
 try {
   settings = JSON.parse(localStorage.getItem("settings") || "{}") || {};
@@ -44,14 +47,45 @@ if (settings.model && availableModels.includes(settings.model)) {
   localStorage.setItem("settings", JSON.stringify(settings));
 }
 
-const availablePersonas = Array.from(personaSelect.options).map((opt) => opt.value);
-if (settings.personality && availablePersonas.includes(settings.personality)) {
-  personaSelect.value = settings.personality;
-} else {
-  personaSelect.value = availablePersonas[0];
-  if (settings.personality && !availablePersonas.includes(settings.personality)) {
-    delete settings.personality;
-    localStorage.setItem("settings", JSON.stringify(settings));
+let availablePersonas = Array.from(personaSelect.options).map((opt) => opt.value);
+
+function applyPersonaSetting({ prune = true } = {}) {
+  if (settings.personality && availablePersonas.includes(settings.personality)) {
+    personaSelect.value = settings.personality;
+  } else {
+    personaSelect.value = availablePersonas[0];
+    if (prune && settings.personality) {
+      delete settings.personality;
+      localStorage.setItem("settings", JSON.stringify(settings));
+    }
+  }
+}
+// Keep a saved persona that only the server knows about until /api/personas answers.
+applyPersonaSetting({ prune: false });
+
+async function loadPersonas() {
+  try {
+    const resp = await fetch(`${API_BASE}/api/personas`);
+    if (!resp.ok) return;
+    const data = await resp.json();
+    const personas = Array.isArray(data.personas) ? data.personas : [];
+    if (!personas.length) return;
+    personaSelect.innerHTML = '';
+    personas.forEach((persona) => {
+      const opt = document.createElement('option');
+      opt.value = persona.key;
+      opt.textContent = persona.label || persona.key;
+      if (persona.description) opt.title = persona.description;
+      personaSelect.appendChild(opt);
+    });
+    availablePersonas = personas.map((persona) => persona.key);
+    if (!settings.personality && data.default && availablePersonas.includes(data.default)) {
+      personaSelect.value = data.default;
+    } else {
+      applyPersonaSetting();
+    }
+  } catch (err) {
+    console.warn('Failed to load personas; keeping the built-in list', err);
   }
 }
 
@@ -214,8 +248,13 @@ async function handleFeedbackSubmit(event) {
     if (feedbackCsrfInput) feedbackCsrfInput.value = feedbackCsrfToken || '';
     feedbackForm?.reset();
     if (feedbackCsrfInput) feedbackCsrfInput.value = feedbackCsrfToken || '';
-    setFeedbackStatus('Thanks! Just got pinged in Telegram.', 'success');
-    toast('Feedback delivered. Thank you for your feedback.');
+    if (data?.queued) {
+      setFeedbackStatus('Thanks! Your feedback is on its way to Telegram.', 'success');
+      toast('Feedback received. Thank you for your feedback.');
+    } else {
+      setFeedbackStatus('Thanks! Just got pinged in Telegram.', 'success');
+      toast('Feedback delivered. Thank you for your feedback.');
+    }
 
     if (feedbackSubmit) {
       shouldThrottle = true;
@@ -255,6 +294,7 @@ function renderHistory() {
         { role: "user", content: item.q },
         { role: "assistant", content: item.a, sources: item.sources || [] },
       ];
+      conversationId = null;
       renderMessages();
       queryInput.value = item.q;
       if (item.personality && availablePersonas.includes(item.personality)) {
@@ -323,6 +363,99 @@ function renderMessages() {
   messagesEl.scrollTop = messagesEl.scrollHeight;
 }
 
+let renderScheduled = false;
+function scheduleRender() {
+  if (renderScheduled) return;
+  renderScheduled = true;
+  requestAnimationFrame(() => {
+    renderScheduled = false;
+    renderMessages();
+  });
+}
+
+function parseSseBlock(block) {
+  let event = 'message';
+  const dataLines = [];
+  block.split('\n').forEach((line) => {
+    if (line.startsWith('event:')) event = line.slice(6).trim();
+    else if (line.startsWith('data:')) dataLines.push(line.slice(5).trimStart());
+  });
+  if (!dataLines.length) return null;
+  try {
+    return { event, data: JSON.parse(dataLines.join('\n')) };
+  } catch (err) {
+    return { event, data: {} };
+  }
+}
+
+async function readAnswerStream(resp, onToken) {
+  const reader = resp.body.getReader();
+  const decoder = new TextDecoder();
+  const result = { answer: '', citations: [] };
+  let buffer = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const evt = parseSseBlock(buffer.slice(0, boundary));
+      buffer = buffer.slice(boundary + 2);
+      if (!evt) continue;
+      if (evt.event === 'token') {
+        result.answer += evt.data.delta || '';
+        onToken(result.answer);
+      } else if (evt.event === 'citations') {
+        result.citations = evt.data.citations || [];
+      } else if (evt.event === 'done') {
+        Object.assign(result, evt.data);
+      } else if (evt.event === 'error') {
+        throw new Error(evt.data.error || 'Stream interrupted');
+      }
+    }
+  }
+  return result;
+}
+
+function dropPendingAssistant() {
+  const last = convo[convo.length - 1];
+  if (last && (last.pending || last.streaming)) {
+    convo.pop();
+    return true;
+  }
+  return false;
+}
+
+async function ensureConversation(seedHistory) {
+  if (conversationId) return conversationId;
+  try {
+    const resp = await fetch(`${API_BASE}/api/conversations`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ history: seedHistory }),
+    });
+    if (resp.ok) {
+      const data = await resp.json();
+      conversationId = data.conversation_id || null;
+    }
+  } catch (err) {
+    console.warn('Conversation session unavailable, sending full history', err);
+    conversationId = null;
+  }
+  return conversationId;
+}
+
+async function postAsk(body, historyPayload, signal) {
+  const id = await ensureConversation(historyPayload);
+  const request = id ? { ...body, conversation_id: id } : { ...body, history: historyPayload };
+  return fetch(`${API_BASE}/api/ask`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json", "X-Request-Timeout": String(ASK_TIMEOUT_SECONDS) },
+    body: JSON.stringify(request),
+    signal,
+  });
+}
+
 function showThinking() {
   convo.push({ role: "assistant", content: "Thinking…", pending: true });
   renderMessages();
@@ -332,6 +465,11 @@ async function ask(query) {
   statusEl.textContent = "Thinking...";
   askBtn.disabled = true;
   showThinking();
+  askController?.abort();
+  const controller = new AbortController();
+  askController = controller;
+  // Backstop for when the server's own deadline event never arrives.
+  const timer = setTimeout(() => controller.abort(), (ASK_TIMEOUT_SECONDS + 5) * 1000);
   try {
     const conversation = convo
       .filter(msg => !msg.pending)
@@ -342,22 +480,34 @@ async function ask(query) {
         ? conversation.slice(0, -1)
         : conversation;
 
-    const resp = await fetch(`${API_BASE}/api/ask`, {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({
-        query,
-        history: historyPayload,
-        model: modelSelect.value,
-        personality: personaSelect.value,
-        mode: modeSelect ? modeSelect.value : "chat",
-      }),
-    });
+    const body = {
+      query,
+      model: modelSelect.value,
+      personality: personaSelect.value,
+      mode: modeSelect ? modeSelect.value : "chat",
+      stream: true,
+    };
+    let resp = await postAsk(body, historyPayload, controller.signal);
+    if (resp.status === 404 && conversationId) {
+      // Session expired server-side: start a new one seeded with the local history.
+      conversationId = null;
+      resp = await postAsk(body, historyPayload, controller.signal);
+    }
     if (!resp.ok) {
       const err = await resp.json().catch(() => ({ error: resp.statusText }));
       throw new Error(err.error || err.details || resp.statusText);
     }
-    const data = await resp.json();
+    const isStream = (resp.headers.get("Content-Type") || "").includes("text/event-stream");
+    const data = isStream
+      ? await readAnswerStream(resp, (text) => {
+          const last = convo[convo.length - 1];
+          if (!last || last.role !== "assistant") return;
+          last.content = text;
+          last.pending = false;
+          last.streaming = true;
+          scheduleRender();
+        })
+      : await resp.json();
     const answer = data.answer || "";
     const citations = data.citations || [];
 
@@ -365,9 +515,7 @@ async function ask(query) {
       toast(data.answer || 'Web search is currently unavailable.');
     }
 
-    if (convo.length && convo[convo.length - 1].pending) {
-      convo.pop();
-    }
+    dropPendingAssistant();
 
     convo.push({ role: "assistant", content: answer, sources: citations });
     renderMessages();
@@ -384,17 +532,20 @@ async function ask(query) {
     historyItems = historyItems.slice(0, 50);
     localStorage.setItem("history", JSON.stringify(historyItems));
     renderHistory();
-    toast('Answer ready');
+    toast(data.routing ? `Answer ready · ${data.routing.model} (${data.routing.tier})` : 'Answer ready');
   } catch (e) {
-    if (convo.length && convo[convo.length - 1].pending) {
-      convo.pop();
+    if (dropPendingAssistant()) {
       renderMessages();
     }
-    statusEl.textContent = `Error: ${e.message}`;
-    toast(`Error: ${e.message}`);
+    const message = e.name === 'AbortError' ? 'Request cancelled' : e.message;
+    statusEl.textContent = `Error: ${message}`;
+    toast(`Error: ${message}`);
   } finally {
-    if (convo.length && convo[convo.length - 1].pending) {
-      convo.pop();
+    clearTimeout(timer);
+    if (askController === controller) {
+      askController = null;
+    }
+    if (dropPendingAssistant()) {
       renderMessages();
     }
     askBtn.disabled = false;
@@ -412,6 +563,9 @@ askForm.addEventListener("submit", (e) => {
   ask(q);
 });
 
+// Leaving the page drops the stream so the server can stop the provider call.
+window.addEventListener('pagehide', () => askController?.abort());
+
 clearHistoryBtn.addEventListener("click", () => {
   historyItems = [];
   localStorage.removeItem("history");
@@ -437,7 +591,7 @@ modelSelect?.addEventListener('change', () => {
 personaSelect?.addEventListener('change', () => {
   settings.personality = personaSelect.value;
   localStorage.setItem('settings', JSON.stringify(settings));
-  const label = personaSelect.value === 'fluent' ? 'Fluent English' : 'Pidgin Vibes';
+  const label = personaSelect.selectedOptions[0]?.textContent || personaSelect.value;
   toast(`Personality: ${label}`);
 });
 
@@ -454,5 +608,6 @@ if (feedbackForm) {
   refreshFeedbackCsrf();
 }
 
+loadPersonas();
 renderHistory();
 renderMessages();
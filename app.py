@@ -3,14 +3,57 @@ import json
 import re
 import logging
 import time
+import array
+import atexit
+import base64
+import math
+import operator
+import zlib
+import bisect
+import gzip
+import contextvars
 import hashlib
+import hmac
+import importlib.util
+import random
 import secrets
+import socket
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from functools import lru_cache, wraps
 from urllib.parse import urlparse
-from flask import Flask, request, jsonify, send_from_directory, make_response
+from flask import Flask, Response, g, request, jsonify, send_from_directory, make_response
 from flask_cors import CORS
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 from dotenv import load_dotenv
+
+try:
+    import redis
+except ImportError:  # optional shared backend
+    redis = None
+
+try:
+    import tiktoken
+except ImportError:  # optional exact token counts
+    tiktoken = None
+
+try:
+    import brotli
+except ImportError:  # optional br response compression
+    brotli = None
+
+try:
+    import numpy as np
+except ImportError:  # optional vectorized semantic cache search
+    np = None
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 FRONTEND_DIR = os.getenv(
     "FRONTEND_DIR",
@@ -32,10 +75,13 @@ if not app.secret_key:
 
 FEEDBACK_CSRF_SALT = os.getenv("FEEDBACK_CSRF_SALT", "feedback-form")
 feedback_serializer = URLSafeTimedSerializer(app.secret_key, salt=FEEDBACK_CSRF_SALT)
+# Operational pages (``/metrics`` and every ``/api/<area>/stats``): no CORS, optional bearer token.
+OPS_PATH_RE = re.compile(r"/metrics|/api/\w+/stats")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
 # Allow CORS from local files (origin 'null') and localhost
 CORS(
     app,
-    resources={r"/api/*": {"origins": ["null", r"http://127.0.0.1:*", r"http://localhost:*", "https://sourcescout.onrender.com","*"]}},
+    resources={r"/api/(?!\w+/stats$).*": {"origins": ["null", r"http://127.0.0.1:*", r"http://localhost:*", "https://sourcescout.onrender.com","*"]}},
 )
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -46,6 +92,8 @@ OPENROUTER_SITE_URL = os.getenv("OPENROUTER_SITE_URL", "https://sourcescout.loca
 OPENROUTER_APP_NAME = os.getenv("OPENROUTER_APP_NAME", "SourceScout")
 CHAT_DEFAULT_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 INCLUDE_RAW = os.getenv("OPENAI_INCLUDE_RAW", "false").lower() in {"1", "true", "yes"}
+RAW_FIELDS = [f.strip() for f in os.getenv("OPENAI_RAW_FIELDS", "id,object,created,model,system_fingerprint,usage,citations").split(",") if f.strip()]
+RAW_TTL = int(os.getenv("OPENAI_RAW_TTL", "3600"))
 APP_HOST = os.getenv("APP_HOST", os.getenv("FLASK_RUN_HOST", "127.0.0.1"))
 APP_PORT = int(os.getenv("APP_PORT", os.getenv("PORT", os.getenv("FLASK_RUN_PORT", "5000"))))
 APP_DEBUG = os.getenv("APP_DEBUG", os.getenv("FLASK_DEBUG", "1")).lower() in {"1", "true", "yes"}
@@ -53,6 +101,135 @@ PPLX_API_KEY = os.getenv("PPLX_API_KEY") or os.getenv("PERPLEXITY_API_KEY")
 PPLX_API_URL = os.getenv("PPLX_API_URL", os.getenv("PERPLEXITY_API_URL", "https://api.perplexity.ai/chat/completions"))
 PPLX_MODEL = os.getenv("PPLX_MODEL", os.getenv("PERPLEXITY_MODEL", "llama-3.1-sonar-small-128k-online"))
 
+UPSTREAM_POOL_CONNECTIONS = int(os.getenv("UPSTREAM_POOL_CONNECTIONS", "4"))
+UPSTREAM_POOL_MAXSIZE = int(os.getenv("UPSTREAM_POOL_MAXSIZE", "32"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "60"))
+UPSTREAM_KEEPALIVE = os.getenv("UPSTREAM_KEEPALIVE", "true").lower() in {"1", "true", "yes"}
+UPSTREAM_KEEPALIVE_IDLE = float(os.getenv("UPSTREAM_KEEPALIVE_IDLE", "90"))
+TELEGRAM_READ_TIMEOUT = float(os.getenv("TELEGRAM_READ_TIMEOUT", "10"))
+
+PROVIDER_ORDER = [
+    name.strip().lower()
+    for name in os.getenv("PROVIDER_ORDER", "openai,openrouter").split(",")
+    if name.strip()
+]
+PROVIDER_WINDOW = int(os.getenv("PROVIDER_WINDOW", "200"))
+PROVIDER_BREAKER_MIN_SAMPLES = int(os.getenv("PROVIDER_BREAKER_MIN_SAMPLES", "10"))
+PROVIDER_BREAKER_ERROR_RATE = float(os.getenv("PROVIDER_BREAKER_ERROR_RATE", "0.5"))
+PROVIDER_BREAKER_FAILURES = int(os.getenv("PROVIDER_BREAKER_FAILURES", "5"))
+PROVIDER_BREAKER_COOLDOWN = float(os.getenv("PROVIDER_BREAKER_COOLDOWN", "30"))
+PROVIDER_HEDGE_AFTER = os.getenv("PROVIDER_HEDGE_AFTER_MS", "0").strip().lower()
+PROVIDER_HEDGE_WORKERS = int(os.getenv("PROVIDER_HEDGE_WORKERS", "16"))
+OPENROUTER_MODEL_PREFIX = os.getenv("OPENROUTER_MODEL_PREFIX", "openai/")
+PROMPT_CACHE_HINTS = os.getenv("PROMPT_CACHE_HINTS", "true").lower() in {"1", "true", "yes"}
+# OpenRouter models that only cache the prompt prefix at an explicit ``cache_control`` breakpoint.
+PROMPT_CACHE_BREAKPOINT_MODELS = tuple(
+    prefix.strip()
+    for prefix in os.getenv("PROMPT_CACHE_BREAKPOINT_MODELS", "anthropic/,google/gemini").split(",")
+    if prefix.strip()
+)
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.25"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "4"))
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_RESERVE = float(os.getenv("RETRY_BUDGET_RESERVE", "10"))
+try:
+    RETRY_BUDGETS: dict[str, float] = {
+        str(k): float(v) for k, v in json.loads(os.getenv("RETRY_BUDGETS", "{}") or "{}").items()
+    }
+except (ValueError, AttributeError):
+    logger.warning("Ignoring malformed RETRY_BUDGETS")
+    RETRY_BUDGETS = {}
+# Defaults to one full attempt so the deadline never cuts a first read short of ``UPSTREAM_READ_TIMEOUT``.
+UPSTREAM_DEADLINE = float(os.getenv("UPSTREAM_DEADLINE", str(UPSTREAM_CONNECT_TIMEOUT + UPSTREAM_READ_TIMEOUT)))
+try:
+    MODEL_AUTO_TIERS: dict[str, list[str]] = {
+        str(tier): [str(model) for model in models]
+        for tier, models in json.loads(os.getenv("MODEL_AUTO_TIERS", "{}") or "{}").items()
+        if isinstance(models, list)
+    }
+except (ValueError, AttributeError):
+    logger.warning("Ignoring malformed MODEL_AUTO_TIERS")
+    MODEL_AUTO_TIERS = {}
+MODEL_AUTO_TARGET_P95_MS = float(os.getenv("MODEL_AUTO_TARGET_P95_MS", "8000"))
+MODEL_AUTO_TARGET_TTFB_P95_MS = float(os.getenv("MODEL_AUTO_TARGET_TTFB_P95_MS", "2000"))
+REQUEST_TIMEOUT_HEADER = "X-Request-Timeout"
+
+STATE_DIR = os.getenv("STATE_DIR", os.path.join(BASE_DIR, "var"))
+SHARED_STORE_PATH = os.getenv("SHARED_STORE_PATH", os.path.join(STATE_DIR, "shared_store.sqlite3"))
+REDIS_URL = os.getenv("REDIS_URL")
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in {"1", "true", "yes"}
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory").lower()
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2048"))
+RESPONSE_CACHE_TTL_CHAT = int(os.getenv("RESPONSE_CACHE_TTL_CHAT", "3600"))
+RESPONSE_CACHE_TTL_WEB = int(os.getenv("RESPONSE_CACHE_TTL_WEB", "300"))
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() in {"1", "true", "yes"}
+SEMANTIC_CACHE_MODEL = os.getenv("SEMANTIC_CACHE_MODEL", "auto")
+SEMANTIC_CACHE_DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+SEMANTIC_CACHE_DIM = int(os.getenv("SEMANTIC_CACHE_DIM", "512"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0"))  # 0: the embedder's own default
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH", os.path.join(STATE_DIR, "semantic_cache.json"))
+SEMANTIC_CACHE_SAVE_INTERVAL = float(os.getenv("SEMANTIC_CACHE_SAVE_INTERVAL", "60"))
+CITATION_STORE_ENABLED = os.getenv("CITATION_STORE_ENABLED", "true").lower() in {"1", "true", "yes"}
+CITATION_STORE_PATH = os.getenv("CITATION_STORE_PATH", os.path.join(STATE_DIR, "citations.db"))
+CITATION_QUEUE_MAX = int(os.getenv("CITATION_QUEUE_MAX", "10000"))
+CITATION_BATCH_MAX = int(os.getenv("CITATION_BATCH_MAX", "500"))
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", "50"))
+SEARCH_RANK_WINDOW = int(os.getenv("SEARCH_RANK_WINDOW", "2000"))
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() in {"1", "true", "yes"}
+
+HISTORY_COMPACTION = os.getenv("HISTORY_COMPACTION", "summarize").lower()
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "200"))
+try:
+    HISTORY_TOKEN_BUDGETS: dict[str, int] = {
+        str(k): int(v) for k, v in json.loads(os.getenv("HISTORY_TOKEN_BUDGETS", "{}") or "{}").items()
+    }
+except (ValueError, AttributeError):
+    logger.warning("Ignoring malformed HISTORY_TOKEN_BUDGETS")
+    HISTORY_TOKEN_BUDGETS = {}
+MESSAGE_TOKEN_OVERHEAD = 4
+
+CONVERSATION_BACKEND = os.getenv("CONVERSATION_BACKEND", "memory").lower()
+CONVERSATION_TTL = int(os.getenv("CONVERSATION_TTL", "86400"))
+CONVERSATION_MAX_TURNS = int(os.getenv("CONVERSATION_MAX_TURNS", "200"))
+CONVERSATION_MAX_BYTES = int(os.getenv("CONVERSATION_MAX_BYTES", str(256 * 1024)))
+CONVERSATION_MAX_SESSIONS = int(os.getenv("CONVERSATION_MAX_SESSIONS", "10000"))
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in {"1", "true", "yes"}
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_IP_PER_MINUTE = float(os.getenv("RATE_LIMIT_IP_PER_MINUTE", "30"))
+RATE_LIMIT_IP_BURST = float(os.getenv("RATE_LIMIT_IP_BURST", "10"))
+RATE_LIMIT_SESSION_PER_MINUTE = float(os.getenv("RATE_LIMIT_SESSION_PER_MINUTE", "20"))
+RATE_LIMIT_SESSION_BURST = float(os.getenv("RATE_LIMIT_SESSION_BURST", "5"))
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "50000"))
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "32"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5"))
+SESSION_ID_HEADER = "X-Session-Id"
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "200"))
+BATCH_CONCURRENCY = max(1, int(os.getenv("BATCH_CONCURRENCY", "4")))
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in {"1", "true", "yes"}
+METRICS_SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "true").lower() in {"1", "true", "yes"}
+METRICS_MAX_LABEL_VALUES = int(os.getenv("METRICS_MAX_LABEL_VALUES", "20"))
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() in {"1", "true", "yes"}
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "5"))
+QUICK_QUESTIONS_MAX_AGE = int(os.getenv("QUICK_QUESTIONS_MAX_AGE", "300"))
+QUICK_QUESTIONS_PATH = os.getenv("QUICK_QUESTIONS_PATH", os.path.join(BASE_DIR, "quick_questions.json"))
+QUICK_ANSWERS_ENABLED = os.getenv("QUICK_ANSWERS_ENABLED", "false").lower() in {"1", "true", "yes"}
+QUICK_ANSWERS_INTERVAL = max(1.0, float(os.getenv("QUICK_ANSWERS_INTERVAL", "3600")))
+QUICK_ANSWERS_JITTER = min(0.9, max(0.0, float(os.getenv("QUICK_ANSWERS_JITTER", "0.1"))))
+QUICK_ANSWERS_CONCURRENCY = max(1, int(os.getenv("QUICK_ANSWERS_CONCURRENCY", "2")))
+QUICK_ANSWERS_MODES = [m.strip().lower() for m in os.getenv("QUICK_ANSWERS_MODES", "chat,web").split(",") if m.strip()]
+QUICK_ANSWERS_PERSONAS = [p.strip().lower() for p in os.getenv("QUICK_ANSWERS_PERSONAS", "").split(",") if p.strip()]
+QUICK_ANSWERS_MAX_AGE = float(os.getenv("QUICK_ANSWERS_MAX_AGE", str(3 * QUICK_ANSWERS_INTERVAL)))
+
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 FEEDBACK_ENABLED = (
@@ -60,8 +237,17 @@ FEEDBACK_ENABLED = (
     and bool(TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID)
 )
 FEEDBACK_DUP_TTL = int(os.getenv("FEEDBACK_DUPLICATE_TTL", "180"))
+FEEDBACK_DEDUP_BACKEND = os.getenv("FEEDBACK_DEDUP_BACKEND", "memory").lower()
+FEEDBACK_DEDUP_MAX_ENTRIES = int(os.getenv("FEEDBACK_DEDUP_MAX_ENTRIES", "10000"))
 FEEDBACK_COOKIE_SECURE = os.getenv("FEEDBACK_COOKIE_SECURE", "false").lower() in {"1", "true", "yes"}
-recent_feedback_cache: dict[str, float] = {}
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
+FEEDBACK_QUEUE_ENABLED = os.getenv("FEEDBACK_QUEUE_ENABLED", "true").lower() in {"1", "true", "yes"}
+FEEDBACK_QUEUE_PATH = os.getenv("FEEDBACK_QUEUE_PATH", os.path.join(STATE_DIR, "feedback_queue.db"))
+FEEDBACK_BATCH_MAX = int(os.getenv("FEEDBACK_BATCH_MAX", "10"))
+FEEDBACK_MAX_ATTEMPTS = int(os.getenv("FEEDBACK_MAX_ATTEMPTS", "12"))
+FEEDBACK_RETRY_MAX_DELAY = float(os.getenv("FEEDBACK_RETRY_MAX_DELAY", "600"))
+TELEGRAM_MIN_INTERVAL = float(os.getenv("TELEGRAM_MIN_INTERVAL", "1.0"))
+TELEGRAM_MESSAGE_LIMIT = 4096
 
 if not FEEDBACK_ENABLED:
     logger.info("Telegram feedback disabled (provide TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID to enable)")
@@ -87,30 +273,95 @@ QUICK_QUESTIONS: list[dict[str, str]] = [
     },
 ]
 
-MONTH_NAME_TO_INDEX = {
-    "january": 1,
-    "february": 2,
-    "march": 3,
-    "april": 4,
-    "may": 5,
-    "june": 6,
-    "july": 7,
-    "august": 8,
-    "september": 9,
-    "october": 10,
-    "november": 11,
-    "december": 12,
-}
+MONTH_NAMES = [
+    "january",
+    "february",
+    "march",
+    "april",
+    "may",
+    "june",
+    "july",
+    "august",
+    "september",
+    "october",
+    "november",
+    "december",
+]
+RELATIVE_DATE_PHRASES = [
+    "this year",
+    "last year",
+    "next year",
+    "this month",
+    "last month",
+    "this week",
+    "last week",
+    "yesterday",
+]
+
+
+def parse_knowledge_cutoff(value: str) -> tuple[int, int]:
+    """``YYYY-MM`` from the environment, falling back to October 2023."""
+    try:
+        year_text, month_text = value.strip().split("-", 1)
+        year, month = int(year_text), int(month_text)
+        if 1900 <= year <= 2099 and 1 <= month <= 12:
+            return year, month
+    except ValueError:
+        pass
+    logger.warning("Ignoring malformed KNOWLEDGE_CUTOFF %r", value)
+    return 2023, 10
 
-POST_CUTOFF_MONTHS_2023 = {11, 12}
-YEAR_PATTERN = re.compile(r"\b(20\d{2})\b")
-MONTH_YEAR_PATTERN = re.compile(r"(january|february|march|april|may|june|july|august|september|october|november|december)\s+(20\d{2})", re.IGNORECASE)
-CUTOFF_PHRASES = [
-    "after october 2023",
-    "beyond october 2023",
-    "since october 2023",
-    "post october 2023",
+
+KNOWLEDGE_CUTOFF = parse_knowledge_cutoff(os.getenv("KNOWLEDGE_CUTOFF", "2023-10"))
+KNOWLEDGE_CUTOFF_LABEL = f"{MONTH_NAMES[KNOWLEDGE_CUTOFF[1] - 1].title()} {KNOWLEDGE_CUTOFF[0]}"
+CUTOFF_EXTRA_PHRASES = [
+    phrase.strip().lower() for phrase in os.getenv("CUTOFF_EXTRA_PHRASES", "").split(",") if phrase.strip()
 ]
+CUTOFF_RELATIVE_DATES = os.getenv("CUTOFF_RELATIVE_DATES", "false").lower() in {"1", "true", "yes"}
+CUTOFF_HISTORY_TURNS = int(os.getenv("CUTOFF_HISTORY_TURNS", "0"))
+
+
+def years_after_pattern(year: int) -> str:
+    """Regex alternation matching every four-digit year after ``year`` up to 2099."""
+    parts = []
+    if year % 10 != 9:
+        parts.append(f"{year // 10}[{year % 10 + 1}-9]")
+    decade = year // 10 + 1
+    if decade % 10 and decade < 210:
+        parts.append(f"{decade // 10}[{decade % 10}-9]\\d")
+    century = decade // 10 + (1 if decade % 10 else 0)
+    if century < 21:
+        parts.append(f"{century}\\d\\d")
+        if century < 20:
+            parts.append("20\\d\\d")
+    return "|".join(parts)
+
+
+def build_cutoff_pattern(cutoff: tuple[int, int], extra_phrases: list[str], relative: bool) -> re.Pattern:
+    """Compile every post-cutoff rule into one regex that only matches triggering text.
+
+    Years after the cutoff, months after the cutoff within its year, "after
+    <cutoff month>" style phrases, configured extras and (optionally)
+    relative dates are alternatives of a single pattern, so a query is
+    decided by one ``search`` that stops at the first hit, with no
+    lowercasing copy or integer parsing.
+    """
+    year, month = cutoff
+    cutoff_name = MONTH_NAMES[month - 1]
+    alternatives = [f"(?:after|beyond|since|post)\\s+{cutoff_name}\\s+{year}"]
+    alternatives += [re.escape(phrase) for phrase in extra_phrases]
+    if relative:
+        alternatives += [phrase.replace(" ", "\\s+") for phrase in RELATIVE_DATE_PHRASES]
+    later_months = MONTH_NAMES[month:]
+    if later_months:
+        alternatives.append(f"(?:{'|'.join(later_months)})\\s+{year}")
+    years = years_after_pattern(year)
+    if years:
+        alternatives.append(years)
+    return re.compile(r"\b(?:" + "|".join(alternatives) + r")\b", re.IGNORECASE)
+
+
+CUTOFF_PATTERN = build_cutoff_pattern(KNOWLEDGE_CUTOFF, CUTOFF_EXTRA_PHRASES, CUTOFF_RELATIVE_DATES)
 
 
 def cutoff_message(personality_key: str) -> str:
@@ -125,29 +376,20 @@ def cutoff_message(personality_key: str) -> str:
     )
 
 
-def references_post_cutoff(text: str | None) -> bool:
-    if not text:
-        return False
-
-    lower = text.lower()
-    if any(phrase in lower for phrase in CUTOFF_PHRASES):
+def references_post_cutoff(text: str | None, history: list | None = None) -> bool:
+    """True when ``text`` (or, with ``CUTOFF_HISTORY_TURNS``, recent user turns) asks about post-cutoff events."""
+    if text and CUTOFF_PATTERN.search(text):
         return True
+    if CUTOFF_HISTORY_TURNS <= 0 or not isinstance(history, list):
+        return False
+    recent = [
+        turn["content"]
+        for turn in history[-2 * CUTOFF_HISTORY_TURNS:]
+        if isinstance(turn, dict) and turn.get("role") == "user" and isinstance(turn.get("content"), str)
+    ]
+    return bool(recent) and CUTOFF_PATTERN.search("\n".join(recent[-CUTOFF_HISTORY_TURNS:])) is not None
 
-    for month_name, year_str in MONTH_YEAR_PATTERN.findall(text):
-        year = int(year_str)
-        month = MONTH_NAME_TO_INDEX.get(month_name.lower())
-        if year > 2023 or (year == 2023 and month in POST_CUTOFF_MONTHS_2023):
-            return True
-
-    for year_str in YEAR_PATTERN.findall(text):
-        try:
-            year = int(year_str)
-        except ValueError:
-            continue
-        if year >= 2024:
-            return True
 
-    return False
 PERSONALITY_PIDGIN_PATH = os.getenv(
     "PERSONALITY_PIDGIN_PATH" ,
     os.getenv("SYSTEM_PROMPT_PATH", os.path.join(BASE_DIR, "sasu_jnr_prompt.md")),
@@ -156,6 +398,8 @@ PERSONALITY_FLUENT_PATH = os.getenv(
     "PERSONALITY_FLUENT_PATH",
     os.path.join(BASE_DIR, "fluent_persona_prompt.md"),
 )
+PERSONAS_DIR = os.getenv("PERSONAS_DIR", os.path.join(BASE_DIR, "personas"))
+PERSONA_RELOAD_INTERVAL = float(os.getenv("PERSONA_RELOAD_INTERVAL", "5"))
 DEFAULT_PERSONALITY = os.getenv("DEFAULT_PERSONALITY", "pidgin").lower()
 
 PIDGIN_PROMPT_FALLBACK = (
@@ -173,509 +417,4904 @@ FLUENT_PROMPT_FALLBACK = (
 )
 
 
-def load_system_prompt(path: str | None, fallback: str) -> str:
-    if not path:
-        return fallback
+PERSONA_KEY_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,31}$")
+PERSONA_FILE_SUFFIXES = (".md", ".txt")
+FRONT_MATTER_RE = re.compile(r"\A---[ \t]*\r?\n(.*?)\r?\n---[ \t]*(?:\r?\n|\Z)", re.DOTALL)
 
+
+def prompt_candidates(path: str) -> list[str]:
     candidates: list[str] = []
     if not os.path.isabs(path):
         candidates.append(os.path.join(BASE_DIR, path))
         candidates.append(os.path.join(os.path.dirname(BASE_DIR), path))
     candidates.append(path)
+    return candidates
+
+
+def parse_persona_file(text: str) -> tuple[dict[str, str], str]:
+    """Split optional ``---`` front matter (``label: ...`` lines) from the prompt body."""
+    meta: dict[str, str] = {}
+    match = FRONT_MATTER_RE.match(text)
+    if match:
+        for line in match.group(1).splitlines():
+            name, sep, value = line.partition(":")
+            if sep and name.strip():
+                meta[name.strip().lower()] = value.strip()
+        text = text[match.end():]
+    return meta, text.strip()
+
+
+class Persona:
+    """A system prompt plus the hash and token count requests need, computed once per file version."""
+
+    def __init__(self, key: str, prompt: str, *, label: str | None = None, description: str = "", source: str | None = None):
+        self.key = key
+        self.prompt = prompt
+        self.label = label or key.replace("_", " ").replace("-", " ").title()
+        self.description = description
+        self.source = source
+        self.hash = prompt_hash(prompt)
+        self.tokens = count_tokens(prompt, CHAT_DEFAULT_MODEL)
 
-    for candidate in candidates:
+    def summary(self) -> dict:
+        return {
+            "key": self.key,
+            "label": self.label,
+            "description": self.description,
+            "hash": self.hash,
+            "tokens": self.tokens,
+        }
+
+
+class PersonaRegistry:
+    """Personas from the built-in prompt paths plus every ``*.md``/``*.txt`` file in ``directory``.
+
+    A file's stem is its key (a directory file may override a built-in), and
+    optional front matter supplies ``label`` and ``description``. Lookups
+    never wait on disk: at most once per ``interval`` seconds a lookup starts
+    a background rescan, which stats every source, re-reads only files whose
+    mtime or size changed and swaps in a new mapping. A file that fails to
+    read keeps its last good version; a missing built-in falls back to its
+    bundled prompt.
+    """
+
+    def __init__(self, builtins: dict[str, tuple[str, str, str]], directory: str | None, default: str, interval: float):
+        self.builtins = builtins
+        self.directory = directory
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._checked = time.monotonic()
+        self._stamps: dict[str, tuple | None] = {}
+        self._personas: dict[str, Persona] = {}
+        self.reloads = 0
+        self._scan()
+        if default not in self._personas:
+            logger.warning("Unknown DEFAULT_PERSONALITY %s, falling back to pidgin", default)
+            default = "pidgin"
+        self.default = default
+
+    def _sources(self) -> dict[str, str | None]:
+        sources: dict[str, str | None] = {}
+        for key, (path, _fallback, _label) in self.builtins.items():
+            sources[key] = next((c for c in prompt_candidates(path) if os.path.isfile(c)), None) if path else None
+        if self.directory and os.path.isdir(self.directory):
+            for entry in sorted(os.scandir(self.directory), key=lambda e: e.name):
+                stem, suffix = os.path.splitext(entry.name)
+                if suffix.lower() in PERSONA_FILE_SUFFIXES and PERSONA_KEY_RE.match(stem.lower()) and entry.is_file():
+                    sources[stem.lower()] = entry.path
+        return sources
+
+    def _read(self, key: str, path: str, size: int) -> Persona | None:
         try:
-            with open(candidate, "r", encoding="utf-8") as handle:
-                contents = handle.read().strip()
-                if contents:
-                    return contents
-        except OSError:
-            continue
+            with open(path, "rb") as handle:
+                data = handle.read()
+            if len(data) != size:  # caught mid-write; the next rescan picks up the final version
+                return None
+            meta, prompt = parse_persona_file(data.decode("utf-8"))
+        except (OSError, UnicodeDecodeError) as exc:
+            logger.warning("Unable to read persona file %s: %s", path, exc)
+            return None
+        if not prompt:
+            return None
+        builtin = self.builtins.get(key)
+        label = meta.get("label") or (builtin[2] if builtin else None)
+        return Persona(key, prompt, label=label, description=meta.get("description", ""), source=path)
 
-    logger.info("Unable to read system prompt file %s (candidates: %s)", path, candidates)
-    return fallback
+    def _scan(self) -> None:
+        current = self._personas
+        personas: dict[str, Persona] = {}
+        stamps: dict[str, tuple | None] = {}
+        changed = False
+        for key, path in self._sources().items():
+            try:
+                info = os.stat(path) if path else None
+            except OSError:
+                info = None
+            stamp = (path, info.st_mtime_ns, info.st_size) if info else None
+            previous = current.get(key)
+            if previous is not None and key in self._stamps and self._stamps[key] == stamp:
+                personas[key] = previous
+                stamps[key] = stamp
+                continue
+            persona = self._read(key, path, info.st_size) if info else None
+            if persona is not None:
+                stamps[key] = stamp
+            elif previous is not None and info is not None:
+                persona = previous
+            elif key in self.builtins:
+                _path, fallback, label = self.builtins[key]
+                if info is None:
+                    stamps[key] = None
+                    logger.info("Persona %s has no prompt file, using the bundled prompt", key)
+                persona = Persona(key, fallback, label=label)
+            if persona is not None:
+                personas[key] = persona
+                changed = changed or persona is not previous
+        changed = changed or personas.keys() != current.keys()
+        self._stamps = stamps
+        self._personas = personas
+        if changed and current:
+            self.reloads += 1
+            logger.info("Reloaded personas: %s", ", ".join(personas))
 
+    def _rescan(self) -> None:
+        try:
+            self._scan()
+        except Exception:
+            logger.exception("Persona rescan failed")
+        finally:
+            self._lock.release()
 
-PERSONALITY_PROMPTS = {
-    "pidgin": load_system_prompt(PERSONALITY_PIDGIN_PATH, PIDGIN_PROMPT_FALLBACK),
-    "fluent": load_system_prompt(PERSONALITY_FLUENT_PATH, FLUENT_PROMPT_FALLBACK),
-}
+    def _maybe_reload(self) -> None:
+        if self.interval <= 0:
+            return
+        now = time.monotonic()
+        if now - self._checked < self.interval or not self._lock.acquire(blocking=False):
+            return
+        self._checked = now
+        threading.Thread(target=self._rescan, name="persona-reload", daemon=True).start()
 
-if DEFAULT_PERSONALITY not in PERSONALITY_PROMPTS:
-    logger.warning("Unknown DEFAULT_PERSONALITY %s, falling back to pidgin", DEFAULT_PERSONALITY)
-    DEFAULT_PERSONALITY = "pidgin"
+    def get(self, key: str) -> Persona | None:
+        self._maybe_reload()
+        return self._personas.get(key)
 
+    def resolve(self, name: str | None) -> Persona:
+        """The requested persona, else the default one."""
+        self._maybe_reload()
+        personas = self._personas
+        key = (name or self.default or "pidgin").strip().lower()
+        return personas.get(key) or personas.get(self.default) or next(iter(personas.values()))
 
-def resolve_personality(name: str | None) -> tuple[str, str]:
-    key = (name or DEFAULT_PERSONALITY or "pidgin").strip().lower()
-    prompt = PERSONALITY_PROMPTS.get(key)
-    if not prompt:
-        key = DEFAULT_PERSONALITY if DEFAULT_PERSONALITY in PERSONALITY_PROMPTS else "pidgin"
-        prompt = PERSONALITY_PROMPTS.get(key, PIDGIN_PROMPT_FALLBACK)
-    return key, prompt
+    def snapshot(self) -> dict:
+        self._maybe_reload()
+        personas = list(self._personas.values())
+        version = hashlib.sha256("".join(p.key + p.hash for p in personas).encode("utf-8")).hexdigest()[:16]
+        return {
+            "default": self.default,
+            "version": version,
+            "reloads": self.reloads,
+            "personas": [p.summary() for p in personas],
+        }
 
 
 INJECT_SYSTEM_PROMPT = os.getenv("INJECT_SYSTEM_PROMPT", "true").lower() in {"1", "true", "yes"}
 
 
-def post_chat_completion(payload: dict):
-    """Send chat completion request to OpenAI or OpenRouter."""
-    headers = {"Content-Type": "application/json"}
-    if OPENAI_API_KEY:
-        url = OPENAI_API_URL
-        headers["Authorization"] = f"Bearer {OPENAI_API_KEY}"
-    elif OPENROUTER_API_KEY:
-        url = OPENROUTER_API_URL
-        headers["Authorization"] = f"Bearer {OPENROUTER_API_KEY}"
-        headers["HTTP-Referer"] = OPENROUTER_SITE_URL
-        headers["X-Title"] = OPENROUTER_APP_NAME
-    else:
-        raise RuntimeError("missing_api_key")
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
 
-    resp = requests.post(
-        url,
-        headers=headers,
-        data=json.dumps(payload),
-        timeout=60,
-    )
-    resp.raise_for_status()
-    return resp
 
+def metric_labels(names: tuple[str, ...], values: tuple) -> str:
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return ",".join(f'{name}="{value}"' for name, value in zip(names, escaped))
 
-def perplexity_search(messages: list[dict[str, str]]):
-    if not PPLX_API_KEY:
-        raise RuntimeError("missing_perplexity_key")
 
-    headers = {
-        "Authorization": f"Bearer {PPLX_API_KEY}",
-        "Content-Type": "application/json",
-    }
-    payload = {
-        "model": PPLX_MODEL,
-        "messages": messages,
-        "temperature": 0.65,
-        "top_p": 0.9,
-    }
-    resp = requests.post(
-        PPLX_API_URL,
-        headers=headers,
-        data=json.dumps(payload),
-        timeout=60,
-    )
-    resp.raise_for_status()
-    return resp.json()
+class Histogram:
+    """Prometheus histogram; each label-value tuple keeps per-bucket counts plus sum and count."""
 
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...], buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series: dict[tuple, list] = {}
 
-def normalize_citations(items):
-    normalized = []
-    if not items:
-        return normalized
-    for idx, item in enumerate(items, start=1):
-        if isinstance(item, str):
-            url = item
-            domain = urlparse(url).netloc if url else ""
-            normalized.append({
-                "title": domain or f"Source {idx}",
-                "url": url,
-                "domain": domain,
-                "snippet": "",
-            })
-            continue
+    def observe(self, labels: tuple, value: float) -> None:
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # One counter per bucket, one for +Inf, then the running sum.
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[slot] += 1
+            series[-1] += value
 
-        if not isinstance(item, dict):
-            continue
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(values)) for labels, values in self._series.items())
+        for labels, values in series:
+            base = metric_labels(self.labelnames, labels)
+            prefix = base + "," if base else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            cumulative += values[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{base}}} {values[-1]:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {cumulative}")
+        return lines
 
-        url = item.get("url") or item.get("source") or item.get("source_url")
-        domain = item.get("domain")
-        if not domain and url:
-            domain = urlparse(url).netloc
-
-        title = item.get("title") or item.get("name") or item.get("id")
-        if title and isinstance(title, str) and title.lower().startswith("source #") and domain:
-            title = domain
-        if not title:
-            title = domain or f"Source {idx}"
-
-        snippet = (
-            item.get("snippet")
-            or item.get("description")
-            or item.get("text")
-            or ""
-        )
 
-        normalized.append({
-            "title": title,
-            "url": url,
-            "domain": domain or "",
-            "snippet": snippet,
-        })
-    return normalized
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values: dict[tuple, float] = {}
 
+    def inc(self, labels: tuple, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
 
-INLINE_CITATION_RE = re.compile(r"(\s*\[\s*(?:\d+|[a-z]{1,3}\d*|source\s*#?\d+)\s*\])+", re.IGNORECASE)
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        lines.extend(f"{self.name}{{{metric_labels(self.labelnames, labels)}}} {value:g}" for labels, value in values)
+        return lines
 
 
-def strip_inline_citations(text: str | None) -> str:
-    if not text:
-        return ""
-    cleaned = INLINE_CITATION_RE.sub("", text)
-    cleaned = re.sub(r"\s{2,}", " ", cleaned)
-    cleaned = re.sub(r"\s*\n\s*", lambda m: "\n", cleaned)
-    return cleaned.strip()
+class RequestMetrics:
+    """Request, phase and token metrics for ``/metrics``.
 
+    Label values partly come from clients (model names), so each label keeps
+    at most ``max_label_values`` distinct values and reports the rest as
+    ``other``.
+    """
 
-def generate_feedback_csrf() -> str:
-    return feedback_serializer.dumps({"nonce": secrets.token_hex(8)})
+    PHASE_LABELS = ("phase", "provider", "model", "mode", "persona")
 
+    def __init__(self, enabled: bool, max_label_values: int):
+        self.enabled = enabled
+        self.max_label_values = max(1, max_label_values)
+        self._seen: dict[str, set[str]] = {}
+        self._lock = threading.Lock()
+        self.requests = Histogram(
+            "sourcescout_request_duration_seconds",
+            "Time from request start to the last byte of the response.",
+            ("route", "method", "status"),
+        )
+        self.phases = Histogram(
+            "sourcescout_request_phase_seconds",
+            "Time spent in each phase of a request.",
+            self.PHASE_LABELS,
+        )
+        self.tokens = Counter(
+            "sourcescout_upstream_tokens_total",
+            "Tokens reported in upstream usage fields.",
+            ("provider", "model", "kind"),
+        )
+        self.model_routes = Counter(
+            "sourcescout_model_routes_total",
+            'Models picked for "model": "auto" requests.',
+            ("tier", "model", "reason"),
+        )
+        self.cancellations = Counter(
+            "sourcescout_cancelled_requests_total",
+            "Upstream generations stopped early because the client left or the deadline passed.",
+            ("reason", "source"),
+        )
+        self.tokens_saved = Counter(
+            "sourcescout_cancelled_tokens_saved_total",
+            "Estimated completion tokens not generated thanks to cancellations.",
+            ("source",),
+        )
 
-def validate_feedback_csrf(token: str | None, cookie_token: str | None) -> bool:
-    if not token or not cookie_token or token != cookie_token:
-        return False
-    try:
-        feedback_serializer.loads(token, max_age=3600)
-        return True
-    except (BadSignature, SignatureExpired):
-        return False
+    def label(self, name: str, value) -> str:
+        value = str(value) if value else "none"
+        with self._lock:
+            seen = self._seen.setdefault(name, set())
+            if value in seen:
+                return value
+            if len(seen) >= self.max_label_values:
+                return "other"
+            seen.add(value)
+            return value
 
+    def observe(self, timings: "RequestTimings", status: int | None) -> None:
+        labels = tuple(self.label(name, timings.labels.get(name)) for name in self.PHASE_LABELS[1:])
+        for phase, seconds in list(timings.phases.items()):
+            self.phases.observe((phase,) + labels, seconds)
+        if timings.route is not None:
+            self.requests.observe((timings.route, timings.method, str(status or 0)), timings.elapsed())
 
-def is_duplicate_feedback(client_ip: str, message: str) -> bool:
-    if not message:
-        return False
+    def count_tokens(self, usage: dict) -> None:
+        timings = current_timings.get()
+        labels = timings.labels if timings is not None else {}
+        provider = self.label("provider", labels.get("provider"))
+        model = self.label("model", labels.get("model"))
+        for kind in ("prompt", "completion", "cached", "cache_write"):
+            amount = usage.get(f"{kind}_tokens") or 0
+            if amount:
+                self.tokens.inc((provider, model, kind), amount)
 
-    now = time.time()
-    expired = [key for key, ts in recent_feedback_cache.items() if now - ts > FEEDBACK_DUP_TTL]
-    for key in expired:
-        recent_feedback_cache.pop(key, None)
+    def render(self) -> str:
+        lines = self.requests.render() + self.phases.render() + self.tokens.render() + self.model_routes.render()
+        lines += self.cancellations.render() + self.tokens_saved.render()
+        return "\n".join(lines) + "\n"
 
-    fingerprint = hashlib.sha256(f"{client_ip}|{message}".encode("utf-8")).hexdigest()
-    if fingerprint in recent_feedback_cache:
-        return True
 
-    recent_feedback_cache[fingerprint] = now
-    return False
+metrics = RequestMetrics(METRICS_ENABLED, METRICS_MAX_LABEL_VALUES)
 
 
-def send_feedback_to_telegram(name: str, email: str, message: str) -> None:
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        raise RuntimeError("missing_telegram_config")
+class RequestTimings:
+    """Phase durations and metric labels for one request.
 
-    payload = {
-        "chat_id": TELEGRAM_CHAT_ID.strip(),
-        "text": (
-            "\U0001F4E9 New Feedback Submission:\n"
-            f"\U0001F464 Name: {name or 'Anonymous'}\n"
-            f"\U0001F4E7 Email: {email or '(not provided)'}\n"
-            f"\U0001F4AC Feedback: {message or '(empty message)'}"
-        ),
-    }
+    The active instance lives in ``current_timings``, so the plan builder,
+    upstream clients and citation processing report their phases without
+    being handed it. Phases: ``parse``, ``cutoff``, ``build``,
+    ``upstream_connect`` (new sockets only), ``upstream_ttfb``, ``upstream``
+    (first attempt to last byte) and ``postprocess``.
+    """
 
-    api_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    resp = requests.post(api_url, data=payload, timeout=10)
-    resp.raise_for_status()
+    def __init__(self, route: str | None = None, method: str = "POST"):
+        self.route = route
+        self.method = method
+        self.started = time.perf_counter()
+        self.phases: dict[str, float] = {}
+        self.labels: dict[str, str] = {}
+        self._upstream_started: float | None = None
+        self._finished = False
+        self.status: int | None = None
 
-@app.get("/health")
-def health():
-    return {"status": "ok"}
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
 
-# Serve frontend files for convenience during development
-@app.get("/")
-def index_html():
-    return send_from_directory(FRONTEND_DIR, "index.html")
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
 
-@app.get("/index.html")
-def index_html_alias():
-    return send_from_directory(FRONTEND_DIR, "index.html")
+    def upstream_attempt(self, provider: str) -> None:
+        self.labels["provider"] = provider
+        if self._upstream_started is None:
+            self._upstream_started = time.perf_counter()
 
-@app.get("/styles.css")
-def styles_css():
-    return send_from_directory(FRONTEND_DIR, "styles.css")
+    def upstream_done(self) -> None:
+        if self._upstream_started is not None and "upstream" not in self.phases:
+            self.phases["upstream"] = time.perf_counter() - self._upstream_started
 
-@app.get("/app.js")
-def app_js():
-    return send_from_directory(FRONTEND_DIR, "app.js")
+    def server_timing(self) -> str:
+        parts = [f"{phase};dur={seconds * 1000:.2f}" for phase, seconds in list(self.phases.items())]
+        parts.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ", ".join(parts)
 
+    def finish(self, status: int | None = None) -> None:
+        if self._finished:
+            return
+        self._finished = True
+        metrics.observe(self, status)
 
-@app.get("/api/feedback/csrf")
-def feedback_csrf():
-    if not FEEDBACK_ENABLED:
-        resp = make_response(jsonify({"enabled": False}))
-        resp.delete_cookie("feedback_csrf")
-        return resp, 503
 
-    token = generate_feedback_csrf()
-    resp = make_response(jsonify({"token": token, "enabled": True}))
-    resp.set_cookie(
-        "feedback_csrf",
-        token,
-        max_age=3600,
-        secure=FEEDBACK_COOKIE_SECURE,
-        httponly=True,
-        samesite="Lax",
-    )
-    return resp
+current_timings: contextvars.ContextVar[RequestTimings | None] = contextvars.ContextVar("current_timings", default=None)
 
 
-@app.post("/api/feedback")
-def submit_feedback():
-    if not FEEDBACK_ENABLED:
-        return jsonify({"error": "Feedback submission is currently disabled."}), 503
+@contextmanager
+def timed(phase: str):
+    """Add the block's duration to ``phase`` of the current request, if one is being timed."""
+    timings = current_timings.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings.add(phase, time.perf_counter() - started)
 
-    data = request.get_json(silent=True) or {}
-    name = (data.get("name") or "").strip()
-    email = (data.get("email") or "").strip()
-    message = (data.get("message") or "").strip()
-    csrf_token = data.get("csrf_token")
-    cookie_token = request.cookies.get("feedback_csrf")
 
-    if not validate_feedback_csrf(csrf_token, cookie_token):
-        return jsonify({"error": "Invalid or missing CSRF token."}), 400
+def note_request_labels(**labels) -> None:
+    timings = current_timings.get()
+    if timings is not None:
+        timings.labels.update(labels)
 
-    if len(name) < 2:
-        return jsonify({"error": "Please provide your name (at least 2 characters)."}), 400
 
-    if email and ("@" not in email or email.count("@") != 1 or email.startswith("@")):
-        return jsonify({"error": "Please provide a valid email address or leave it blank."}), 400
+def note_connect_time(seconds: float) -> None:
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add("upstream_connect", seconds)
 
-    if len(message) < 10:
-        return jsonify({"error": "Feedback message is too short (minimum 10 characters)."}), 400
 
-    client_ip = request.headers.get("X-Forwarded-For", request.remote_addr or "").split(",")[0].strip()
-    if is_duplicate_feedback(client_ip, message):
-        return jsonify({"error": "Duplicate feedback detected. Please wait before resubmitting."}), 409
+class _TrackedHTTPConnection(HTTPConnection):
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        upstream_client.note_connect(self.host, time.perf_counter() - started)
+        note_connect_time(time.perf_counter() - started)
 
-    try:
-        send_feedback_to_telegram(name, email, message)
-    except requests.HTTPError as exc:
-        err_resp = getattr(exc, "response", None)
-        app.logger.error("Telegram HTTPError: %s", getattr(err_resp, "text", str(exc)))
-        return jsonify({"error": "Failed to deliver feedback to Telegram."}), 502
-    except requests.RequestException as exc:
-        app.logger.error("Telegram RequestException: %s", exc)
-        return jsonify({"error": "Network error while sending feedback."}), 502
-    except RuntimeError as exc:
-        if str(exc) == "missing_telegram_config":
-            return jsonify({"error": "Server missing Telegram configuration."}), 500
-        raise
 
-    refreshed_token = generate_feedback_csrf()
-    resp = make_response(jsonify({"ok": True, "message": "Feedback delivered", "csrf_token": refreshed_token}))
-    resp.set_cookie(
-        "feedback_csrf",
-        refreshed_token,
-        max_age=3600,
-        secure=FEEDBACK_COOKIE_SECURE,
-        httponly=True,
-        samesite="Lax",
-    )
-    return resp
+class _TrackedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        upstream_client.note_connect(self.host, time.perf_counter() - started)
+        note_connect_time(time.perf_counter() - started)
 
 
-@app.post("/api/ask")
-def ask():
-    data = request.get_json(silent=True) or {}
-    query = data.get("query")
-    history = data.get("history", [])  # [{role, content}]
-    model = data.get("model") or CHAT_DEFAULT_MODEL
-    requested_personality = data.get("personality")
-    personality_key, system_prompt = resolve_personality(requested_personality)
-    mode = (data.get("mode") or "chat").strip().lower()
-    is_web_mode = mode in {"web", "web-search", "search", "perplexity"}
+class _TrackedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TrackedHTTPConnection
 
-    if not is_web_mode and not OPENAI_API_KEY and not OPENROUTER_API_KEY:
-        return jsonify({"error": "Server missing OPENAI_API_KEY or OPENROUTER_API_KEY"}), 500
 
-    if not query or not isinstance(query, str):
-        return jsonify({"error": "Query is required as a string"}), 400
+class _TrackedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TrackedHTTPSConnection
 
-    if not is_web_mode and references_post_cutoff(query):
-        message = cutoff_message(personality_key)
-        payload = {
-            "answer": message,
-            "citations": [],
-            "personality": personality_key,
-            "knowledge_cutoff": "October 2023",
-        }
-        return jsonify(payload)
 
-    messages = []
-    if INJECT_SYSTEM_PROMPT and system_prompt:
-        messages.append({"role": "system", "content": system_prompt})
+class _UpstreamAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools report every freshly opened socket."""
 
-    messages.extend(
-        m for m in history if isinstance(m, dict) and {"role", "content"} <= set(m.keys())
-    )
-    messages.append({"role": "user", "content": query})
+    def __init__(self, *args, keepalive: bool = True, **kwargs):
+        self._keepalive = keepalive
+        super().__init__(*args, **kwargs)
 
-    if is_web_mode:
-        try:
-            out = perplexity_search(messages)
-            choice0 = (out.get("choices", []) or [None])[0] or {}
-            message = choice0.get("message") or {}
-            answer_text = message.get("content") or out.get("answer") or ""
-            citations = (
-                out.get("citations")
-                or choice0.get("citations")
-                or message.get("citations")
-                or out.get("sources")
-                or []
+    def init_poolmanager(self, *args, **kwargs):
+        if self._keepalive:
+            kwargs.setdefault(
+                "socket_options",
+                HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)],
             )
-            payload = {
-                "answer": strip_inline_citations(answer_text),
-                "citations": normalize_citations(citations),
-                "personality": personality_key,
-                "mode": "web",
-            }
-            if INCLUDE_RAW:
-                payload["raw"] = out
-            return jsonify(payload)
-        except RuntimeError as exc:
-            if str(exc) != "missing_perplexity_key":
-                app.logger.error("Perplexity runtime error: %s", exc)
-            else:
-                app.logger.error("Perplexity key missing when web search requested")
-        except requests.HTTPError as exc:
-            err_resp = getattr(exc, "response", None)
-            try:
-                err_json = err_resp.json() if err_resp is not None else {"message": str(exc)}
-            except Exception:
-                err_json = {"message": str(exc), "text": getattr(err_resp, "text", "")}
-            status_code = getattr(err_resp, "status_code", 502)
-            app.logger.error("Perplexity HTTPError %s: %s", status_code, err_json)
-        except requests.RequestException as exc:
-            app.logger.error("Perplexity RequestException: %s", exc)
-
-        payload = {
-            "answer": WEB_SEARCH_DISABLED_MESSAGE,
-            "citations": [],
-            "personality": personality_key,
-            "mode": "web",
-            "web_search_disabled": True,
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TrackedHTTPConnectionPool,
+            "https": _TrackedHTTPSConnectionPool,
         }
-        return jsonify(payload)
 
-    payload = {
-        "model": model,
-        "messages": messages,
-        "temperature": 0.65,
-        "top_p": 0.9,
-    }
 
-    try:
-        resp = post_chat_completion(payload)
-    except requests.HTTPError as e:
-        err_resp = getattr(e, "response", None)
-        try:
-            err_json = err_resp.json() if err_resp is not None else {"message": str(e)}
-        except Exception:
-            err_json = {
-                "message": str(e),
-                "text": getattr(err_resp, "text", ""),
-            }
-        status_code = getattr(err_resp, "status_code", 502)
-        app.logger.error("Chat completion HTTPError %s: %s", status_code, err_json)
-        return jsonify({"error": "Chat completion API error", "details": err_json}), status_code
-    except requests.RequestException as e:
-        app.logger.error("Chat completion RequestException: %s", str(e))
-        return jsonify({"error": "Network error", "details": str(e)}), 502
-    except RuntimeError as e:
-        if str(e) == "missing_api_key":
-            return jsonify({"error": "Server missing OpenAI/OpenRouter API key"}), 500
-        raise
+class UpstreamClient:
+    """Pooled keep-alive HTTP client shared by every provider call.
 
-    out = resp.json()
+    One ``requests.Session`` is kept per upstream host so TCP/TLS connections to
+    OpenAI, OpenRouter, Perplexity and Telegram are reused across requests.
+    Sessions idle for longer than ``idle_timeout`` are recycled before the
+    provider drops them on its side.
+    """
 
-    # Expected shape similar to OpenAI/OpenRouter chat completions
-    answer_text = None
+    def __init__(
+        self,
+        *,
+        pool_connections: int,
+        pool_maxsize: int,
+        connect_timeout: float,
+        read_timeout: float,
+        keepalive: bool = True,
+        idle_timeout: float = 0,
+    ):
+        self.pool_connections = max(1, pool_connections)
+        self.pool_maxsize = max(1, pool_maxsize)
+        self.timeout = (connect_timeout, read_timeout)
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._sessions: dict[str, requests.Session] = {}
+        self._last_used: dict[str, float] = {}
+        self._stats: dict[str, dict[str, float]] = {}
+
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = _UpstreamAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=False,
+            keepalive=self.keepalive,
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _host_stats(self, host: str) -> dict[str, float]:
+        stats = self._stats.get(host)
+        if stats is None:
+            stats = {"requests": 0, "new_connections": 0, "connect_seconds": 0.0, "idle_resets": 0}
+            self._stats[host] = stats
+        return stats
+
+    def _session_for(self, parsed) -> requests.Session:
+        key = f"{parsed.scheme}://{parsed.netloc}"
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(key)
+            last_used = self._last_used.get(key, now)
+            if session is not None and self.idle_timeout and now - last_used > self.idle_timeout:
+                session.close()
+                session = None
+                self._host_stats(parsed.hostname or "")["idle_resets"] += 1
+            if session is None:
+                session = self._new_session()
+                self._sessions[key] = session
+            self._last_used[key] = now
+            self._host_stats(parsed.hostname or "")["requests"] += 1
+        return session
+
+    def note_connect(self, host: str, seconds: float) -> None:
+        with self._lock:
+            stats = self._host_stats(host or "")
+            stats["new_connections"] += 1
+            stats["connect_seconds"] += seconds
+
+    def post(self, url: str, *, headers: dict | None = None, data=None, timeout=None, stream: bool = False, provider: str | None = None):
+        """POST through the host's pooled session, reporting upstream phases when ``provider`` is named."""
+        parsed = urlparse(url)
+        session = self._session_for(parsed)
+        headers = dict(headers or {})
+        if not self.keepalive:
+            headers["Connection"] = "close"
+        timings = current_timings.get() if provider else None
+        if timings is not None:
+            timings.upstream_attempt(provider)
+        resp = session.post(
+            url,
+            headers=headers,
+            data=data,
+            timeout=timeout or self.timeout,
+            stream=stream,
+        )
+        if timings is not None:
+            timings.phases["upstream_ttfb"] = resp.elapsed.total_seconds()
+            if not stream and resp.status_code < 400:
+                timings.upstream_done()
+        return resp
+
+    def stats(self) -> dict:
+        with self._lock:
+            hosts = {}
+            totals = {"requests": 0, "new_connections": 0, "pool_hits": 0}
+            for host, stats in self._stats.items():
+                pool_hits = max(0, int(stats["requests"] - stats["new_connections"]))
+                hosts[host] = {
+                    "requests": int(stats["requests"]),
+                    "new_connections": int(stats["new_connections"]),
+                    "pool_hits": pool_hits,
+                    "avg_connect_ms": round(1000 * stats["connect_seconds"] / stats["new_connections"], 2)
+                    if stats["new_connections"]
+                    else 0.0,
+                    "idle_resets": int(stats["idle_resets"]),
+                }
+                totals["requests"] += hosts[host]["requests"]
+                totals["new_connections"] += hosts[host]["new_connections"]
+                totals["pool_hits"] += pool_hits
+        return {
+            "pool_maxsize": self.pool_maxsize,
+            "keepalive": self.keepalive,
+            "timeout": {"connect": self.timeout[0], "read": self.timeout[1]},
+            "totals": totals,
+            "hosts": hosts,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._last_used.clear()
+
+
+upstream_client = UpstreamClient(
+    pool_connections=UPSTREAM_POOL_CONNECTIONS,
+    pool_maxsize=UPSTREAM_POOL_MAXSIZE,
+    connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
+    read_timeout=UPSTREAM_READ_TIMEOUT,
+    keepalive=UPSTREAM_KEEPALIVE,
+    idle_timeout=UPSTREAM_KEEPALIVE_IDLE,
+)
+
+
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Seconds to wait from a ``Retry-After`` header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def client_wait(header_value: str | None) -> float:
+    """Seconds the client says it will wait (``X-Request-Timeout``), or 0 when it did not say."""
+    try:
+        wait = float(header_value) if header_value else 0.0
+    except ValueError:
+        return 0.0
+    return wait if wait > 0 else 0.0
+
+
+def request_deadline(header_value: str | None = None) -> float:
+    """Monotonic deadline for one client request: ``UPSTREAM_DEADLINE``, shortened by the client's own wait."""
+    budget = UPSTREAM_DEADLINE
+    wait = client_wait(header_value)
+    if wait:
+        budget = min(budget, wait)
+    return time.monotonic() + budget
+
+
+def stream_deadline(header_value: str | None = None) -> float | None:
+    """Monotonic cut-off for a whole streamed answer, or None.
+
+    Only a wait the client actually sent ends a stream; ``UPSTREAM_DEADLINE``
+    bounds connecting and retrying, not how long a healthy answer may take.
+    """
+    wait = client_wait(header_value)
+    return time.monotonic() + wait if wait else None
+
+
+def deadline_timeout(deadline: float | None, read_timeout: float = UPSTREAM_READ_TIMEOUT):
+    """Per-attempt ``(connect, read)`` timeout clipped to what is left before ``deadline``."""
+    if deadline is None:
+        return (UPSTREAM_CONNECT_TIMEOUT, read_timeout)
+    remaining = max(0.05, deadline - time.monotonic())
+    return (min(UPSTREAM_CONNECT_TIMEOUT, remaining), min(read_timeout, remaining))
+
+
+class RetryPolicy:
+    """Retry decisions for one provider: jittered backoff, ``Retry-After`` and a retry budget.
+
+    The budget is a token bucket: every first attempt deposits ``ratio``
+    tokens (capped at ``reserve``) and every retry spends one, so retries stay
+    near ``ratio`` of traffic when a provider is struggling instead of
+    multiplying load. ``next_delay`` is transport-agnostic and shared with the
+    async entry point; ``call`` drives a blocking ``send`` callable.
+    """
+
+    def __init__(self, name: str, *, max_attempts: int, base_delay: float, max_delay: float, ratio: float, reserve: float):
+        self.name = name
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.ratio = ratio
+        self.reserve = max(1.0, reserve)
+        self._tokens = self.reserve
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "retries": 0, "give_ups": 0, "budget_exhausted": 0}
+
+    def begin(self) -> None:
+        with self._lock:
+            self.counters["requests"] += 1
+            self._tokens = min(self.reserve, self._tokens + self.ratio)
+
+    def backoff(self, attempt: int) -> float:
+        # Full jitter: a uniform draw under the exponential cap spreads out synchronized retries.
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def next_delay(self, attempt: int, status: int | None, retry_after: float | None, deadline: float | None) -> float | None:
+        """Seconds to wait before retrying attempt ``attempt`` (1-based), or ``None`` to give up."""
+        if status is not None and status not in RETRYABLE_STATUSES:
+            return None
+        delay = retry_after if retry_after is not None else self.backoff(attempt)
+        with self._lock:
+            if attempt >= self.max_attempts:
+                self.counters["give_ups"] += 1
+                return None
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                self.counters["give_ups"] += 1
+                return None
+            if self._tokens < 1:
+                self.counters["budget_exhausted"] += 1
+                self.counters["give_ups"] += 1
+                return None
+            self._tokens -= 1
+            self.counters["retries"] += 1
+        logger.info("Retrying %s in %.2fs (attempt %s, status %s)", self.name, delay, attempt, status or "error")
+        return delay
+
+    def call(self, send, deadline: float | None = None):
+        """Call ``send(timeout)`` until it returns a non-retryable response or retries run out.
+
+        Only connection failures are retried on exceptions; a read timeout may
+        mean the provider is already generating (and billing) the answer.
+        """
+        self.begin()
+        attempt = 1
+        while True:
+            try:
+                resp = send(deadline_timeout(deadline))
+            except requests.ConnectionError:
+                delay = self.next_delay(attempt, None, None, deadline)
+                if delay is None:
+                    raise
+            else:
+                if resp.status_code < 400:
+                    return resp
+                delay = self.next_delay(attempt, resp.status_code, parse_retry_after(resp.headers.get("Retry-After")), deadline)
+                if delay is None:
+                    return resp
+                resp.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters, budget=round(self._tokens, 2))
+
+
+retry_policies = {
+    name: RetryPolicy(
+        name,
+        max_attempts=RETRY_MAX_ATTEMPTS,
+        base_delay=RETRY_BASE_DELAY,
+        max_delay=RETRY_MAX_DELAY,
+        ratio=RETRY_BUDGETS.get(name, RETRY_BUDGET_RATIO),
+        reserve=RETRY_BUDGET_RESERVE,
+    )
+    for name in ("openai", "openrouter", "perplexity", "telegram")
+}
+
+
+def token_bucket(state: str | None, rate: float, burst: float, now: float, cost: float = 1.0) -> tuple[str, float]:
+    """Refill a ``"tokens:updated_at"`` bucket and try to take ``cost`` tokens.
+
+    Returns the new state and ``0`` when the tokens were taken, otherwise the
+    seconds until enough will be available (nothing is taken then).
+    """
+    tokens, updated_at = burst, now
+    if state:
+        try:
+            tokens_text, updated_text = state.split(":", 1)
+            tokens, updated_at = float(tokens_text), float(updated_text)
+        except ValueError:
+            pass
+    tokens = min(burst, tokens + max(0.0, now - updated_at) * rate)
+    if tokens >= cost:
+        return f"{tokens - cost:.6f}:{now:.6f}", 0.0
+    wait = (cost - tokens) / rate if rate > 0 else 60.0
+    return f"{tokens:.6f}:{now:.6f}", wait
+
+
+def bucket_ttl(rate: float, burst: float) -> float:
+    """How long an idle bucket must be kept before it would be full again anyway."""
+    return burst / rate + 1 if rate > 0 else 3600
+
+
+class MemoryStore:
+    """Process-local string store with per-entry TTL and LRU eviction."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at and expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: float = 0) -> None:
+        expires_at = time.time() + ttl if ttl else 0
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def add(self, key: str, value: str, ttl: float = 0) -> bool:
+        """Set ``key`` only if it is absent or expired; ``True`` when it was stored."""
+        now = time.time()
+        with self._lock:
+            # Entries are kept in insertion/use order, so expired ones collect at the
+            # head: popping them here keeps expiry amortized O(1) instead of a scan.
+            while self._entries:
+                _, expires_at = next(iter(self._entries.values()))
+                if not expires_at or expires_at > now:
+                    break
+                self._entries.popitem(last=False)
+            entry = self._entries.get(key)
+            if entry is not None and (not entry[1] or entry[1] > now):
+                return False
+            self._entries[key] = (value, now + ttl if ttl else 0)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return True
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        """Atomically take ``cost`` tokens from the bucket at ``key``; see ``token_bucket``."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            state = entry[0] if entry and (not entry[1] or entry[1] > now) else None
+            state, wait = token_bucket(state, rate, burst, now, cost)
+            self._entries[key] = (state, now + bucket_ttl(rate, burst))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return wait
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_sqlite_local = threading.local()
+
+
+def sqlite_connect(path: str) -> sqlite3.Connection:
+    """This thread's connection to the SQLite file at ``path``, opened on first use.
+
+    Connections run in autocommit mode (callers open their own ``BEGIN
+    IMMEDIATE`` transactions) with WAL and ``synchronous=NORMAL``, so readers
+    never block the writer. A forked child opens its own.
+    """
+    pid = os.getpid()
+    if getattr(_sqlite_local, "pid", None) != pid:
+        _sqlite_local.pid, _sqlite_local.conns = pid, {}
+    conn = _sqlite_local.conns.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _sqlite_local.conns[path] = conn
+    return conn
+
+
+class BackgroundWorker:
+    """Mixin for objects served by one daemon thread per process running their ``_run`` loop.
+
+    ``ensure_worker`` is cheap once the thread is up, so callers invoke it
+    on every use; it starts the thread again in a forked child (e.g.
+    gunicorn ``--preload``), where the parent's thread does not exist.
+    """
+
+    worker_name = "worker"
+    _worker: threading.Thread | None = None
+    _worker_pid = 0
+    _worker_lock = threading.Lock()
+
+    def _run(self) -> None:
+        raise NotImplementedError
+
+    def _worker_running(self) -> bool:
+        return self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid()
+
+    def ensure_worker(self) -> None:
+        """Start this process' worker thread unless it is already running."""
+        if self._worker_running():
+            return
+        with self._worker_lock:
+            if self._worker_running():
+                return
+            self._worker = threading.Thread(target=self._run, name=self.worker_name, daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+
+class SQLiteStore:
+    """String store in a SQLite file so every worker on the host shares it.
+
+    Reads refresh ``touched_at``; writes occasionally prune expired rows and
+    trim the namespace back to ``max_entries`` by least-recent use.
+    """
+
+    PRUNE_EVERY = 64
+
+    def __init__(self, path: str, namespace: str, max_entries: int = 1024):
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max(1, max_entries)
+        self._writes = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, touched_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        return sqlite_connect(self.path)
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT value, expires_at FROM kv WHERE namespace = ? AND key = ?",
+            (self.namespace, key),
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at and expires_at <= now:
+            conn.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (self.namespace, key))
+            return None
+        conn.execute(
+            "UPDATE kv SET touched_at = ? WHERE namespace = ? AND key = ?",
+            (now, self.namespace, key),
+        )
+        return value
+
+    def set(self, key: str, value: str, ttl: float = 0) -> None:
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO kv (namespace, key, value, expires_at, touched_at) VALUES (?, ?, ?, ?, ?)",
+            (self.namespace, key, value, now + ttl if ttl else 0, now),
+        )
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def delete(self, key: str) -> None:
+        self._conn().execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+    def add(self, key: str, value: str, ttl: float = 0) -> bool:
+        """Set ``key`` only if it is absent or expired; ``True`` when it was stored."""
+        now = time.time()
+        cursor = self._conn().execute(
+            "INSERT INTO kv (namespace, key, value, expires_at, touched_at) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (namespace, key) DO UPDATE SET"
+            " value = excluded.value, expires_at = excluded.expires_at, touched_at = excluded.touched_at"
+            " WHERE kv.expires_at > 0 AND kv.expires_at <= ?",
+            (self.namespace, key, value, now + ttl if ttl else 0, now, now),
+        )
+        if cursor.rowcount != 1:
+            return False
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+        return True
+
+    def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        """Atomically take ``cost`` tokens from the bucket at ``key``; see ``token_bucket``."""
+        now = time.time()
+        conn = self._conn()
+        # BEGIN IMMEDIATE takes the write lock up front so concurrent workers serialize on the bucket.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value, expires_at FROM kv WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+            state = row[0] if row and (not row[1] or row[1] > now) else None
+            state, wait = token_bucket(state, rate, burst, now, cost)
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (namespace, key, value, expires_at, touched_at) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, state, now + bucket_ttl(rate, burst), now),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+        return wait
+
+    def prune(self) -> None:
+        conn = self._conn()
+        conn.execute(
+            "DELETE FROM kv WHERE namespace = ? AND expires_at > 0 AND expires_at <= ?",
+            (self.namespace, time.time()),
+        )
+        conn.execute(
+            "DELETE FROM kv WHERE namespace = ? AND key IN ("
+            " SELECT key FROM kv WHERE namespace = ? ORDER BY touched_at DESC LIMIT -1 OFFSET ?)",
+            (self.namespace, self.namespace, self.max_entries),
+        )
+
+    def __len__(self) -> int:
+        row = self._conn().execute("SELECT COUNT(*) FROM kv WHERE namespace = ?", (self.namespace,)).fetchone()
+        return row[0] if row else 0
+
+
+class RedisStore:
+    """String store on Redis for multi-host deployments (eviction follows Redis' maxmemory policy)."""
+
+    def __init__(self, url: str, namespace: str):
+        self.namespace = namespace
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def _key(self, key: str) -> str:
+        return f"sourcescout:{self.namespace}:{key}"
+
+    def get(self, key: str) -> str | None:
+        return self.client.get(self._key(key))
+
+    def set(self, key: str, value: str, ttl: float = 0) -> None:
+        self.client.set(self._key(key), value, ex=max(1, int(ttl)) if ttl else None)
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self._key(key))
+
+    def add(self, key: str, value: str, ttl: float = 0) -> bool:
+        """Set ``key`` only if it is absent (``SET NX``); ``True`` when it was stored."""
+        return bool(self.client.set(self._key(key), value, nx=True, ex=max(1, int(ttl)) if ttl else None))
+
+    TAKE_SCRIPT = """
+    local state = redis.call('GET', KEYS[1])
+    local rate, burst, now, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[5])
+    local tokens, updated = burst, now
+    if state then
+        local sep = string.find(state, ':', 1, true)
+        tokens = tonumber(string.sub(state, 1, sep - 1))
+        updated = tonumber(string.sub(state, sep + 1))
+    end
+    tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+    local wait = 0
+    if tokens >= cost then
+        tokens = tokens - cost
+    elseif rate > 0 then
+        wait = (cost - tokens) / rate
+    else
+        wait = 60
+    end
+    redis.call('SET', KEYS[1], string.format('%.6f:%.6f', tokens, now), 'EX', tonumber(ARGV[4]))
+    return tostring(wait)
+    """
+
+    def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        """Atomically take ``cost`` tokens from the bucket at ``key`` (Lua script; see ``token_bucket``)."""
+        ttl = max(1, int(bucket_ttl(rate, burst)))
+        return float(self.client.eval(self.TAKE_SCRIPT, 1, self._key(key), rate, burst, time.time(), ttl, cost))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.client.scan_iter(match=self._key("*"), count=500))
+
+
+def make_store(backend: str, namespace: str, max_entries: int):
+    """Build the ``memory``/``sqlite``/``redis`` store named by ``backend``."""
+    if backend == "redis":
+        if redis is None or not REDIS_URL:
+            logger.warning("Redis backend for %s needs the redis package and REDIS_URL; using memory", namespace)
+        else:
+            return RedisStore(REDIS_URL, namespace)
+    elif backend == "sqlite":
+        return SQLiteStore(SHARED_STORE_PATH, namespace, max_entries)
+    elif backend != "memory":
+        logger.warning("Unknown store backend %s for %s; using memory", backend, namespace)
+    return MemoryStore(max_entries)
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def provider_fault(status: int | None) -> bool:
+    """True when an upstream outcome says the provider itself is unhealthy (network error, 429, 5xx)."""
+    return status is None or status == 429 or status >= 500
+
+
+def should_failover(status: int | None) -> bool:
+    return provider_fault(status) or status in {401, 403}
+
+
+class ProviderHealth:
+    """Rolling latency/error window and circuit breaker for one chat provider.
+
+    The breaker opens after ``PROVIDER_BREAKER_FAILURES`` consecutive provider
+    faults or when the windowed error rate crosses the threshold, and lets a
+    single probe through once the cooldown has passed (half-open).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._samples: deque[tuple[float, bool]] = deque(maxlen=max(10, PROVIDER_WINDOW))
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.state = "closed"
+
+    def record(self, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self._samples.append((seconds, ok))
+            if ok:
+                self.consecutive_failures = 0
+                if self.state != "closed":
+                    logger.info("Provider %s recovered; closing circuit", self.name)
+                self.state = "closed"
+                self.probing = False
+                return
+            self.consecutive_failures += 1
+            errors = sum(1 for _, sample_ok in self._samples if not sample_ok)
+            tripped = self.consecutive_failures >= PROVIDER_BREAKER_FAILURES or (
+                len(self._samples) >= PROVIDER_BREAKER_MIN_SAMPLES
+                and errors / len(self._samples) >= PROVIDER_BREAKER_ERROR_RATE
+            )
+            if self.state == "half_open" or (tripped and self.state == "closed"):
+                logger.warning("Opening circuit for provider %s", self.name)
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= PROVIDER_BREAKER_COOLDOWN:
+                self.state = "half_open"
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def latency(self, pct: float) -> float:
+        with self._lock:
+            values = [seconds for seconds, ok in self._samples if ok]
+        return percentile(values, pct)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            samples = list(self._samples)
+            state = self.state
+        ok_latencies = [seconds for seconds, ok in samples if ok]
+        errors = sum(1 for _, ok in samples if not ok)
+        return {
+            "state": state,
+            "samples": len(samples),
+            "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+            "p50_ms": round(1000 * percentile(ok_latencies, 50), 1),
+            "p95_ms": round(1000 * percentile(ok_latencies, 95), 1),
+        }
+
+
+def configured_chat_providers() -> list[dict]:
+    providers = {}
+    if OPENAI_API_KEY:
+        providers["openai"] = {
+            "name": "openai",
+            "url": OPENAI_API_URL,
+            "headers": {"Content-Type": "application/json", "Authorization": f"Bearer {OPENAI_API_KEY}"},
+            "model_prefix": "",
+            "prompt_cache": "key",
+        }
+    if OPENROUTER_API_KEY:
+        providers["openrouter"] = {
+            "name": "openrouter",
+            "url": OPENROUTER_API_URL,
+            "headers": {
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+                "HTTP-Referer": OPENROUTER_SITE_URL,
+                "X-Title": OPENROUTER_APP_NAME,
+            },
+            "model_prefix": OPENROUTER_MODEL_PREFIX,
+            "prompt_cache": "breakpoint",
+        }
+    ordered = [providers.pop(name) for name in PROVIDER_ORDER if name in providers]
+    return ordered + list(providers.values())
+
+
+def prompt_cache_request(provider: dict, body: dict) -> dict:
+    """Adapt the planned ``prompt_cache_key`` hint to what ``provider`` understands.
+
+    OpenAI takes the key as-is (prefixes of 1024+ tokens are cached
+    automatically; the key keeps one persona's requests on the same cache).
+    OpenRouter drops it and, for models in ``PROMPT_CACHE_BREAKPOINT_MODELS``,
+    marks the leading system prompt with a ``cache_control`` breakpoint. The
+    shared payload is never mutated, since hedged requests send it twice.
+    """
+    style = provider.get("prompt_cache")
+    if "prompt_cache_key" in body and style != "key":
+        body = {k: v for k, v in body.items() if k != "prompt_cache_key"}
+    model = body.get("model")
+    messages = body.get("messages")
+    if (
+        style == "breakpoint"
+        and PROMPT_CACHE_HINTS
+        and isinstance(model, str)
+        and model.startswith(PROMPT_CACHE_BREAKPOINT_MODELS)
+        and messages
+        and isinstance(messages[0], dict)
+        and messages[0].get("role") == "system"
+        and isinstance(messages[0].get("content"), str)
+    ):
+        system = {
+            "role": "system",
+            "content": [{"type": "text", "text": messages[0]["content"], "cache_control": {"type": "ephemeral"}}],
+        }
+        body = dict(body, messages=[system] + list(messages[1:]))
+    return body
+
+
+class ProviderRouter:
+    """Chooses, fails over between and optionally hedges across chat providers.
+
+    Providers are tried in ``PROVIDER_ORDER``, skipping any whose circuit is
+    open. Provider faults fail over to the next provider; with
+    ``PROVIDER_HEDGE_AFTER_MS`` set, a non-streaming request that has not
+    answered within that delay (or the primary's rolling p95 when set to
+    ``p95``) is also sent to the alternate and the first success wins.
+    Transport-agnostic pieces (``candidates``, ``request_for``, ``record``,
+    ``hedge_delay``) are shared with the async entry point.
+    """
+
+    def __init__(self, providers: list[dict]):
+        self.providers = providers
+        self.health = {p["name"]: ProviderHealth(p["name"]) for p in providers}
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+        self.counters = {"failovers": 0, "hedges": 0, "hedge_wins": 0}
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def candidates(self) -> list[dict]:
+        if not self.providers:
+            raise RuntimeError("missing_api_key")
+        available = [p for p in self.providers if self.health[p["name"]].allow()]
+        # With every circuit open, still try the preferred provider rather than failing outright.
+        return available or self.providers[:1]
+
+    def request_for(self, provider: dict, payload: dict) -> tuple[str, dict, dict]:
+        # Model names follow the preferred provider; map them when another provider serves the request.
+        body = payload
+        model = payload.get("model")
+        prefix = provider.get("model_prefix")
+        if provider is not self.providers[0] and prefix and isinstance(model, str) and "/" not in model:
+            body = dict(payload, model=prefix + model)
+        return provider["url"], dict(provider["headers"]), prompt_cache_request(provider, body)
+
+    def record(self, name: str, seconds: float, status: int | None, model: str | None = None, stream: bool = False) -> None:
+        self.health[name].record(seconds, ok=not provider_fault(status))
+        if model and status is not None and status < 400:
+            model_router.observe(model, stream, seconds)
+
+    def hedge_delay(self, candidates: list[dict], stream: bool = False) -> float | None:
+        if stream or len(candidates) < 2 or PROVIDER_HEDGE_AFTER in {"", "0", "off", "false"}:
+            return None
+        if PROVIDER_HEDGE_AFTER == "p95":
+            health = self.health[candidates[0]["name"]]
+            if health.snapshot()["samples"] < PROVIDER_BREAKER_MIN_SAMPLES:
+                return None
+            return health.latency(95) or None
+        try:
+            return float(PROVIDER_HEDGE_AFTER) / 1000
+        except ValueError:
+            return None
+
+    def _send(self, provider: dict, payload: dict, deadline: float | None = None, retry: bool = True):
+        url, headers, body = self.request_for(provider, payload)
+        data = json.dumps(body)
+        model, stream = payload.get("model"), bool(body.get("stream"))
+
+        def attempt(timeout):
+            started = time.perf_counter()
+            try:
+                resp = upstream_client.post(url, headers=headers, data=data, timeout=timeout, stream=stream, provider=provider["name"])
+            except requests.RequestException:
+                self.record(provider["name"], time.perf_counter() - started, None)
+                raise
+            self.record(provider["name"], time.perf_counter() - started, resp.status_code, model, stream)
+            return resp
+
+        if retry:
+            resp = retry_policies[provider["name"]].call(attempt, deadline)
+        else:
+            resp = attempt(deadline_timeout(deadline))
+        resp.raise_for_status()
+        return resp
+
+    def call(self, payload: dict, deadline: float | None = None):
+        """Send a chat completion with failover (and hedging when enabled); returns the response.
+
+        Failing over is the first remedy for a provider fault, so only the
+        last candidate goes through its retry policy.
+        """
+        candidates = self.candidates()
+        delay = self.hedge_delay(candidates, stream=bool(payload.get("stream")))
+        if delay is not None:
+            return self._hedged(candidates[0], candidates[1], payload, delay, deadline)
+        for index, provider in enumerate(candidates):
+            last = index == len(candidates) - 1
+            try:
+                return self._send(provider, payload, deadline, retry=last)
+            except requests.RequestException as exc:
+                status = getattr(getattr(exc, "response", None), "status_code", None)
+                if last or not should_failover(status):
+                    raise
+                self.count("failovers")
+                logger.warning("Provider %s failed (%s); failing over", provider["name"], status or exc)
+
+    def _hedged(self, primary: dict, alternate: dict, payload: dict, delay: float, deadline: float | None):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=PROVIDER_HEDGE_WORKERS, thread_name_prefix="hedge")
+        futures = {self._executor.submit(contextvars.copy_context().run, self._send, primary, payload, deadline, False): primary}
+        done, pending = wait(futures, timeout=delay)
+        if not done:
+            self.count("hedges")
+            futures[self._executor.submit(contextvars.copy_context().run, self._send, alternate, payload, deadline)] = alternate
+            pending = set(futures)
+        last_exc: BaseException | None = None
+        while True:
+            for future in done:
+                exc = future.exception()
+                if exc is None:
+                    if futures[future] is alternate:
+                        self.count("hedge_wins")
+                    for loser in pending:
+                        loser.add_done_callback(lambda f: f.exception() is None and f.result().close())
+                    return future.result()
+                last_exc = exc
+            if not pending:
+                status = getattr(getattr(last_exc, "response", None), "status_code", None)
+                if alternate in futures.values() or not should_failover(status):
+                    raise last_exc
+                self.count("failovers")
+                futures[self._executor.submit(contextvars.copy_context().run, self._send, alternate, payload, deadline)] = alternate
+                pending = {f for f, p in futures.items() if p is alternate}
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        counters["providers"] = {name: health.snapshot() for name, health in self.health.items()}
+        counters["order"] = [p["name"] for p in self.providers]
+        return counters
+
+
+provider_router = ProviderRouter(configured_chat_providers())
+
+
+MODEL_AUTO = "auto"
+AUTO_CODE_RE = re.compile(
+    r"```|^\s*(?:def|class|import|from \S+ import|select|const|let|function|#include)\b|[{};]\s*$"
+    r"|\b(?:traceback|stack trace|exception|regex|refactor|debug|compile|syntax error)\b",
+    re.IGNORECASE | re.MULTILINE,
+)
+AUTO_MATH_RE = re.compile(
+    r"\d\s*[-+*/^=]\s*\d|\b(?:integral|derivative|equation|theorem|prove|proof|probability|calculate|solve for)\b",
+    re.IGNORECASE,
+)
+AUTO_REASONING_RE = re.compile(
+    r"\b(?:compare|comparison|contrast|analy[sz]e|analysis|evaluate|critique|pros and cons|trade-?offs?"
+    r"|step[- ]by[- ]step|in[- ]depth|detailed|comprehensive|essay|strategy|plan|outline|research"
+    r"|why (?:does|do|did|is|are|was|were)|implications?)\b",
+    re.IGNORECASE,
+)
+
+
+class ModelRouter:
+    """Model choice for ``"model": "auto"`` chat requests.
+
+    ``classify`` sorts a question into the ``fast`` or ``heavy`` tier with
+    local heuristics only: code, maths and reasoning cues ("compare", "step by
+    step", "why does"), a long question or a long history mean ``heavy``.
+    Within the tier the first model whose observed p95 fits the target wins:
+    time to first byte for streamed requests, the full answer otherwise, each
+    tracked per model over the last ``window`` successful calls. A model with
+    fewer than ``PROVIDER_BREAKER_MIN_SAMPLES`` samples is assumed to fit.
+    When no heavy model fits, the request drops to the fast tier.
+    """
+
+    HEAVY_QUERY_TOKENS = 80
+    HEAVY_HISTORY_TOKENS = 2000
+
+    def __init__(self, tiers: dict[str, list[str]], *, target_p95: float, target_ttfb_p95: float, window: int):
+        fast = [m for m in tiers.get("fast", []) if m] or [CHAT_DEFAULT_MODEL]
+        heavy = [m for m in tiers.get("heavy", []) if m] or fast
+        self.tiers = {"fast": fast, "heavy": heavy}
+        self.targets = {False: target_p95, True: target_ttfb_p95}
+        self.window = max(10, window)
+        self._lock = threading.Lock()
+        self._samples: dict[tuple[str, bool], deque[float]] = {
+            (model, stream): deque(maxlen=self.window) for model in fast + heavy for stream in (False, True)
+        }
+        self.counters: dict[str, int] = {"fast": 0, "heavy": 0, "downgraded": 0}
+
+    def observe(self, model: str, stream: bool, seconds: float) -> None:
+        samples = self._samples.get((model, stream))
+        if samples is not None:
+            with self._lock:
+                samples.append(seconds)
+
+    def p95(self, model: str, stream: bool) -> float | None:
+        with self._lock:
+            samples = list(self._samples[(model, stream)])
+        if len(samples) < PROVIDER_BREAKER_MIN_SAMPLES:
+            return None
+        return percentile(samples, 95)
+
+    def classify(self, query: str, turns: list[dict]) -> tuple[str, str]:
+        """``(tier, reason)`` for a question and its history."""
+        for reason, pattern in (("code", AUTO_CODE_RE), ("math", AUTO_MATH_RE), ("reasoning", AUTO_REASONING_RE)):
+            if pattern.search(query):
+                return "heavy", reason
+        if count_tokens(query) > self.HEAVY_QUERY_TOKENS:
+            return "heavy", "long_query"
+        if sum(message_tokens(turn) for turn in turns) > self.HEAVY_HISTORY_TOKENS:
+            return "heavy", "long_history"
+        return "fast", "simple"
+
+    def pick(self, tier: str, stream: bool) -> str | None:
+        """The tier's first model within the latency target, or ``None`` when all are over it."""
+        for model in self.tiers[tier]:
+            p95 = self.p95(model, stream)
+            if p95 is None or p95 * 1000 <= self.targets[stream]:
+                return model
+        return None
+
+    def choose(self, query: str, turns: list[dict], stream: bool) -> dict:
+        """The ``routing`` entry for a request: ``tier``, ``model``, ``reason`` and ``downgraded`` when latency forced it."""
+        tier, reason = self.classify(query, turns)
+        model = self.pick(tier, stream)
+        routing = {"tier": tier, "model": model, "reason": reason}
+        if model is None and tier == "heavy":
+            routing.update(tier="fast", model=self.pick("fast", stream), downgraded=True)
+        if routing["model"] is None:
+            # Nothing meets the target: take the tier's fastest model.
+            routing["model"] = min(self.tiers[routing["tier"]], key=lambda m: self.p95(m, stream) or 0.0)
+        with self._lock:
+            self.counters[routing["tier"]] += 1
+            self.counters["downgraded"] += 1 if routing.get("downgraded") else 0
+        if metrics.enabled:
+            label = "latency" if routing.get("downgraded") else reason
+            metrics.model_routes.inc((routing["tier"], metrics.label("model", routing["model"]), label))
+        return routing
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            samples = {key: list(values) for key, values in self._samples.items()}
+        models = {}
+        for (model, stream), values in samples.items():
+            models.setdefault(model, {})["ttfb" if stream else "complete"] = {
+                "samples": len(values),
+                "p50_ms": round(1000 * percentile(values, 50), 1),
+                "p95_ms": round(1000 * percentile(values, 95), 1),
+            }
+        return {
+            "tiers": self.tiers,
+            "target_p95_ms": self.targets[False],
+            "target_ttfb_p95_ms": self.targets[True],
+            "routes": counters,
+            "models": models,
+        }
+
+
+model_router = ModelRouter(
+    MODEL_AUTO_TIERS or {"fast": [CHAT_DEFAULT_MODEL], "heavy": ["gpt-4o", "gpt-4.1-mini"]},
+    target_p95=MODEL_AUTO_TARGET_P95_MS,
+    target_ttfb_p95=MODEL_AUTO_TARGET_TTFB_P95_MS,
+    window=PROVIDER_WINDOW,
+)
+
+
+def post_chat_completion(payload: dict, deadline: float | None = None):
+    """Send chat completion request to OpenAI or OpenRouter via the provider router."""
+    return provider_router.call(payload, deadline)
+
+
+def perplexity_request(messages: list[dict[str, str]], stream: bool = False) -> tuple[dict[str, str], dict]:
+    """Return the (headers, payload) pair for a Perplexity search."""
+    if not PPLX_API_KEY:
+        raise RuntimeError("missing_perplexity_key")
+
+    headers = {
+        "Authorization": f"Bearer {PPLX_API_KEY}",
+        "Content-Type": "application/json",
+    }
+    payload = {
+        "model": PPLX_MODEL,
+        "messages": messages,
+        "temperature": 0.65,
+        "top_p": 0.9,
+    }
+    if stream:
+        payload["stream"] = True
+    return headers, payload
+
+
+def perplexity_search(messages: list[dict[str, str]], stream: bool = False, deadline: float | None = None):
+    """Query Perplexity; returns the decoded body, or the open response when streaming."""
+    headers, payload = perplexity_request(messages, stream=stream)
+    data = json.dumps(payload)
+    resp = retry_policies["perplexity"].call(
+        lambda timeout: upstream_client.post(
+            PPLX_API_URL, headers=headers, data=data, timeout=timeout, stream=stream, provider="perplexity"
+        ),
+        deadline,
+    )
+    resp.raise_for_status()
+    if stream:
+        return resp
+    return resp.json()
+
+
+@lru_cache(maxsize=4096)
+def citation_url_parts(url: str) -> tuple[str, str]:
+    """``(canonical key, domain)`` for a source URL, memoized because sources repeat across answers.
+
+    The key ignores scheme, ``www.``, default ports, trailing slashes,
+    fragments and ``utm_*`` parameters so the same page cited twice collapses.
+    """
+    parsed = urlparse(url.strip())
+    host = (parsed.hostname or "").lower()
+    if not host:
+        return url.strip(), parsed.netloc
+    if host.startswith("www."):
+        host = host[4:]
+    try:
+        port = parsed.port
+    except ValueError:
+        port = None
+    netloc = f"{host}:{port}" if port and port not in {80, 443} else host
+    query = "&".join(part for part in parsed.query.split("&") if part and not part.lower().startswith("utm_"))
+    canonical = netloc + parsed.path.rstrip("/") + (f"?{query}" if query else "")
+    return canonical, parsed.netloc
+
+
+def process_citations(items) -> tuple[list[dict], dict[int, int]]:
+    """Normalize provider citations and drop repeats of the same canonical URL.
+
+    Returns the sources plus a map from each original 1-based position to
+    its position in the deduplicated list, for remapping ``[n]`` markers.
+    """
+    normalized = []
+    index_map: dict[int, int] = {}
+    seen: dict[str, int] = {}
+    if not items:
+        return normalized, index_map
+    for idx, item in enumerate(items, start=1):
+        if isinstance(item, str):
+            url = item
+            key, domain = citation_url_parts(url) if url else ("", "")
+            entry = {
+                "title": domain or f"Source {idx}",
+                "url": url,
+                "domain": domain,
+                "snippet": "",
+            }
+        elif isinstance(item, dict):
+            url = item.get("url") or item.get("source") or item.get("source_url")
+            key, parsed_domain = citation_url_parts(url) if isinstance(url, str) and url else ("", "")
+            domain = item.get("domain") or parsed_domain
+
+            title = item.get("title") or item.get("name") or item.get("id")
+            if title and isinstance(title, str) and title.lower().startswith("source #") and domain:
+                title = domain
+            if not title:
+                title = domain or f"Source {idx}"
+
+            snippet = (
+                item.get("snippet")
+                or item.get("description")
+                or item.get("text")
+                or ""
+            )
+            entry = {
+                "title": title,
+                "url": url,
+                "domain": domain or "",
+                "snippet": snippet,
+            }
+        else:
+            continue
+
+        if key and key in seen:
+            first = normalized[seen[key] - 1]
+            if not first["snippet"] and entry["snippet"]:
+                first["snippet"] = entry["snippet"]
+            index_map[idx] = seen[key]
+            continue
+        normalized.append(entry)
+        index_map[idx] = len(normalized)
+        if key:
+            seen[key] = len(normalized)
+    return normalized, index_map
+
+
+def normalize_citations(items):
+    return process_citations(items)[0]
+
+
+INLINE_MARKER = r"\[\s*(?:\d+|[a-z]{1,3}\d*|source\s*#?\d+)\s*\]"
+# Runs start with a literal "[" so the regex engine can skip ahead instead of trying every position.
+MARKER_RUN_RE = re.compile(INLINE_MARKER + r"(?:\s*" + INLINE_MARKER + ")*", re.IGNORECASE)
+MARKER_NUMBER_RE = re.compile(r"(\d+)\s*\]")
+WHITESPACE_RUN_RE = re.compile(r"\s\s+")
+URL_RE = re.compile(r"https?://[^\s()\[\]]+")
+PARTIAL_URL_RE = re.compile(r"https?://[^\s()\[\]]*$|h(?:t(?:t(?:p(?:s?(?::/{0,2})?)?)?)?)?$", re.IGNORECASE)
+MARKER_SENTINEL = "\x00"
+
+
+@lru_cache(maxsize=1024)
+def marker_numbers(run: str) -> tuple[int, ...]:
+    """Source numbers cited by a run of inline markers such as ``[1][source #3]``."""
+    return tuple(int(number) for number in MARKER_NUMBER_RE.findall(run))
+
+
+class CitationProcessor:
+    """Cleans answer text in one pass, one-shot (``process``) or streamed (``feed``/``flush``).
+
+    Inline ``[n]`` markers (and the whitespace before them) are cut out in a
+    single walk that remembers where each sat and which sources it cites;
+    whitespace runs then collapse to one space in the same output, and with
+    ``collect_urls`` the links are gathered for the link fallback. While
+    streaming, text is held back while it ends in whitespace, an
+    unterminated ``[`` marker or (when collecting) a URL that may continue,
+    so chunk boundaries never change the result.
+    """
+
+    MAX_PENDING_MARKER = 24
+    MAX_PENDING_URL = 2048
+
+    def __init__(self, collect_urls: bool = False):
+        self.collect_urls = collect_urls
+        self._pending = ""
+        self.length = 0
+        self.urls: dict[str, None] = {}
+        self.markers: list[list] = []
+
+    def process(self, text: str | None) -> str:
+        return self.feed(text) + self.flush()
+
+    def feed(self, chunk: str | None) -> str:
+        if not chunk:
+            return ""
+        text = self._pending + chunk
+        cut = self._safe_cut(text)
+        self._pending = text[cut:]
+        return self._clean(text[:cut])
+
+    def flush(self) -> str:
+        text, self._pending = self._pending, ""
+        cleaned = self._clean(text)
+        tail = cleaned.rstrip()
+        self.length -= len(cleaned) - len(tail)
+        return tail
+
+    def _safe_cut(self, text: str) -> int:
+        cut = len(text)
+        bracket = text.rfind("[")
+        if bracket != -1 and "]" not in text[bracket:] and cut - bracket <= self.MAX_PENDING_MARKER:
+            cut = bracket
+        if self.collect_urls:
+            partial = PARTIAL_URL_RE.search(text, max(0, cut - self.MAX_PENDING_URL), cut)
+            if partial:
+                cut = partial.start()
+        while cut > 0 and text[cut - 1].isspace():
+            cut -= 1
+        return cut
+
+    def _clean(self, text: str) -> str:
+        if not text:
+            return ""
+        if MARKER_SENTINEL in text:
+            text = text.replace(MARKER_SENTINEL, "")
+        if self.collect_urls:
+            self.urls.update(dict.fromkeys(URL_RE.findall(text)))
+
+        numbers = []
+        if "[" in text:
+            parts = []
+            pos = 0
+            for match in MARKER_RUN_RE.finditer(text):
+                # A marker takes the whitespace in front of it along with it.
+                parts.append(text[pos:match.start()].rstrip())
+                parts.append(MARKER_SENTINEL)
+                numbers.append(marker_numbers(match.group()))
+                pos = match.end()
+            if parts:
+                parts.append(text[pos:])
+                text = "".join(parts)
+
+        cleaned = WHITESPACE_RUN_RE.sub(" ", text)
+        if numbers:
+            cleaned = self._place_markers(cleaned, numbers)
+        elif not self.length:
+            cleaned = cleaned.lstrip()
+        self.length += len(cleaned)
+        return cleaned
+
+    def _place_markers(self, cleaned: str, numbers: list[tuple[int, ...]]) -> str:
+        pieces = cleaned.split(MARKER_SENTINEL)
+        text = "".join(pieces)
+        lead = 0
+        if not self.length:
+            text = text.lstrip()
+            lead = len(cleaned) - len(numbers) - len(text)
+        offset = self.length - lead
+        for piece, cited in zip(pieces, numbers):
+            offset += len(piece)
+            at = max(offset, self.length)
+            if self.markers and self.markers[-1][0] == at:
+                self.markers[-1][1].extend(cited)
+            elif cited:
+                self.markers.append([at, list(cited)])
+        return text
+
+    def citation_markers(self, index_map: dict[int, int]) -> list[dict]:
+        """Marker offsets in the cleaned answer with ``[n]`` remapped to deduplicated source positions."""
+        markers = []
+        for offset, numbers in self.markers:
+            cited = list(dict.fromkeys(index_map[n] for n in numbers if n in index_map))
+            if cited:
+                markers.append({"offset": min(offset, self.length), "citations": cited})
+        return markers
+
+
+def strip_inline_citations(text: str | None) -> str:
+    if not text:
+        return ""
+    return CitationProcessor().process(text)
+
+
+def render_answer(text: str | None, citations=None, *, link_fallback: bool = False) -> dict:
+    """Clean an answer and attach its sources (and marker positions when any map to a source)."""
+    processor = CitationProcessor(collect_urls=link_fallback)
+    answer = processor.process(text or "")
+    if not citations and link_fallback:
+        citations = list(processor.urls)
+    return citations_payload(processor, answer, citations)
+
+
+def citations_payload(processor: CitationProcessor, answer: str, citations) -> dict:
+    normalized, index_map = process_citations(citations)
+    payload = {"answer": answer, "citations": normalized}
+    markers = processor.citation_markers(index_map)
+    if markers:
+        payload["citation_markers"] = markers
+    return payload
+
+
+def wants_stream(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in {"1", "true", "yes"}
+    return value is True or value == 1
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def sse_response(events) -> Response:
+    resp = Response(events, mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+
+STREAM_DONE = object()
+
+
+def decode_upstream_line(raw):
+    """Decode one line of an OpenAI-style ``text/event-stream`` body.
+
+    Returns the JSON chunk, ``STREAM_DONE`` for the terminating ``[DONE]``
+    marker, or ``None`` for blank, comment and undecodable lines.
+    """
+    if not raw:
+        return None
+    line = raw.decode("utf-8", errors="replace") if isinstance(raw, bytes) else raw
+    if not line.startswith("data:"):
+        return None
+    data = line[5:].strip()
+    if data == "[DONE]":
+        return STREAM_DONE
+    try:
+        return json.loads(data)
+    except ValueError:
+        return None
+
+
+class AnswerStreamRelay:
+    """Turns upstream completion chunks into the SSE events sent to the browser.
+
+    Emits ``token`` events with cleaned text, then ``citations`` (normalized)
+    and a closing ``done`` event; ``fail`` produces the ``error`` event used
+    when the upstream connection drops mid-answer. The relay does no I/O, so
+    the sync and async transports share it.
+    """
+
+    def __init__(
+        self,
+        *,
+        personality_key: str,
+        mode: str | None = None,
+        include_citations: bool = True,
+        link_fallback: bool = False,
+        on_complete=None,
+        context: dict | None = None,
+        routing: dict | None = None,
+    ):
+        self.personality_key = personality_key
+        self.context = context
+        self.routing = routing
+        self.mode = mode
+        self.include_citations = include_citations
+        self.link_fallback = link_fallback
+        self.on_complete = on_complete
+        self.processor = CitationProcessor(collect_urls=include_citations and link_fallback)
+        self.answer_parts: list[str] = []
+        self.citations = []
+        self.usage = None
+        # Content chunks received; providers send about one token per chunk.
+        self.streamed = 0
+
+    def feed(self, chunk: dict) -> list[str]:
+        choice0 = (chunk.get("choices", []) or [None])[0] or {}
+        piece = (choice0.get("delta") or {}).get("content") or ""
+        chunk_citations = chunk.get("citations") or choice0.get("citations") or chunk.get("sources")
+        if chunk_citations:
+            self.citations = chunk_citations
+        if chunk.get("usage"):
+            self.usage = chunk["usage"]
+        if not piece:
+            return []
+        self.streamed += 1
+        with timed("postprocess"):
+            text = self.processor.feed(piece)
+        if not text:
+            return []
+        self.answer_parts.append(text)
+        return [sse_event("token", {"delta": text})]
+
+    def finish(self) -> list[str]:
+        """Flush held-back text and close the stream; ``on_complete`` gets the JSON-mode payload."""
+        events = []
+        with timed("postprocess"):
+            tail = self.processor.flush()
+        if tail:
+            self.answer_parts.append(tail)
+            events.append(sse_event("token", {"delta": tail}))
+        answer = "".join(self.answer_parts)
+        prompt_cache_stats.record(self.mode or "chat", self.usage)
+        if self.include_citations:
+            citations = self.citations
+            if not citations and self.link_fallback:
+                citations = list(self.processor.urls)
+            with timed("postprocess"):
+                payload = citations_payload(self.processor, answer, citations)
+            sources = {"citations": payload["citations"]}
+            if "citation_markers" in payload:
+                sources["citation_markers"] = payload["citation_markers"]
+            events.append(sse_event("citations", sources))
+        else:
+            payload = {"answer": answer}
+        payload["personality"] = self.personality_key
+        done = {"personality": self.personality_key}
+        if self.mode:
+            done["mode"] = self.mode
+            payload["mode"] = self.mode
+        if self.context:
+            done["context"] = self.context
+            payload["context"] = self.context
+        if self.routing:
+            done["routing"] = self.routing
+            payload["routing"] = self.routing
+        events.append(sse_event("done", done))
+        if self.on_complete is not None:
+            self.on_complete(payload)
+        return events
+
+    def fail(self, error: str = "Upstream stream interrupted") -> list[str]:
+        return [sse_event("error", {"error": error})]
+
+
+DEADLINE_EXCEEDED_ERROR = "Request deadline exceeded"
+
+
+def stream_answer_events(resp, *, deadline: float | None = None, **relay_options):
+    """Relay a streaming ``requests`` response to the browser as SSE events.
+
+    The upstream connection is closed as soon as the generator is closed
+    (the client disconnected) or ``deadline`` passes mid-answer; partial
+    answers are never handed to ``on_complete``.
+    """
+    relay = AnswerStreamRelay(**relay_options)
+    source = relay.mode or "chat"
+    try:
+        for raw in resp.iter_lines():
+            if deadline is not None and time.monotonic() > deadline:
+                cancellations.record("deadline", source, relay.streamed)
+                yield from relay.fail(DEADLINE_EXCEEDED_ERROR)
+                return
+            chunk = decode_upstream_line(raw)
+            if chunk is STREAM_DONE:
+                break
+            if chunk:
+                yield from relay.feed(chunk)
+    except GeneratorExit:
+        cancellations.record("disconnect", source, relay.streamed)
+        raise
+    except requests.RequestException as exc:
+        logger.error("Upstream stream interrupted: %s", exc)
+        yield from relay.fail()
+        return
+    finally:
+        resp.close()
+    timings = current_timings.get()
+    if timings is not None:
+        timings.upstream_done()
+    yield from relay.finish()
+
+
+@lru_cache(maxsize=64)
+def prompt_hash(text: str | None) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()[:16]
+
+
+def usage_summary(usage) -> dict | None:
+    """Token usage from a completion body, including prompt-cache reads and writes.
+
+    Understands OpenAI/OpenRouter ``prompt_tokens_details.cached_tokens`` and
+    Anthropic-style ``cache_read_input_tokens``/``cache_creation_input_tokens``.
+    """
+    if not isinstance(usage, dict):
+        return None
+    details = usage.get("prompt_tokens_details") or {}
+
+    def count(*values) -> int:
+        for value in values:
+            if isinstance(value, (int, float)):
+                return int(value)
+        return 0
+
+    return {
+        "prompt_tokens": count(usage.get("prompt_tokens"), usage.get("input_tokens")),
+        "completion_tokens": count(usage.get("completion_tokens"), usage.get("output_tokens")),
+        "cached_tokens": count(details.get("cached_tokens") if isinstance(details, dict) else None, usage.get("cache_read_input_tokens")),
+        "cache_write_tokens": count(
+            details.get("cache_write_tokens") if isinstance(details, dict) else None,
+            usage.get("cache_creation_input_tokens"),
+        ),
+    }
+
+
+class PromptCacheStats:
+    """Per-source totals of reported prompt tokens and how many were served from the provider's prompt cache."""
+
+    FIELDS = ("prompt_tokens", "completion_tokens", "cached_tokens", "cache_write_tokens")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: dict[str, dict[str, int]] = {}
+
+    def record(self, source: str, usage) -> dict | None:
+        summary = usage_summary(usage)
+        with self._lock:
+            totals = self._totals.setdefault(source, dict.fromkeys(("responses", "with_usage", "cache_hits") + self.FIELDS, 0))
+            totals["responses"] += 1
+            if summary is None:
+                return None
+            totals["with_usage"] += 1
+            totals["cache_hits"] += bool(summary["cached_tokens"])
+            for field in self.FIELDS:
+                totals[field] += summary[field]
+        if metrics.enabled:
+            metrics.count_tokens(summary)
+        return summary
+
+    def mean_completion(self, source: str) -> float:
+        with self._lock:
+            totals = self._totals.get(source)
+            if not totals or not totals["with_usage"]:
+                return 0.0
+            return totals["completion_tokens"] / totals["with_usage"]
+
+    def stats(self) -> dict:
+        with self._lock:
+            snapshot = {source: dict(totals) for source, totals in self._totals.items()}
+        for totals in snapshot.values():
+            prompt = totals["prompt_tokens"]
+            totals["cached_ratio"] = round(totals["cached_tokens"] / prompt, 4) if prompt else 0.0
+            totals["hit_rate"] = round(totals["cache_hits"] / totals["with_usage"], 4) if totals["with_usage"] else 0.0
+        return snapshot
+
+
+prompt_cache_stats = PromptCacheStats()
+
+
+class CancellationStats:
+    """Upstream generations stopped early, and the completion tokens that saved.
+
+    Each stop is assumed to save the source's mean completion length (from
+    ``prompt_cache_stats``) minus the tokens that had already streamed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {"disconnect": 0, "deadline": 0, "tokens_streamed": 0, "tokens_saved": 0}
+
+    def record(self, reason: str, source: str, streamed: int = 0) -> None:
+        saved = max(0, round(prompt_cache_stats.mean_completion(source)) - streamed)
+        with self._lock:
+            self.counters[reason] += 1
+            self.counters["tokens_streamed"] += streamed
+            self.counters["tokens_saved"] += saved
+        if metrics.enabled:
+            metrics.cancellations.inc((reason, source))
+            if saved:
+                metrics.tokens_saved.inc((source,), saved)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        counters["cancelled"] = counters["disconnect"] + counters["deadline"]
+        return counters
+
+
+cancellations = CancellationStats()
+
+
+def prompt_cache_key(persona) -> str:
+    """Stable per-persona routing key: requests sharing it share the same system-prompt prefix."""
+    return f"sourcescout-{persona.key}-{persona.hash}"
+
+
+def normalize_query(text: str) -> str:
+    return " ".join(text.split()).casefold()
+
+
+def response_cache_key(mode: str, model: str, personality_key: str, system_prompt_hash: str, messages: list[dict]) -> str:
+    """Hash the normalized (mode, model, personality, prompt hash, history, query) tuple.
+
+    ``messages`` excludes the persona system prompt (``system_prompt_hash``
+    stands for it) but keeps every other message, including the system note
+    summarizing compacted history, so different earlier turns never share a key.
+    """
+    turns = [[m.get("role"), normalize_query(str(m.get("content") or ""))] for m in messages]
+    material = json.dumps(
+        [mode, model, personality_key, system_prompt_hash, turns],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def cache_directive(value, cache_control: str | None = None) -> str:
+    """Map the body's ``cache`` field or a ``Cache-Control`` header to use/refresh/bypass."""
+    if isinstance(value, str) and value.strip().lower() in {"bypass", "refresh"}:
+        return value.strip().lower()
+    if value is False:
+        return "bypass"
+    directives = {part.strip().lower() for part in (cache_control or "").split(",")}
+    if "no-store" in directives:
+        return "bypass"
+    if "no-cache" in directives:
+        return "refresh"
+    return "use"
+
+
+SEMANTIC_WORD_RE = re.compile(r"\w+")
+SEMANTIC_GUARD_RE = re.compile(r"\d+|\b(?:not|no|never|without)\b|n't")
+SEMANTIC_STOPWORDS = frozenset(
+    "a an the of in on at by for to from with and or is are was were be been am do does did "
+    "what whats how why who which this that these those it its there me my i you your please "
+    "tell give can could would about latest recent news".split()
+)
+
+
+def semantic_guard(text: str) -> list[str]:
+    """Numbers and negations in ``text``; two queries only match when these agree."""
+    return sorted(set(SEMANTIC_GUARD_RE.findall(text.casefold())))
+
+
+class HashingEmbedder:
+    """Feature-hashed stemmed words, word bigrams and character trigrams, L2-normalized.
+
+    Lexical only: it runs anywhere without a model download and catches
+    reordering, filler words and plural/tense changes, but never synonyms
+    ("Naija" vs. "Nigerian"). Those need a sentence-transformers model.
+    """
+
+    default_threshold = 0.8
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    @staticmethod
+    def _stem(word: str) -> str:
+        if len(word) > 5 and word.endswith("ing"):
+            word = word[:-3]
+        elif len(word) > 4 and word.endswith("ed"):
+            word = word[:-2]
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        if len(word) > 3 and word.endswith("e"):
+            word = word[:-1]
+        return word
+
+    def embed(self, text: str) -> list[float]:
+        words = [self._stem(w) for w in SEMANTIC_WORD_RE.findall(text.casefold()) if w not in SEMANTIC_STOPWORDS]
+        features = [(f"w:{word}", 1.0) for word in words]
+        features += [(f"b:{left} {right}", 0.5) for left, right in zip(words, words[1:])]
+        for word in words:
+            padded = f"<{word}>"
+            features += [(f"c:{padded[i:i + 3]}", 0.25) for i in range(len(padded) - 2)]
+        vector = [0.0] * self.dim
+        for feature, weight in features:
+            bucket = zlib.crc32(feature.encode("utf-8"))
+            vector[bucket % self.dim] += weight if bucket & 0x80000000 else -weight
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+
+class SentenceTransformerEmbedder:
+    """A local sentence-transformers model (CPU by default)."""
+
+    default_threshold = 0.85
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = f"st-{model_name}"
+
+    def embed(self, text: str) -> list[float]:
+        return [float(x) for x in self.model.encode(text, normalize_embeddings=True)]
+
+
+def make_embedder(model: str, dim: int):
+    """The embedder named by ``SEMANTIC_CACHE_MODEL``.
+
+    ``auto`` means ``SEMANTIC_CACHE_DEFAULT_MODEL`` when sentence-transformers
+    is installed and the hashing embedder otherwise. A model that cannot be
+    loaded also falls back to hashing, with a warning.
+    """
+    if model == "auto":
+        if importlib.util.find_spec("sentence_transformers") is None:
+            return HashingEmbedder(dim)
+        model = SEMANTIC_CACHE_DEFAULT_MODEL
+    if model == "hashing":
+        return HashingEmbedder(dim)
+    try:
+        return SentenceTransformerEmbedder(model)
+    except Exception as exc:
+        logger.warning("Semantic cache model %s unavailable (%s); using the hashing embedder", model, exc)
+        return HashingEmbedder(dim)
+
+
+class SemanticIndex:
+    """Fixed-capacity cosine-similarity index of past queries, evicting the least recently used.
+
+    Each entry points at the exact ``response_cache_key`` holding its answer
+    and belongs to one scope, so only answers for the same mode, model and
+    persona compare. Vectors sit in one NumPy matrix when NumPy is installed
+    and in plain lists otherwise.
+    """
+
+    def __init__(self, dim: int, capacity: int):
+        self.dim = dim
+        self.capacity = capacity
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32) if np is not None else [None] * capacity
+        self._scope_ids = np.full(capacity, -1, dtype=np.int32) if np is not None else None
+        self._entries: list[dict | None] = [None] * capacity
+        self._scope_codes: dict[str, int] = {}
+        self._scope_slots: dict[str, set[int]] = {}
+        self._slot_by_key: dict[str, int] = {}
+        self._lru: OrderedDict[int, None] = OrderedDict()
+        self._free = list(range(capacity - 1, -1, -1))
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    def _release(self, slot: int) -> None:
+        entry = self._entries[slot]
+        self._entries[slot] = None
+        self._lru.pop(slot, None)
+        self._slot_by_key.pop(entry["key"], None)
+        self._scope_slots[entry["scope"]].discard(slot)
+        if np is not None:
+            self._scope_ids[slot] = -1
+        self._free.append(slot)
+
+    def add(self, vector: list[float], entry: dict) -> None:
+        slot = self._slot_by_key.get(entry["key"])
+        if slot is not None:
+            self._release(slot)
+        if not self._free:
+            self._release(next(iter(self._lru)))
+            self.evictions += 1
+        slot = self._free.pop()
+        self._entries[slot] = entry
+        self._slot_by_key[entry["key"]] = slot
+        self._scope_slots.setdefault(entry["scope"], set()).add(slot)
+        self._lru[slot] = None
+        if np is not None:
+            self._vectors[slot] = vector
+            self._scope_ids[slot] = self._scope_codes.setdefault(entry["scope"], len(self._scope_codes))
+        else:
+            self._vectors[slot] = vector
+
+    def remove(self, key: str) -> None:
+        slot = self._slot_by_key.get(key)
+        if slot is not None:
+            self._release(slot)
+
+    def _candidates(self, vector: list[float], scope: str, threshold: float) -> list[tuple[float, int]]:
+        if np is not None:
+            code = self._scope_codes.get(scope)
+            if code is None:
+                return []
+            sims = self._vectors @ np.asarray(vector, dtype=np.float32)
+            sims[self._scope_ids != code] = -1.0
+            slots = np.flatnonzero(sims >= threshold)
+            return sorted(((float(sims[slot]), int(slot)) for slot in slots), reverse=True)
+        # Hashed query vectors are sparse, so only their non-zero dimensions are multiplied.
+        dims = [i for i, x in enumerate(vector) if x]
+        if not dims:
+            return []
+        weights = [vector[i] for i in dims]
+        pick = operator.itemgetter(*dims) if len(dims) > 1 else (lambda row: (row[dims[0]],))
+        scored = [(sum(map(operator.mul, weights, pick(self._vectors[slot]))), slot) for slot in self._scope_slots.get(scope, ())]
+        return sorted((item for item in scored if item[0] >= threshold), reverse=True)
+
+    def search(self, vector: list[float], scope: str, guard: list[str], threshold: float) -> tuple[dict, float] | None:
+        """Best live entry in ``scope`` at or above ``threshold`` whose guard tokens match."""
+        now = time.time()
+        for similarity, slot in self._candidates(vector, scope, threshold):
+            entry = self._entries[slot]
+            if entry["expires"] <= now:
+                self._release(slot)
+                continue
+            if entry["guard"] == guard:
+                self._lru.move_to_end(slot)
+                return entry, similarity
+        return None
+
+    def export(self) -> list[dict]:
+        now = time.time()
+        rows = []
+        for slot in self._lru:
+            entry = self._entries[slot]
+            if entry["expires"] > now:
+                vector = self._vectors[slot]
+                packed = vector.tobytes() if np is not None else array.array("f", vector).tobytes()
+                rows.append({**entry, "vector": base64.b64encode(packed).decode("ascii")})
+        return rows
+
+    def load(self, rows: list[dict]) -> None:
+        now = time.time()
+        for row in rows[-self.capacity:]:
+            if row.get("expires", 0) <= now:
+                continue
+            packed = array.array("f")
+            packed.frombytes(base64.b64decode(row.pop("vector")))
+            if len(packed) == self.dim:
+                self.add(list(packed), row)
+
+
+class SemanticCache:
+    """Near-duplicate lookups for the response cache.
+
+    Single-turn /api/ask queries are embedded and indexed next to their exact
+    cache key; a later query whose embedding is at least ``threshold``
+    cosine-similar in the same scope reuses that stored answer. The index is
+    saved to ``path`` every ``save_interval`` seconds when it changed, and on
+    exit, and reloaded at startup when the embedder matches. Workers share the
+    file: each save merges in the entries other workers saved before replacing
+    it.
+    """
+
+    def __init__(self, embedder, *, threshold: float, max_entries: int, path: str | None = None, save_interval: float = 60):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.path = path
+        self.save_interval = save_interval
+        self.index = SemanticIndex(embedder.dim, max_entries)
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._latencies = deque(maxlen=1000)
+        self.counters = {"lookups": 0, "hits": 0, "misses": 0, "stores": 0, "stale": 0}
+        self._load()
+        if path:
+            atexit.register(self.save)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def lookup(self, scope: str, query: str) -> tuple[str, dict] | None:
+        """``(cache_key, match)`` for the closest earlier query, with ``match`` describing it."""
+        started = time.perf_counter()
+        vector = self.embedder.embed(query)
+        with self._lock:
+            self.counters["lookups"] += 1
+            found = self.index.search(vector, scope, semantic_guard(query), self.threshold)
+            self.counters["hits" if found else "misses"] += 1
+            self._latencies.append(time.perf_counter() - started)
+        if found is None:
+            return None
+        entry, similarity = found
+        return entry["key"], {"query": entry["query"], "similarity": round(similarity, 4)}
+
+    def remember(self, scope: str, query: str, key: str, ttl: float) -> None:
+        vector = self.embedder.embed(query)
+        entry = {"key": key, "query": query, "scope": scope, "guard": semantic_guard(query), "expires": time.time() + ttl}
+        with self._lock:
+            self.index.add(vector, entry)
+            self.counters["stores"] += 1
+            self._dirty = True
+        self._maybe_save()
+
+    def forget(self, key: str) -> None:
+        """Drop an entry whose answer has left the response store."""
+        with self._lock:
+            self.index.remove(key)
+            self.counters["stale"] += 1
+            self._dirty = True
+
+    def _maybe_save(self) -> None:
+        if not self.path or self.save_interval <= 0 or time.monotonic() - self._saved_at < self.save_interval:
+            return
+        if self._save_lock.acquire(blocking=False):
+            self._save_lock.release()
+            threading.Thread(target=self.save, name="semantic-cache-save", daemon=True).start()
+
+    def save(self) -> None:
+        if not self.path or not self._save_lock.acquire(blocking=False):
+            return
+        try:
+            with self._lock:
+                if not self._dirty:
+                    return
+                rows = self.index.export()
+                self._dirty = False
+                self._saved_at = time.monotonic()
+            rows = self._merge_saved(rows)
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # The atomic replace keeps the file whole when workers save at the same time.
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as fh:
+                json.dump({"embedder": self.embedder.name, "dim": self.embedder.dim, "entries": rows}, fh, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as exc:
+            logger.warning("Could not save the semantic cache index: %s", exc)
+        finally:
+            self._save_lock.release()
+
+    def _merge_saved(self, rows: list[dict]) -> list[dict]:
+        """``rows`` after the live entries already in the file that they do not replace (oldest first)."""
+        ours = {row["key"] for row in rows}
+        now = time.time()
+        theirs = [
+            row for row in self._read_saved(quiet=True)
+            if row.get("key") not in ours and row.get("expires", 0) > now
+        ]
+        return (theirs + rows)[-self.index.capacity:]
+
+    def _read_saved(self, quiet: bool = False) -> list[dict]:
+        if not self.path or not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError) as exc:
+            logger.warning("Ignoring unreadable semantic cache index %s: %s", self.path, exc)
+            return []
+        if data.get("embedder") != self.embedder.name or data.get("dim") != self.embedder.dim:
+            if not quiet:
+                logger.info("Semantic cache index %s was built by another embedder; starting empty", self.path)
+            return []
+        return data.get("entries") or []
+
+    def _load(self) -> None:
+        self.index.load(self._read_saved())
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            latencies = list(self._latencies)
+            counters["entries"] = len(self.index)
+            counters["evictions"] = self.index.evictions
+        counters["hit_rate"] = round(counters["hits"] / counters["lookups"], 4) if counters["lookups"] else 0.0
+        counters["lookup_p50_ms"] = round(1000 * percentile(latencies, 50), 3)
+        counters["lookup_p95_ms"] = round(1000 * percentile(latencies, 95), 3)
+        counters["capacity"] = self.index.capacity
+        counters["threshold"] = self.threshold
+        counters["embedder"] = self.embedder.name
+        counters["search"] = "numpy" if np is not None else "python"
+        return counters
+
+
+class ResponseCache:
+    """Answer cache for /api/ask keyed by ``response_cache_key``.
+
+    Payloads are stored as JSON in a ``make_store`` backend, so hits come back
+    with exactly the shape (and normalized citations) of the original answer.
+    """
+
+    def __init__(self, store, *, enabled: bool = True, semantic: SemanticCache | None = None):
+        self.store = store
+        self.enabled = enabled
+        self.semantic = semantic
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "semantic_hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "errors": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def lookup(self, plan: dict) -> dict | None:
+        cache = plan.get("cache")
+        if not self.enabled or not cache:
+            return None
+        if cache["directive"] != "use":
+            self._count("bypassed")
+            return None
+        try:
+            raw = self.store.get(cache["key"])
+            if raw is None and self.semantic is not None and cache.get("scope"):
+                return self._semantic_lookup(cache["scope"], plan["query"])
+        except Exception as exc:
+            self._count("errors")
+            logger.warning("Response cache read failed: %s", exc)
+            return None
+        if raw is None:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return json.loads(raw)
+
+    def _semantic_lookup(self, scope: str, query: str) -> dict | None:
+        with timed("semantic"):
+            found = self.semantic.lookup(scope, query)
+            raw = self.store.get(found[0]) if found else None
+        if found and raw is None:
+            self.semantic.forget(found[0])
+        if raw is None:
+            self._count("misses")
+            return None
+        self._count("hits")
+        self._count("semantic_hits")
+        payload = json.loads(raw)
+        payload["semantic_match"] = found[1]
+        return payload
+
+    def remember(self, plan: dict, payload: dict) -> None:
+        cache = plan.get("cache")
+        if not self.enabled or not cache or cache["directive"] == "bypass":
+            return
+        try:
+            self.store.set(cache["key"], json.dumps(payload, ensure_ascii=False), cache["ttl"])
+            self._count("stores")
+            if self.semantic is not None and cache.get("scope"):
+                self.semantic.remember(cache["scope"], plan["query"], cache["key"], cache["ttl"])
+        except Exception as exc:
+            self._count("errors")
+            logger.warning("Response cache write failed: %s", exc)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters["hits"] + counters["misses"]
+        counters["hit_ratio"] = round(counters["hits"] / lookups, 4) if lookups else 0.0
+        counters["backend"] = type(self.store).__name__
+        counters["enabled"] = self.enabled
+        try:
+            counters["entries"] = len(self.store)
+        except Exception:
+            counters["entries"] = None
+        if self.semantic is not None:
+            counters["semantic"] = self.semantic.stats()
+        return counters
+
+
+def make_semantic_cache() -> SemanticCache | None:
+    if not (RESPONSE_CACHE_ENABLED and SEMANTIC_CACHE_ENABLED and SEMANTIC_CACHE_MAX_ENTRIES > 0):
+        return None
+    embedder = make_embedder(SEMANTIC_CACHE_MODEL, SEMANTIC_CACHE_DIM)
+    return SemanticCache(
+        embedder,
+        threshold=SEMANTIC_CACHE_THRESHOLD or embedder.default_threshold,
+        max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+        path=SEMANTIC_CACHE_PATH,
+        save_interval=SEMANTIC_CACHE_SAVE_INTERVAL,
+    )
+
+
+response_cache = ResponseCache(
+    make_store(RESPONSE_CACHE_BACKEND, "responses", RESPONSE_CACHE_MAX_ENTRIES),
+    enabled=RESPONSE_CACHE_ENABLED,
+    semantic=make_semantic_cache(),
+)
+
+
+def cached_answer_events(payload: dict) -> list[str]:
+    """Replay a cached /api/ask payload as the SSE events a live stream would send."""
+    events = []
+    if payload.get("answer"):
+        events.append(sse_event("token", {"delta": payload["answer"]}))
+    events.append(sse_event("citations", {"citations": payload.get("citations", [])}))
+    done = {"personality": payload.get("personality")}
+    for key in ("mode", "context", "routing"):
+        if payload.get(key):
+            done[key] = payload[key]
+    events.append(sse_event("done", done))
+    return events
+
+
+class StreamFlight:
+    """One upstream answer stream fanned out to every request that joined it.
+
+    The pump thread calls ``start``/``publish``/``close`` (or ``fail`` with a
+    ``(payload, status)`` pair if the stream never opened); subscribers
+    replay every buffered event from the beginning, so late joiners still
+    receive the whole answer. The pump stops early once ``abandoned``.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.events: list[str] = []
+        self.response: tuple[dict, int] | None = None
+        self.result: dict | None = None
+        self.started = False
+        self.closed = False
+        self.subscribers = 0
+        self.abandoned = False
+
+    def start(self) -> None:
+        with self._cond:
+            self.started = True
+            self._cond.notify_all()
+
+    def publish(self, event: str) -> None:
+        with self._cond:
+            self.events.append(event)
+            self._cond.notify_all()
+
+    def fail(self, response: tuple[dict, int]) -> None:
+        with self._cond:
+            self.response = response
+            self.closed = True
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def wait_started(self) -> tuple[dict, int] | None:
+        """Block until the upstream stream opened; returns the failure response if it did not."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.started or self.closed)
+            if self.started:
+                return None
+            return self.response or ({"error": "Upstream stream unavailable"}, 502)
+
+    def subscribe(self):
+        """Yield every event; when the last subscriber leaves before the end, the flight is ``abandoned``."""
+        index = 0
+        with self._cond:
+            self.subscribers += 1
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: index < len(self.events) or self.closed)
+                    batch = self.events[index:]
+                    index += len(batch)
+                    closed = self.closed
+                yield from batch
+                if closed and index >= len(self.events):
+                    return
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+                if not self.subscribers and not self.closed:
+                    self.abandoned = True
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """Coalesces concurrent identical upstream calls onto a single leader.
+
+    ``do`` runs ``fn`` once per key while a call is in flight and hands every
+    concurrent caller the same result (or exception); ``stream`` does the same
+    for streaming answers through a shared ``StreamFlight``.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._calls: dict[str, _Call] = {}
+        self._streams: dict[str, StreamFlight] = {}
+        self.counters = {"leaders": 0, "followers": 0}
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def do(self, key: str, fn):
+        if not self.enabled:
+            return fn()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            self.counters["leaders" if leader else "followers"] += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stream(self, key: str | None, pump) -> StreamFlight:
+        """Join the in-flight stream for ``key`` or start ``pump(flight)`` on a worker thread."""
+        leader = True
+        if self.enabled and key is not None:
+            with self._lock:
+                flight = self._streams.get(key)
+                # An abandoned flight is winding down without its ending; start afresh.
+                leader = flight is None or flight.abandoned
+                if leader:
+                    flight = StreamFlight()
+                    self._streams[key] = flight
+                self.counters["leaders" if leader else "followers"] += 1
+        else:
+            flight = StreamFlight()
+        if leader:
+            # The pump reports upstream phases to the leader's request timings.
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(self._pump, key, flight, pump), daemon=True).start()
+        return flight
+
+    def _pump(self, key: str | None, flight: StreamFlight, pump) -> None:
+        try:
+            pump(flight)
+        except Exception:
+            logger.exception("Streaming pump failed")
+            if not flight.started:
+                flight.fail(({"error": "Upstream stream unavailable"}, 502))
+            else:
+                flight.publish(sse_event("error", {"error": "Upstream stream interrupted"}))
+        finally:
+            if key is not None:
+                with self._lock:
+                    if self._streams.get(key) is flight:
+                        del self._streams[key]
+            flight.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            counters["in_flight"] = len(self._calls) + len(self._streams)
+        counters["enabled"] = self.enabled
+        return counters
+
+
+ask_flights = SingleFlight(enabled=SINGLE_FLIGHT_ENABLED)
+
+
+@lru_cache(maxsize=32)
+def _token_encoder(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    except Exception:
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str | None, model: str | None = None) -> int:
+    """Token count for ``model``: exact with tiktoken installed, ~4 chars per token otherwise."""
+    if not text:
+        return 0
+    encoder = _token_encoder((model or "").split("/")[-1])
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def message_tokens(message: dict, model: str | None = None) -> int:
+    return MESSAGE_TOKEN_OVERHEAD + count_tokens(str(message.get("content") or ""), model)
+
+
+personas = PersonaRegistry(
+    {
+        "pidgin": (PERSONALITY_PIDGIN_PATH, PIDGIN_PROMPT_FALLBACK, "Sasu Jnr (Pidgin)"),
+        "fluent": (PERSONALITY_FLUENT_PATH, FLUENT_PROMPT_FALLBACK, "Fluent English"),
+    },
+    PERSONAS_DIR,
+    DEFAULT_PERSONALITY,
+    PERSONA_RELOAD_INTERVAL,
+)
+
+
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s|\n")
+
+
+def summarize_turns(turns: list[dict], model: str, budget: int) -> str:
+    """Cheap extractive summary: the opening sentence of each dropped turn, newest first, within ``budget`` tokens."""
+    lines = []
+    used = 0
+    for message in reversed(turns):
+        content = " ".join(str(message.get("content") or "").split())
+        if not content:
+            continue
+        first = SENTENCE_END_RE.split(content, maxsplit=1)[0][:160]
+        line = f"- {message.get('role')}: {first}"
+        cost = count_tokens(line, model)
+        if used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+    if not lines:
+        return ""
+    lines.reverse()
+    return "Summary of earlier turns in this conversation (older messages were trimmed):\n" + "\n".join(lines)
+
+
+def compact_history(history: list[dict], model: str) -> tuple[list[dict], dict | None]:
+    """Trim client-supplied history to the model's token budget, keeping the newest turns.
+
+    Dropped turns are replaced by a short summary note when
+    ``HISTORY_COMPACTION=summarize``. Returns the turns to send and a report
+    of what was trimmed (``None`` when everything fit).
+    """
+    budget = HISTORY_TOKEN_BUDGETS.get(model, HISTORY_TOKEN_BUDGET)
+    if HISTORY_COMPACTION == "off" or budget <= 0 or not history:
+        return history, None
+
+    costs = [message_tokens(m, model) for m in history]
+    total = sum(costs)
+    if total <= budget:
+        return history, None
+
+    summarize = HISTORY_COMPACTION == "summarize"
+    allowance = budget - (HISTORY_SUMMARY_TOKENS if summarize else 0)
+    keep_from = len(history)
+    kept_tokens = 0
+    for idx in range(len(history) - 1, -1, -1):
+        if kept_tokens + costs[idx] > allowance:
+            break
+        kept_tokens += costs[idx]
+        keep_from = idx
+    # Start the kept window on a user turn so roles still alternate after the system prompt.
+    while keep_from < len(history) and history[keep_from].get("role") == "assistant":
+        kept_tokens -= costs[keep_from]
+        keep_from += 1
+
+    kept = history[keep_from:]
+    report = {
+        "history_turns": len(history),
+        "kept_turns": len(kept),
+        "trimmed_turns": keep_from,
+        "history_tokens": total,
+        "kept_tokens": kept_tokens,
+        "summarized": False,
+    }
+    if summarize:
+        summary = summarize_turns(history[:keep_from], model, HISTORY_SUMMARY_TOKENS)
+        if summary:
+            kept = [{"role": "system", "content": summary}] + kept
+            report["summarized"] = True
+    return kept, report
+
+
+CONVERSATION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+
+def clean_turns(items) -> list[dict]:
+    if not isinstance(items, list):
+        return []
+    return [
+        {"role": m["role"], "content": m["content"]}
+        for m in items
+        if isinstance(m, dict)
+        and m.get("role") in {"user", "assistant"}
+        and isinstance(m.get("content"), str)
+    ]
+
+
+class ConversationStore:
+    """Server-side conversation turns, so clients post only the new question.
+
+    Turns live as one JSON list per conversation in a ``make_store`` backend;
+    every append slides the TTL and trims the oldest turns to stay within the
+    turn and byte caps.
+    """
+
+    def __init__(self, store, *, ttl: int, max_turns: int, max_bytes: int):
+        self.store = store
+        self.ttl = ttl
+        self.max_turns = max(2, max_turns)
+        self.max_bytes = max(1024, max_bytes)
+        self._lock = threading.Lock()
+
+    def _save(self, conversation_id: str, turns: list[dict]) -> None:
+        turns = turns[-self.max_turns:]
+        encoded = json.dumps(turns, ensure_ascii=False)
+        while len(turns) > 1 and len(encoded.encode("utf-8")) > self.max_bytes:
+            turns = turns[2:] if len(turns) > 2 else turns[1:]
+            encoded = json.dumps(turns, ensure_ascii=False)
+        self.store.set(conversation_id, encoded, self.ttl)
+
+    def create(self, seed=None) -> str:
+        conversation_id = secrets.token_urlsafe(16)
+        self._save(conversation_id, clean_turns(seed))
+        return conversation_id
+
+    def load(self, conversation_id: str | None) -> list[dict] | None:
+        if not isinstance(conversation_id, str) or not CONVERSATION_ID_RE.match(conversation_id):
+            return None
+        raw = self.store.get(conversation_id)
+        return json.loads(raw) if raw is not None else None
+
+    def append(self, conversation_id: str, *turns: dict) -> None:
+        with self._lock:
+            existing = self.load(conversation_id)
+            if existing is None:
+                return
+            self._save(conversation_id, existing + clean_turns(list(turns)))
+
+    def delete(self, conversation_id: str) -> None:
+        if isinstance(conversation_id, str) and CONVERSATION_ID_RE.match(conversation_id):
+            self.store.delete(conversation_id)
+
+
+conversations = ConversationStore(
+    make_store(CONVERSATION_BACKEND, "conversations", CONVERSATION_MAX_SESSIONS),
+    ttl=CONVERSATION_TTL,
+    max_turns=CONVERSATION_MAX_TURNS,
+    max_bytes=CONVERSATION_MAX_BYTES,
+)
+
+
+def record_conversation_turn(plan: dict, payload: dict | None, status: int = 200) -> None:
+    """Append the question and its answer to the plan's server-side conversation, if any."""
+    conversation_id = plan.get("conversation_id")
+    if not conversation_id or status != 200 or not payload or payload.get("web_search_disabled"):
+        return
+    answer = payload.get("answer")
+    if not isinstance(answer, str):
+        return
+    try:
+        conversations.append(
+            conversation_id,
+            {"role": "user", "content": plan["query"]},
+            {"role": "assistant", "content": answer},
+        )
+    except Exception as exc:
+        logger.warning("Failed to record conversation turn: %s", exc)
+
+
+def client_ip(forwarded_for: str | None, remote_addr: str | None) -> str:
+    """Caller address: the first ``X-Forwarded-For`` hop when present, else the socket peer."""
+    return (forwarded_for or remote_addr or "").split(",")[0].strip()
+
+
+class RateLimiter:
+    """Per-client token buckets (one per IP, one per session) over a shared store."""
+
+    def __init__(self, store, enabled: bool = True):
+        self.store = store
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.counters = {"allowed": 0, "limited_ip": 0, "limited_session": 0}
+
+    def limits(self, ip: str, session_id: str | None = None) -> list[tuple[str, str, float, float]]:
+        """The ``(kind, identity, per_minute, burst)`` buckets a request from this caller draws on."""
+        if not self.enabled:
+            return []
+        limits = [("ip", ip, RATE_LIMIT_IP_PER_MINUTE, max(1.0, RATE_LIMIT_IP_BURST))]
+        if session_id:
+            limits.append(("session", session_id, RATE_LIMIT_SESSION_PER_MINUTE, max(1.0, RATE_LIMIT_SESSION_BURST)))
+        return [limit for limit in limits if limit[2] > 0 and limit[1]]
+
+    def capacity(self, ip: str, session_id: str | None = None) -> float | None:
+        """Most tokens one request from this caller can ever take at once, or None when unlimited."""
+        return min((burst for *_, burst in self.limits(ip, session_id)), default=None)
+
+    def check(self, ip: str, session_id: str | None = None, cost: float = 1.0) -> float:
+        """Take ``cost`` tokens for this caller; ``0`` when admitted, else seconds to wait."""
+        if not self.enabled:
+            return 0.0
+        for kind, identity, per_minute, burst in self.limits(ip, session_id):
+            wait = self.store.take(f"{kind}:{identity}", per_minute / 60, burst, cost)
+            if wait > 0:
+                with self._lock:
+                    self.counters[f"limited_{kind}"] += 1
+                return wait
+        with self._lock:
+            self.counters["allowed"] += 1
+        return 0.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters, enabled=self.enabled)
+
+
+class AdmissionGate:
+    """Process-wide cap on in-flight provider requests with a bounded wait queue.
+
+    Up to ``max_concurrent`` requests run at once; up to ``max_queue`` more
+    wait at most ``queue_timeout`` seconds for a slot. Anything beyond that
+    is refused straight away so overload turns into fast 429s rather than a
+    pile-up of blocked workers.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.counters = {"admitted": 0, "queued": 0, "rejected_queue_full": 0, "rejected_timeout": 0}
+
+    def acquire(self) -> bool:
+        if self.max_concurrent <= 0:
+            return True
+        with self._cond:
+            if self.active < self.max_concurrent and not self.waiting:
+                self.active += 1
+                self.counters["admitted"] += 1
+                return True
+            if self.waiting >= self.max_queue:
+                self.counters["rejected_queue_full"] += 1
+                return False
+            self.waiting += 1
+            self.counters["queued"] += 1
+            try:
+                admitted = self._cond.wait_for(lambda: self.active < self.max_concurrent, timeout=self.queue_timeout)
+            finally:
+                self.waiting -= 1
+            if not admitted:
+                self.counters["rejected_timeout"] += 1
+                return False
+            self.active += 1
+            self.counters["admitted"] += 1
+            return True
+
+    def release(self) -> None:
+        if self.max_concurrent <= 0:
+            return
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return dict(
+                self.counters,
+                active=self.active,
+                waiting=self.waiting,
+                max_concurrent=self.max_concurrent,
+                max_queue=self.max_queue,
+            )
+
+
+rate_limiter = RateLimiter(
+    make_store(RATE_LIMIT_BACKEND, "ratelimit", RATE_LIMIT_MAX_CLIENTS),
+    enabled=RATE_LIMIT_ENABLED,
+)
+admission_gate = AdmissionGate(ADMISSION_MAX_CONCURRENT, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT)
+
+
+def request_session_id(data: dict, header_value: str | None) -> str | None:
+    session_id = header_value or data.get("conversation_id")
+    return str(session_id)[:128] if session_id else None
+
+
+def rate_limited_payload(wait: float) -> tuple[dict, int, dict[str, str]]:
+    retry_after = max(1, int(wait + 0.999))
+    payload = {"error": "Too many requests. Please slow down.", "retry_after": retry_after}
+    return payload, 429, {"Retry-After": str(retry_after)}
+
+
+def batch_rate_limit(ip: str, session_id: str | None, data: dict) -> tuple[dict, int, dict[str, str]] | None:
+    """Charge a batch one rate-limit token per entry; the refusal to send, or None when admitted.
+
+    A batch is admitted whole or not at all. One holding more entries than
+    the caller's burst could never be admitted, so it is refused outright
+    rather than told to retry.
+    """
+    queries = data.get("queries")
+    cost = min(len(queries), BATCH_MAX_ITEMS) if isinstance(queries, list) and queries else 1
+    capacity = rate_limiter.capacity(ip, session_id)
+    if capacity is not None and cost > capacity:
+        return {"error": f"A batch from this client holds at most {int(capacity)} queries"}, 413, {}
+    wait = rate_limiter.check(ip, session_id, cost)
+    return rate_limited_payload(wait) if wait > 0 else None
+
+
+def overloaded_payload() -> tuple[dict, int, dict[str, str]]:
+    retry_after = max(1, int(ADMISSION_QUEUE_TIMEOUT))
+    payload = {"error": "Server is busy. Please retry shortly.", "retry_after": retry_after}
+    return payload, 429, {"Retry-After": str(retry_after)}
+
+
+def admitted(view):
+    """Rate-limit and admission-gate a provider-calling route.
+
+    The concurrency slot is held until the response is closed, so streamed
+    answers keep it for as long as they are being relayed.
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with timed("parse"):
+            data = request.get_json(silent=True) or {}
+        ip = client_ip(request.headers.get("X-Forwarded-For"), request.remote_addr)
+        wait = rate_limiter.check(ip, request_session_id(data, request.headers.get(SESSION_ID_HEADER)))
+        if wait > 0:
+            payload, status, headers = rate_limited_payload(wait)
+            return jsonify(payload), status, headers
+        if not admission_gate.acquire():
+            payload, status, headers = overloaded_payload()
+            return jsonify(payload), status, headers
+        try:
+            resp = make_response(view(*args, **kwargs))
+        except BaseException:
+            admission_gate.release()
+            raise
+        if resp.is_streamed:
+            resp.call_on_close(admission_gate.release)
+        else:
+            admission_gate.release()
+        return resp
+
+    return wrapper
+
+
+WEB_MODES = {"web", "web-search", "search", "perplexity"}
+
+
+def add_completion_hints(payload: dict, persona: Persona | None, stream: bool) -> None:
+    """Ask for usage on streamed replies and tag requests that open with ``persona``'s system prompt.
+
+    The persona prompt is always the first message and byte-identical
+    between turns, so providers can serve it from their prompt cache;
+    ``prompt_cache_request`` turns the key into each provider's own hint.
+    """
+    if stream:
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
+    if PROMPT_CACHE_HINTS and persona is not None:
+        payload["prompt_cache_key"] = prompt_cache_key(persona)
+
+
+def plan_ask(data: dict, cache_control: str | None = None) -> dict:
+    """Validate an /api/ask body and work out what to send upstream.
+
+    The plan carries ``personality``, ``web``, ``stream``, ``messages`` and the
+    response ``cache`` entry plus, for chat mode, the completion ``payload``
+    and, with ``"model": "auto"``, the ``routing`` picked by ``model_router``.
+    With a ``conversation_id`` the history comes from the server-side
+    conversation instead of the body. When ``response`` is set the request is
+    answered locally with that ``(payload, status)`` pair. Shared by the Flask
+    route and the async ASGI path.
+    """
+    query = data.get("query")
+    history = data.get("history", [])  # [{role, content}]
+    model = data.get("model") or CHAT_DEFAULT_MODEL
+    persona = personas.resolve(data.get("personality"))
+    personality_key, system_prompt = persona.key, persona.prompt
+    mode = (data.get("mode") or "chat").strip().lower()
+    is_web_mode = mode in WEB_MODES
+    note_request_labels(mode="web" if is_web_mode else "chat", model=PPLX_MODEL if is_web_mode else model, persona=persona.key)
+    plan = {
+        "personality": personality_key,
+        "web": is_web_mode,
+        "stream": wants_stream(data.get("stream")),
+    }
+
+    if not is_web_mode and not OPENAI_API_KEY and not OPENROUTER_API_KEY:
+        plan["response"] = ({"error": "Server missing OPENAI_API_KEY or OPENROUTER_API_KEY"}, 500)
+        return plan
+
+    if not query or not isinstance(query, str):
+        plan["response"] = ({"error": "Query is required as a string"}, 400)
+        return plan
+    plan["query"] = query
+
+    conversation_id = data.get("conversation_id")
+    if conversation_id:
+        history = conversations.load(conversation_id)
+        if history is None:
+            plan["response"] = ({"error": "Conversation not found or expired", "conversation_expired": True}, 404)
+            return plan
+        plan["conversation_id"] = conversation_id
+
+    with timed("cutoff"):
+        post_cutoff = not is_web_mode and references_post_cutoff(query, history)
+    if post_cutoff:
+        plan["response"] = ({
+            "answer": cutoff_message(personality_key),
+            "citations": [],
+            "personality": personality_key,
+            "knowledge_cutoff": KNOWLEDGE_CUTOFF_LABEL,
+        }, 200)
+        return plan
+
+    with timed("build"):
+        messages = []
+        if INJECT_SYSTEM_PROMPT and system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+
+        if not isinstance(history, list):
+            history = []
+        turns = [m for m in history if isinstance(m, dict) and {"role", "content"} <= set(m.keys())]
+        if not is_web_mode and isinstance(model, str) and model.strip().lower() == MODEL_AUTO:
+            plan["routing"] = model_router.choose(query, turns, plan["stream"])
+            model = plan["routing"]["model"]
+            note_request_labels(model=model)
+        turns, context = compact_history(turns, PPLX_MODEL if is_web_mode else model)
+        if context:
+            plan["context"] = context
+        messages.extend(turns)
+        messages.append({"role": "user", "content": query})
+        plan["messages"] = messages
+        plan["cache"] = {
+            "key": response_cache_key(
+                "web" if is_web_mode else "chat",
+                PPLX_MODEL if is_web_mode else model,
+                personality_key,
+                persona.hash,
+                turns + [messages[-1]],
+            ),
+            "ttl": RESPONSE_CACHE_TTL_WEB if is_web_mode else RESPONSE_CACHE_TTL_CHAT,
+            "directive": cache_directive(data.get("cache"), cache_control),
+        }
+        if not turns and not context:
+            # Only standalone questions may reuse a paraphrase's answer.
+            plan["cache"]["scope"] = "|".join(("web" if is_web_mode else "chat", PPLX_MODEL if is_web_mode else model, personality_key, persona.hash))
+
+        if not is_web_mode:
+            payload = {
+                "model": model,
+                "messages": messages,
+                "temperature": 0.65,
+                "top_p": 0.9,
+            }
+            add_completion_hints(payload, persona if INJECT_SYSTEM_PROMPT and system_prompt else None, plan["stream"])
+            plan["payload"] = payload
+    return plan
+
+
+def plan_chat(body: dict) -> dict:
+    """Validate an /api/chat body; same plan shape as ``plan_ask``."""
+    if not OPENAI_API_KEY and not OPENROUTER_API_KEY:
+        return {"response": ({"error": "Server missing OPENAI_API_KEY or OPENROUTER_API_KEY"}, 500)}
+
+    messages = body.get("messages")
+    model = body.get("model") or CHAT_DEFAULT_MODEL
+    persona = personas.resolve(body.get("personality"))
+    personality_key, system_prompt = persona.key, persona.prompt
+    note_request_labels(mode="chat", model=model, persona=persona.key)
+    plan = {
+        "personality": personality_key,
+        "web": False,
+        "stream": wants_stream(body.get("stream")),
+    }
+
+    if not isinstance(messages, list) or not messages:
+        plan["response"] = ({"error": "Provide 'messages' array like [{role, content}]"}, 400)
+        return plan
+
+    injected = None
+    if INJECT_SYSTEM_PROMPT and system_prompt and body.get("inject_system", True):
+        first_role = messages[0].get("role") if messages else None
+        if first_role != "system":
+            messages = [{"role": "system", "content": system_prompt}] + messages
+            injected = persona
+
+    payload = {
+        "model": model,
+        "messages": messages,
+        "temperature": body.get("temperature", 0.7),
+        "top_p": body.get("top_p", 1),
+    }
+    add_completion_hints(payload, injected, plan["stream"])
+    plan["messages"] = messages
+    plan["payload"] = payload
+    return plan
+
+
+raw_store = make_store(RESPONSE_CACHE_BACKEND, "raw", RESPONSE_CACHE_MAX_ENTRIES) if INCLUDE_RAW else None
+
+
+def attach_raw(payload: dict, out: dict) -> None:
+    """With ``OPENAI_INCLUDE_RAW``, add the upstream body to ``payload``.
+
+    Only the ``OPENAI_RAW_FIELDS`` whitelist is inlined as ``raw``; the full
+    body is kept for ``RAW_TTL`` seconds under ``raw_id`` and served by
+    ``/api/raw/<raw_id>``. A ``*`` whitelist inlines everything, as before.
+    """
+    if not INCLUDE_RAW:
+        return
+    if "*" in RAW_FIELDS:
+        payload["raw"] = out
+        return
+    payload["raw"] = {field: out[field] for field in RAW_FIELDS if field in out}
+    raw_id = secrets.token_urlsafe(12)
+    raw_store.set(raw_id, json.dumps(out), RAW_TTL)
+    payload["raw_id"] = raw_id
+
+
+def extract_answer(out: dict) -> tuple[str | None, list]:
+    """Pull the answer text and any provider citations out of a completion body."""
+    answer_text = None
     citations = []
     try:
-        first_choice = out.get("choices", [{}])[0]
-        message = first_choice.get("message", {})
-        answer_text = message.get("content")
-        # Perplexity returns citations at top-level or within choice/message depending on model
-        citations = (
-            out.get("citations")
-            or first_choice.get("citations")
-            or message.get("citations")
-            or out.get("sources")
-            or []
-        )
-    except Exception:
-        pass
+        first_choice = (out.get("choices", []) or [None])[0] or {}
+        message = first_choice.get("message") or {}
+        answer_text = message.get("content") or out.get("answer")
+        # Perplexity returns citations at top-level or within choice/message depending on model
+        citations = (
+            out.get("citations")
+            or first_choice.get("citations")
+            or message.get("citations")
+            or out.get("sources")
+            or []
+        )
+    except Exception:
+        pass
+    return answer_text, citations
+
+
+def web_answer_payload(out: dict, personality_key: str) -> dict:
+    answer_text, citations = extract_answer(out)
+    prompt_cache_stats.record("web", out.get("usage"))
+    with timed("postprocess"):
+        payload = render_answer(answer_text, citations)
+    payload["personality"] = personality_key
+    payload["mode"] = "web"
+    attach_raw(payload, out)
+    return payload
+
+
+def web_search_disabled_payload(personality_key: str) -> dict:
+    return {
+        "answer": WEB_SEARCH_DISABLED_MESSAGE,
+        "citations": [],
+        "personality": personality_key,
+        "mode": "web",
+        "web_search_disabled": True,
+    }
+
+
+def chat_answer_payload(out: dict, personality_key: str) -> dict:
+    # Expected shape similar to OpenAI/OpenRouter chat completions
+    answer_text, citations = extract_answer(out)
+    prompt_cache_stats.record("chat", out.get("usage"))
+    # Without provider citations, links in the answer itself become the sources.
+    with timed("postprocess"):
+        payload = render_answer(answer_text, citations, link_fallback=True)
+    payload["personality"] = personality_key
+    attach_raw(payload, out)
+    return payload
+
+
+def chat_passthrough_payload(out: dict, personality_key: str) -> dict:
+    choice0 = (out.get("choices", []) or [None])[0] or {}
+    answer = (choice0.get("message") or {}).get("content") or ""
+    prompt_cache_stats.record("chat", out.get("usage"))
+    with timed("postprocess"):
+        answer = strip_inline_citations(answer)
+    payload = {
+        "answer": answer,
+        "personality": personality_key,
+    }
+    attach_raw(payload, out)
+    return payload
+
+
+def upstream_error_details(err_resp, exc: Exception) -> tuple[int, dict]:
+    """Best-effort (status, body) for an upstream HTTP error from requests or httpx."""
+    try:
+        err_json = err_resp.json() if err_resp is not None else {"message": str(exc)}
+    except Exception:
+        err_json = {
+            "message": str(exc),
+            "text": getattr(err_resp, "text", ""),
+        }
+    status_code = getattr(err_resp, "status_code", 502)
+    return status_code, err_json
+
+
+def generate_feedback_csrf() -> str:
+    return feedback_serializer.dumps({"nonce": secrets.token_hex(8)})
+
+
+def validate_feedback_csrf(token: str | None, cookie_token: str | None) -> bool:
+    if not token or not cookie_token or token != cookie_token:
+        return False
+    try:
+        feedback_serializer.loads(token, max_age=3600)
+        return True
+    except (BadSignature, SignatureExpired):
+        return False
+
+
+feedback_dedup = make_store(FEEDBACK_DEDUP_BACKEND, "feedback", FEEDBACK_DEDUP_MAX_ENTRIES)
+
+
+def is_duplicate_feedback(client_ip: str, message: str) -> bool:
+    if not message:
+        return False
+
+    fingerprint = hashlib.sha256(f"{client_ip}|{message}".encode("utf-8")).hexdigest()
+    return not feedback_dedup.add(fingerprint, "1", FEEDBACK_DUP_TTL)
+
+
+def feedback_entry_text(name: str, email: str, message: str) -> str:
+    return (
+        f"\U0001F464 Name: {name or 'Anonymous'}\n"
+        f"\U0001F4E7 Email: {email or '(not provided)'}\n"
+        f"\U0001F4AC Feedback: {message or '(empty message)'}"
+    )
+
+
+def post_telegram_message(text: str, timeout) -> requests.Response:
+    """POST one ``sendMessage`` call; the response is returned unchecked."""
+    payload = {"chat_id": TELEGRAM_CHAT_ID.strip(), "text": text}
+    api_url = f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+    return upstream_client.post(api_url, data=payload, timeout=(timeout[0], min(timeout[1], TELEGRAM_READ_TIMEOUT)))
+
+
+def send_feedback_to_telegram(name: str, email: str, message: str) -> None:
+    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
+        raise RuntimeError("missing_telegram_config")
+
+    text = "\U0001F4E9 New Feedback Submission:\n" + feedback_entry_text(name, email, message)
+    resp = retry_policies["telegram"].call(lambda timeout: post_telegram_message(text, timeout), request_deadline())
+    resp.raise_for_status()
+
+
+def telegram_retry_after(resp: requests.Response) -> float | None:
+    """Telegram reports flood waits in ``parameters.retry_after`` as well as the header."""
+    try:
+        retry_after = resp.json().get("parameters", {}).get("retry_after")
+    except (ValueError, AttributeError):
+        retry_after = None
+    if retry_after is not None:
+        return float(retry_after)
+    return parse_retry_after(resp.headers.get("Retry-After"))
+
+
+class FeedbackQueue(BackgroundWorker):
+    """Durable SQLite outbox that delivers feedback to Telegram in the background.
+
+    ``enqueue`` only writes a row, so the request returns immediately. A
+    daemon thread per worker claims due rows under a short lease (so several
+    gunicorn workers never send the same row), packs up to ``batch_max`` of
+    them into one message when submissions pile up, and keeps at least
+    ``TELEGRAM_MIN_INTERVAL`` between sends. Failed rows are retried with
+    jittered exponential backoff, or after Telegram's ``retry_after`` on a
+    flood wait; after ``max_attempts`` they are parked as ``dead``.
+    """
+
+    worker_name = "feedback-queue"
+    LEASE_SECONDS = 60
+
+    def __init__(self, path: str, *, batch_max: int, max_attempts: int, retry_max_delay: float, min_interval: float):
+        self.path = path
+        self.batch_max = max(1, batch_max)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_max_delay = retry_max_delay
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._last_send = 0.0
+        self._paused_until = 0.0
+        self._latencies: deque[float] = deque(maxlen=200)
+        self.counters = {"enqueued": 0, "delivered": 0, "messages": 0, "failures": 0, "rate_limited": 0, "dead": 0}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS feedback_queue ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, email TEXT NOT NULL,"
+            " message TEXT NOT NULL, created_at REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt_at REAL NOT NULL, leased_until REAL NOT NULL DEFAULT 0,"
+            " status TEXT NOT NULL DEFAULT 'pending', last_error TEXT)"
+        )
+        self._conn().execute(
+            "CREATE INDEX IF NOT EXISTS feedback_queue_due ON feedback_queue (status, next_attempt_at)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        return sqlite_connect(self.path)
+
+    def enqueue(self, name: str, email: str, message: str) -> int:
+        now = time.time()
+        cursor = self._conn().execute(
+            "INSERT INTO feedback_queue (name, email, message, created_at, next_attempt_at) VALUES (?, ?, ?, ?, ?)",
+            (name, email, message, now, now),
+        )
+        with self._lock:
+            self.counters["enqueued"] += 1
+        self.ensure_worker()
+        self._wake.set()
+        return cursor.lastrowid
+
+    def claim(self) -> list[tuple]:
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, name, email, message, created_at, attempts FROM feedback_queue"
+                " WHERE status = 'pending' AND next_attempt_at <= ? AND leased_until <= ?"
+                " ORDER BY id LIMIT ?",
+                (now, now, self.batch_max),
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE feedback_queue SET leased_until = ? WHERE id = ?",
+                    [(now + self.LEASE_SECONDS, row[0]) for row in rows],
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def pack(self, rows: list[tuple]) -> tuple[list[tuple], str]:
+        """Fit as many claimed rows as Telegram's message size allows; returns (sent rows, text)."""
+        if len(rows) == 1:
+            _, name, email, message, _, _ = rows[0]
+            return rows, ("\U0001F4E9 New Feedback Submission:\n" + feedback_entry_text(name, email, message))[:TELEGRAM_MESSAGE_LIMIT]
+        blocks = []
+        used = 64
+        for row in rows:
+            block = feedback_entry_text(row[1], row[2], row[3])
+            if blocks and used + len(block) + 2 > TELEGRAM_MESSAGE_LIMIT:
+                break
+            blocks.append(block[:TELEGRAM_MESSAGE_LIMIT - used])
+            used += len(block) + 2
+        header = f"\U0001F4E9 {len(blocks)} New Feedback Submissions:\n\n"
+        return rows[:len(blocks)], header + "\n\n".join(blocks)
+
+    def _release(self, rows: list[tuple]) -> None:
+        self._conn().executemany("UPDATE feedback_queue SET leased_until = 0 WHERE id = ?", [(row[0],) for row in rows])
+
+    def _delivered(self, rows: list[tuple]) -> None:
+        now = time.time()
+        self._conn().executemany("DELETE FROM feedback_queue WHERE id = ?", [(row[0],) for row in rows])
+        with self._lock:
+            self.counters["delivered"] += len(rows)
+            self.counters["messages"] += 1
+            self._latencies.extend(now - row[4] for row in rows)
+
+    def _failed(self, rows: list[tuple], error: str, retry_after: float | None = None) -> None:
+        now = time.time()
+        updates = []
+        dead = 0
+        for row in rows:
+            attempts = row[5] + 1
+            if attempts >= self.max_attempts:
+                dead += 1
+                updates.append(("dead", attempts, now, error, row[0]))
+                continue
+            delay = retry_after if retry_after is not None else random.uniform(0, min(self.retry_max_delay, 2 ** attempts))
+            updates.append(("pending", attempts, now + delay, error, row[0]))
+        self._conn().executemany(
+            "UPDATE feedback_queue SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, leased_until = 0"
+            " WHERE id = ?",
+            updates,
+        )
+        with self._lock:
+            self.counters["failures"] += 1
+            self.counters["dead"] += dead
+        if dead:
+            logger.error("Parking %s feedback submission(s) after %s attempts: %s", dead, self.max_attempts, error)
+
+    def deliver_once(self) -> bool:
+        """Send one message; returns ``False`` when nothing was due."""
+        wait = max(self._paused_until, self._last_send + self.min_interval) - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        rows = self.claim()
+        if not rows:
+            return False
+        batch, text = self.pack(rows)
+        self._release(rows[len(batch):])
+        self._last_send = time.monotonic()
+        try:
+            resp = post_telegram_message(text, deadline_timeout(None, TELEGRAM_READ_TIMEOUT))
+        except requests.RequestException as exc:
+            logger.warning("Telegram delivery failed: %s", exc)
+            self._failed(batch, str(exc))
+            return True
+        if resp.status_code == 429:
+            retry_after = telegram_retry_after(resp) or 1.0
+            self._paused_until = time.monotonic() + retry_after
+            with self._lock:
+                self.counters["rate_limited"] += 1
+            self._failed(batch, "rate limited", retry_after)
+        elif resp.status_code >= 400:
+            logger.error("Telegram HTTPError %s: %s", resp.status_code, resp.text[:500])
+            self._failed(batch, f"HTTP {resp.status_code}")
+        else:
+            self._delivered(batch)
+        return True
+
+    def next_due_in(self) -> float:
+        row = self._conn().execute(
+            "SELECT MIN(MAX(next_attempt_at, leased_until)) FROM feedback_queue WHERE status = 'pending'"
+        ).fetchone()
+        if not row or row[0] is None:
+            return 30.0
+        return min(30.0, max(0.0, row[0] - time.time()))
+
+    def _run(self) -> None:
+        while True:
+            try:
+                if self.deliver_once():
+                    continue
+                self._wake.wait(self.next_due_in())
+                self._wake.clear()
+            except Exception:
+                logger.exception("Feedback queue worker error")
+                time.sleep(5)
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        depth, oldest = conn.execute(
+            "SELECT COUNT(*), MIN(created_at) FROM feedback_queue WHERE status = 'pending'"
+        ).fetchone()
+        dead = conn.execute("SELECT COUNT(*) FROM feedback_queue WHERE status = 'dead'").fetchone()[0]
+        with self._lock:
+            latencies = list(self._latencies)
+            counters = dict(self.counters)
+        counters.update(
+            depth=depth,
+            dead_letters=dead,
+            oldest_pending_seconds=round(time.time() - oldest, 1) if oldest else 0.0,
+            latency_p50_ms=round(1000 * percentile(latencies, 50), 1),
+            latency_p95_ms=round(1000 * percentile(latencies, 95), 1),
+        )
+        return counters
+
+
+feedback_queue = (
+    FeedbackQueue(
+        FEEDBACK_QUEUE_PATH,
+        batch_max=FEEDBACK_BATCH_MAX,
+        max_attempts=FEEDBACK_MAX_ATTEMPTS,
+        retry_max_delay=FEEDBACK_RETRY_MAX_DELAY,
+        min_interval=TELEGRAM_MIN_INTERVAL,
+    )
+    if FEEDBACK_ENABLED and FEEDBACK_QUEUE_ENABLED
+    else None
+)
+
+
+SEARCH_TOKEN_RE = re.compile(r"[^\W_]+")
+SEARCH_PREFIX_MIN = 3
+
+
+def search_terms(text: str) -> list[str]:
+    return SEARCH_TOKEN_RE.findall(text.casefold())
+
+
+def fts_query(terms: list[str]) -> str:
+    """An FTS5 MATCH expression requiring every term; a last term of 3+ characters also matches as a
+    prefix (search-as-you-type), served by the table's prefix index."""
+    if not terms:
+        return ""
+    quoted = [f'"{term}"' for term in terms]
+    if len(terms[-1]) >= SEARCH_PREFIX_MIN:
+        quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+class CitationStore(BackgroundWorker):
+    """SQLite FTS5 index of every source web answers have cited.
+
+    ``ingest`` only appends to an in-memory queue, so answering never waits
+    on disk; a daemon thread per worker drains it in batched transactions.
+    Sources are deduplicated on ``citation_url_parts``' canonical URL and
+    keep the latest ``MAX_QUERIES`` questions that surfaced them, which are
+    searchable too. The database is opened on first use; if it cannot be
+    (e.g. SQLite was built without FTS5) the store logs why and stays
+    unavailable instead of failing the import.
+    """
+
+    worker_name = "citation-store"
+    MAX_QUERIES = 20
+    FLUSH_DELAY = 0.5
+    COMMON_TERM_SHARE = 0.1
+
+    def __init__(self, path: str, *, queue_max: int, batch_max: int, rank_window: int = 2000):
+        self.path = path
+        self.batch_max = max(1, batch_max)
+        self.rank_window = max(1, rank_window)
+        self._queue: deque[tuple[str, dict, float]] = deque()
+        self.queue_max = queue_max
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._latencies: deque[float] = deque(maxlen=200)
+        self.counters = {"queued": 0, "ingested": 0, "new_sources": 0, "dropped": 0, "batches": 0, "errors": 0, "searches": 0}
+        self._open_lock = threading.Lock()
+        self.available: bool | None = None
+        self.error: str | None = None
+        atexit.register(self.flush)
+
+    def ready(self) -> bool:
+        """Create the schema on first use; False (with ``error`` set) when the database cannot be opened."""
+        if self.available is not None:
+            return self.available
+        with self._open_lock:
+            if self.available is None:
+                try:
+                    self._create_schema()
+                    self.available = True
+                except (sqlite3.Error, OSError) as exc:
+                    self.error = str(exc)
+                    self.available = False
+                    logger.error("Citation store unavailable, /api/search is disabled: %s", exc)
+        return self.available
+
+    def _create_schema(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, url_key TEXT NOT NULL UNIQUE, url TEXT NOT NULL,"
+            " title TEXT NOT NULL, domain TEXT NOT NULL, snippet TEXT NOT NULL, queries TEXT NOT NULL,"
+            " first_seen REAL NOT NULL, last_seen REAL NOT NULL, citations INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS sources_fts USING fts5(title, snippet, domain, queries, prefix='3')")
+        # Titles weigh most; a configured rank lets FTS5 sort by it without a temp B-tree.
+        conn.execute("INSERT INTO sources_fts (sources_fts, rank) VALUES ('rank', 'bm25(4.0, 2.0, 1.0, 1.0)')")
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS sources_terms USING fts5vocab(sources_fts, row)")
+
+    def _conn(self) -> sqlite3.Connection:
+        return sqlite_connect(self.path)
+
+    def ingest(self, query: str, citations: list[dict]) -> None:
+        if self.available is False:
+            return
+        now = time.time()
+        items = [item for item in citations if isinstance(item, dict) and item.get("url")]
+        with self._lock:
+            room = max(0, self.queue_max - len(self._queue))
+            self._queue.extend((query, item, now) for item in items[:room])
+            self.counters["queued"] += min(room, len(items))
+            self.counters["dropped"] += max(0, len(items) - room)
+        if items:
+            self.ensure_worker()
+            self._wake.set()
+
+    def _take(self) -> list[tuple[str, dict, float]]:
+        with self._lock:
+            return [self._queue.popleft() for _ in range(min(self.batch_max, len(self._queue)))]
+
+    def write_batch(self, batch: list[tuple[str, dict, float]]) -> None:
+        started = time.perf_counter()
+        conn = self._conn()
+        created = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for query, item, seen_at in batch:
+                url_key, domain = citation_url_parts(item["url"])
+                domain = item.get("domain") or domain
+                title = item.get("title") or domain
+                snippet = item.get("snippet") or ""
+                row = conn.execute(
+                    "SELECT id, title, snippet, queries FROM sources WHERE url_key = ?", (url_key,)
+                ).fetchone()
+                if row is None:
+                    queries = [query] if query else []
+                    source_id = conn.execute(
+                        "INSERT INTO sources (url_key, url, title, domain, snippet, queries, first_seen, last_seen, citations)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1)",
+                        (url_key, item["url"], title, domain, snippet, json.dumps(queries), seen_at, seen_at),
+                    ).lastrowid
+                    created += 1
+                else:
+                    source_id, old_title, old_snippet, old_queries = row
+                    queries = [q for q in json.loads(old_queries) if q != query]
+                    queries = (queries + [query] if query else queries)[-self.MAX_QUERIES:]
+                    # A real page title beats the domain placeholder, and any snippet beats none.
+                    title = title if old_title == domain or not old_title else old_title
+                    snippet = old_snippet or snippet
+                    conn.execute(
+                        "UPDATE sources SET title = ?, snippet = ?, queries = ?, last_seen = MAX(last_seen, ?),"
+                        " citations = citations + 1 WHERE id = ?",
+                        (title, snippet, json.dumps(queries), seen_at, source_id),
+                    )
+                    conn.execute("DELETE FROM sources_fts WHERE rowid = ?", (source_id,))
+                conn.execute(
+                    "INSERT INTO sources_fts (rowid, title, snippet, domain, queries) VALUES (?, ?, ?, ?, ?)",
+                    (source_id, title, snippet, domain, "\n".join(queries)),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        with self._lock:
+            self.counters["ingested"] += len(batch)
+            self.counters["new_sources"] += created
+            self.counters["batches"] += 1
+            self._latencies.append(time.perf_counter() - started)
+
+    def flush(self) -> None:
+        """Write everything still queued (also run at exit)."""
+        if not self._queue:
+            return
+        if not self.ready():
+            with self._lock:
+                self.counters["dropped"] += len(self._queue)
+                self._queue.clear()
+            return
+        while True:
+            batch = self._take()
+            if not batch:
+                return
+            try:
+                self.write_batch(batch)
+            except sqlite3.Error as exc:
+                with self._lock:
+                    self.counters["errors"] += 1
+                logger.warning("Dropping %s citations after a write error: %s", len(batch), exc)
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            # Let a burst of answers pile up so it lands in one transaction.
+            time.sleep(self.FLUSH_DELAY)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Citation store worker error")
+                time.sleep(5)
+
+    def _plan_terms(self, conn: sqlite3.Connection, terms: list[str]) -> tuple[list[str], int]:
+        """Drop terms found in over ``COMMON_TERM_SHARE`` of sources (they barely filter but are costly to
+        intersect); returns the kept terms and the document count of the rarest one."""
+        exact, last = terms[:-1], terms[-1]
+        if len(last) < SEARCH_PREFIX_MIN:
+            exact.append(last)
+        counts = dict(conn.execute(
+            f"SELECT term, doc FROM sources_terms WHERE term IN ({','.join('?' * len(exact))})", exact
+        ).fetchall())
+        if len(last) >= SEARCH_PREFIX_MIN:
+            # A prefix expands to several terms; their summed counts over-estimate, which is the safe side.
+            counts[last] = conn.execute(
+                "SELECT COALESCE(SUM(doc), 0) FROM sources_terms WHERE term >= ? AND term < ?", (last, last + "\U0010ffff")
+            ).fetchone()[0]
+        sources = conn.execute("SELECT COALESCE(MAX(id), 0) FROM sources").fetchone()[0]
+        kept = [term for term in terms[:-1] if counts.get(term, 0) <= self.COMMON_TERM_SHARE * sources] + [last]
+        return kept, min(counts.get(term, 0) for term in kept)
+
+    def search(self, text: str, *, limit: int = 10, offset: int = 0, domain: str | None = None) -> dict:
+        """Ranked (BM25, titles weighted highest) page of sources matching ``text``.
+
+        When even the rarest search term matches more than ``rank_window``
+        sources, only the newest ``rank_window`` matches are ranked and
+        ``total`` is that term's source count, flagged ``total_estimated``.
+        """
+        started = time.perf_counter()
+        conn = self._conn()
+        terms, rarest = self._plan_terms(conn, search_terms(text))
+        match = fts_query(terms)
+        where = "sources_fts MATCH ?"
+        params: list = [match]
+        estimated = rarest > self.rank_window
+        if estimated:
+            cutoff = conn.execute(
+                "SELECT rowid FROM sources_fts WHERE sources_fts MATCH ? ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+                (match, self.rank_window - 1),
+            ).fetchone()
+            if cutoff is not None:
+                where += " AND sources_fts.rowid >= ?"
+                params.append(cutoff[0])
+            else:
+                estimated = False
+        if domain:
+            where += " AND s.domain = ?"
+            params.append(domain.strip().lower())
+        if estimated and not domain:
+            total = rarest
+        else:
+            total = conn.execute(
+                f"SELECT COUNT(*) FROM sources_fts JOIN sources s ON s.id = sources_fts.rowid WHERE {where}", params
+            ).fetchone()[0]
+        rows = conn.execute(
+            "SELECT s.url, s.title, s.domain, s.snippet, s.queries, s.citations, s.last_seen,"
+            " snippet(sources_fts, 1, '<mark>', '</mark>', '…', 16)"
+            f" FROM sources_fts JOIN sources s ON s.id = sources_fts.rowid WHERE {where}"
+            " ORDER BY sources_fts.rank LIMIT ? OFFSET ?",
+            params + [limit, offset],
+        ).fetchall()
+        with self._lock:
+            self.counters["searches"] += 1
+        results = [
+            {
+                "url": url,
+                "title": title,
+                "domain": row_domain,
+                "snippet": snippet,
+                "highlight": highlight,
+                "queries": json.loads(queries)[-3:],
+                "citations": citations,
+                "last_seen": int(last_seen),
+            }
+            for url, title, row_domain, snippet, queries, citations, last_seen, highlight in rows
+        ]
+        payload = {
+            "query": text,
+            "results": results,
+            "total": total,
+            "limit": limit,
+            "offset": offset,
+            "next_offset": offset + limit if offset + limit < total and len(results) == limit else None,
+            "took_ms": round(1000 * (time.perf_counter() - started), 2),
+        }
+        if estimated and not domain:
+            payload["total_estimated"] = True
+        return payload
+
+    def stats(self) -> dict:
+        if not self.ready():
+            return {"available": False, "error": self.error}
+        with self._lock:
+            counters = dict(self.counters)
+            counters["pending"] = len(self._queue)
+            latencies = list(self._latencies)
+        try:
+            counters["sources"] = self._conn().execute("SELECT COUNT(*) FROM sources").fetchone()[0]
+        except sqlite3.Error:
+            counters["sources"] = None
+        counters["batch_p50_ms"] = round(1000 * percentile(latencies, 50), 2)
+        counters["batch_p95_ms"] = round(1000 * percentile(latencies, 95), 2)
+        return counters
+
+
+citation_store = (
+    CitationStore(CITATION_STORE_PATH, queue_max=CITATION_QUEUE_MAX, batch_max=CITATION_BATCH_MAX, rank_window=SEARCH_RANK_WINDOW)
+    if CITATION_STORE_ENABLED
+    else None
+)
+
+
+@app.before_request
+def resume_feedback_delivery():
+    # Rows left pending by a restart are picked up once this worker serves traffic.
+    if feedback_queue is not None:
+        feedback_queue.ensure_worker()
+
+
+@app.before_request
+def start_quick_answers():
+    if quick_answers is not None:
+        quick_answers.ensure_worker()
+
+
+@app.before_request
+def start_request_timings():
+    timings = None
+    if metrics.enabled and request.path.startswith("/api/"):
+        timings = RequestTimings(request.url_rule.rule if request.url_rule else "unmatched", request.method)
+    g.timings = timings
+    current_timings.set(timings)
+
+
+@app.after_request
+def finish_request_timings(resp):
+    timings = g.get("timings")
+    if timings is None:
+        return resp
+    if METRICS_SERVER_TIMING:
+        resp.headers["Server-Timing"] = timings.server_timing()
+    if resp.is_streamed:
+        resp.call_on_close(lambda: timings.finish(resp.status_code))
+    else:
+        timings.finish(resp.status_code)
+    return resp
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok"}
+
+
+def ops_authorized(authorization: str | None) -> bool:
+    """True when ``METRICS_TOKEN`` is unset or ``authorization`` is ``Bearer <METRICS_TOKEN>``."""
+    if not METRICS_TOKEN:
+        return True
+    scheme, _, token = (authorization or "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(token.strip().encode("utf-8"), METRICS_TOKEN.encode("utf-8"))
+
+
+OPS_UNAUTHORIZED = ({"error": "Unauthorized"}, 401, {"WWW-Authenticate": 'Bearer realm="sourcescout-ops"'})
+
+
+def operator_only(view):
+    """Guard a metrics/stats route with ``METRICS_TOKEN`` when one is configured."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ops_authorized(request.headers.get("Authorization")):
+            payload, status, headers = OPS_UNAUTHORIZED
+            return jsonify(payload), status, headers
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+@app.get("/metrics")
+@operator_only
+def prometheus_metrics():
+    if not metrics.enabled:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+def upstream_stats_payload() -> dict:
+    """Body of ``/api/upstream/stats``, shared with the ASGI entry point."""
+    stats = upstream_client.stats()
+    stats["router"] = provider_router.stats()
+    stats["model_router"] = model_router.stats()
+    stats["cancellations"] = cancellations.stats()
+    stats["retries"] = {name: policy.stats() for name, policy in retry_policies.items()}
+    stats["prompt_cache"] = prompt_cache_stats.stats()
+    return stats
+
+
+@app.get("/api/upstream/stats")
+@operator_only
+def upstream_stats():
+    return jsonify(upstream_stats_payload())
+
+
+@app.get("/api/cache/stats")
+@operator_only
+def cache_stats():
+    stats = response_cache.stats()
+    stats["single_flight"] = ask_flights.stats()
+    if quick_answers is not None:
+        stats["quick_answers"] = quick_answers.stats()
+    return jsonify(stats)
+
+
+@app.get("/api/feedback/stats")
+@operator_only
+def feedback_stats():
+    if feedback_queue is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(feedback_queue.stats(), enabled=True))
+
+
+@app.get("/api/admission/stats")
+@operator_only
+def admission_stats():
+    return jsonify({"rate_limit": rate_limiter.stats(), "concurrency": admission_gate.stats()})
+
+# Serve frontend files for convenience during development
+@app.get("/")
+def index_html():
+    return send_from_directory(FRONTEND_DIR, "index.html")
+
+@app.get("/index.html")
+def index_html_alias():
+    return send_from_directory(FRONTEND_DIR, "index.html")
+
+@app.get("/styles.css")
+def styles_css():
+    return send_from_directory(FRONTEND_DIR, "styles.css")
+
+@app.get("/app.js")
+def app_js():
+    return send_from_directory(FRONTEND_DIR, "app.js")
+
+
+@app.get("/api/feedback/csrf")
+def feedback_csrf():
+    if not FEEDBACK_ENABLED:
+        resp = make_response(jsonify({"enabled": False}))
+        resp.delete_cookie("feedback_csrf")
+        return resp, 503
+
+    token = generate_feedback_csrf()
+    resp = make_response(jsonify({"token": token, "enabled": True}))
+    resp.set_cookie(
+        "feedback_csrf",
+        token,
+        max_age=3600,
+        secure=FEEDBACK_COOKIE_SECURE,
+        httponly=True,
+        samesite="Lax",
+    )
+    return resp
+
+
+@app.post("/api/feedback")
+def submit_feedback():
+    if not FEEDBACK_ENABLED:
+        return jsonify({"error": "Feedback submission is currently disabled."}), 503
+
+    data = request.get_json(silent=True) or {}
+    name = (data.get("name") or "").strip()
+    email = (data.get("email") or "").strip()
+    message = (data.get("message") or "").strip()
+    csrf_token = data.get("csrf_token")
+    cookie_token = request.cookies.get("feedback_csrf")
+
+    if not validate_feedback_csrf(csrf_token, cookie_token):
+        return jsonify({"error": "Invalid or missing CSRF token."}), 400
+
+    if len(name) < 2:
+        return jsonify({"error": "Please provide your name (at least 2 characters)."}), 400
+
+    if email and ("@" not in email or email.count("@") != 1 or email.startswith("@")):
+        return jsonify({"error": "Please provide a valid email address or leave it blank."}), 400
+
+    if len(message) < 10:
+        return jsonify({"error": "Feedback message is too short (minimum 10 characters)."}), 400
+
+    ip = client_ip(request.headers.get("X-Forwarded-For"), request.remote_addr)
+    if is_duplicate_feedback(ip, message):
+        return jsonify({"error": "Duplicate feedback detected. Please wait before resubmitting."}), 409
+
+    try:
+        if feedback_queue is not None:
+            feedback_queue.enqueue(name, email, message)
+        else:
+            send_feedback_to_telegram(name, email, message)
+    except sqlite3.Error as exc:
+        app.logger.error("Feedback queue error: %s", exc)
+        return jsonify({"error": "Could not save feedback right now."}), 503
+    except requests.HTTPError as exc:
+        err_resp = getattr(exc, "response", None)
+        app.logger.error("Telegram HTTPError: %s", getattr(err_resp, "text", str(exc)))
+        return jsonify({"error": "Failed to deliver feedback to Telegram."}), 502
+    except requests.RequestException as exc:
+        app.logger.error("Telegram RequestException: %s", exc)
+        return jsonify({"error": "Network error while sending feedback."}), 502
+    except RuntimeError as exc:
+        if str(exc) == "missing_telegram_config":
+            return jsonify({"error": "Server missing Telegram configuration."}), 500
+        raise
 
-    if not citations and answer_text:
-        link_candidates = re.findall(r"https?://[^\s)]+", answer_text)
-        if link_candidates:
-            # Preserve order while de-duplicating
-            citations = list(dict.fromkeys(link_candidates))
+    refreshed_token = generate_feedback_csrf()
+    queued = feedback_queue is not None
+    resp = make_response(jsonify({
+        "ok": True,
+        "message": "Feedback queued" if queued else "Feedback delivered",
+        "queued": queued,
+        "csrf_token": refreshed_token,
+    }))
+    resp.set_cookie(
+        "feedback_csrf",
+        refreshed_token,
+        max_age=3600,
+        secure=FEEDBACK_COOKIE_SECURE,
+        httponly=True,
+        samesite="Lax",
+    )
+    return resp
 
-    payload = {
-        "answer": strip_inline_citations(answer_text),
-        "citations": normalize_citations(citations),
-        "personality": personality_key,
+
+@app.after_request
+def add_cache_status(resp):
+    cache_status = g.get("cache_status")
+    if cache_status:
+        resp.headers["X-Cache"] = cache_status
+    return resp
+
+
+COMPRESSIBLE_TYPES = {"application/json", "application/javascript", "image/svg+xml"}
+UNCOMPRESSED_STATUSES = {204, 206, 304}
+
+
+def compressible_type(mimetype: str | None) -> bool:
+    # SSE and NDJSON are streamed and must reach the client event by event.
+    return bool(mimetype) and (mimetype in COMPRESSIBLE_TYPES or (mimetype.startswith("text/") and mimetype != "text/event-stream"))
+
+
+@lru_cache(maxsize=128)
+def preferred_encoding(accept_encoding: str | None) -> str | None:
+    """``br`` or ``gzip``, whichever ``Accept-Encoding`` weights higher; ``br`` wins ties when installed."""
+    if not COMPRESSION_ENABLED or not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, *params = part.split(";")
+        weight = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.strip().lower()] = weight
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    best = max(candidates, key=lambda name: weights.get(name, weights.get("*", 0.0)))
+    return best if weights.get(best, weights.get("*", 0.0)) > 0 else None
+
+
+def negotiate_compression(accept_encoding: str | None, size: int | None) -> str | None:
+    if size is not None and size < COMPRESSION_MIN_BYTES:
+        return None
+    return preferred_encoding(accept_encoding)
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+@app.after_request
+def compress_response(resp):
+    if not COMPRESSION_ENABLED or resp.status_code < 200 or resp.status_code in UNCOMPRESSED_STATUSES:
+        return resp
+    if "Content-Encoding" in resp.headers or not compressible_type(resp.mimetype):
+        return resp
+    if resp.is_streamed and not resp.direct_passthrough:
+        return resp
+    resp.vary.add("Accept-Encoding")
+    encoding = negotiate_compression(request.headers.get("Accept-Encoding"), resp.content_length)
+    if encoding is None:
+        return resp
+    resp.direct_passthrough = False
+    body = resp.get_data()
+    if len(body) < COMPRESSION_MIN_BYTES:
+        return resp
+    resp.set_data(compress_body(body, encoding))
+    resp.headers["Content-Encoding"] = encoding
+    # The compressed bytes differ, so a strong validator would be wrong; weak
+    # comparison still matches it on revalidation.
+    etag, weak = resp.get_etag()
+    if etag and not weak:
+        resp.set_etag(etag, weak=True)
+    return resp
+
+
+def cache_status_for(plan: dict) -> str | None:
+    cache = plan.get("cache")
+    if not response_cache.enabled or not cache:
+        return None
+    return "MISS" if cache["directive"] == "use" else cache["directive"].upper()
+
+
+def call_upstream(plan: dict, stream: bool = False):
+    """Send a planned /api/ask request to its provider.
+
+    Returns ``(upstream, None)`` with the decoded body (or the open streaming
+    response), or ``(None, (payload, status))`` with the client-facing reply
+    when the provider call failed.
+    """
+    personality_key = plan["personality"]
+    if plan["web"]:
+        try:
+            return perplexity_search(plan["messages"], stream=stream, deadline=plan.get("deadline")), None
+        except RuntimeError as exc:
+            if str(exc) != "missing_perplexity_key":
+                app.logger.error("Perplexity runtime error: %s", exc)
+            else:
+                app.logger.error("Perplexity key missing when web search requested")
+        except requests.HTTPError as exc:
+            status_code, err_json = upstream_error_details(getattr(exc, "response", None), exc)
+            app.logger.error("Perplexity HTTPError %s: %s", status_code, err_json)
+        except requests.RequestException as exc:
+            app.logger.error("Perplexity RequestException: %s", exc)
+        return None, (web_search_disabled_payload(personality_key), 200)
+
+    try:
+        resp = post_chat_completion(plan["payload"], plan.get("deadline"))
+        return (resp if stream else resp.json()), None
+    except requests.HTTPError as e:
+        status_code, err_json = upstream_error_details(getattr(e, "response", None), e)
+        app.logger.error("Chat completion HTTPError %s: %s", status_code, err_json)
+        return None, ({"error": "Chat completion API error", "details": err_json}, status_code)
+    except requests.RequestException as e:
+        app.logger.error("Chat completion RequestException: %s", str(e))
+        return None, ({"error": "Network error", "details": str(e)}, 502)
+    except RuntimeError as e:
+        if str(e) == "missing_api_key":
+            return None, ({"error": "Server missing OpenAI/OpenRouter API key"}, 500)
+        raise
+
+
+def record_citations(plan: dict, payload: dict) -> None:
+    if citation_store is not None and plan.get("web") and payload.get("citations"):
+        citation_store.ingest(plan.get("query") or "", payload["citations"])
+
+
+def finish_ask_payload(plan: dict, payload: dict) -> dict:
+    """Attach per-request extras to a fresh /api/ask answer, cache it and index its sources."""
+    if plan.get("context"):
+        payload["context"] = plan["context"]
+    if plan.get("routing"):
+        payload["routing"] = plan["routing"]
+    response_cache.remember(plan, payload)
+    record_citations(plan, payload)
+    return payload
+
+
+def ask_relay_options(plan: dict, flight=None) -> dict:
+    """Relay options for a streamed /api/ask answer; the final payload is cached and kept on ``flight``."""
+
+    def on_complete(payload: dict) -> None:
+        response_cache.remember(plan, payload)
+        record_citations(plan, payload)
+        if flight is not None:
+            flight.result = payload
+
+    options = {"mode": "web"} if plan["web"] else {"link_fallback": True}
+    options["context"] = plan.get("context")
+    options["routing"] = plan.get("routing")
+    options["on_complete"] = on_complete
+    return options
+
+
+def answer_ask(plan: dict) -> tuple[dict, int]:
+    out, failure = call_upstream(plan)
+    if failure:
+        return failure
+    if plan["web"]:
+        payload = web_answer_payload(out, plan["personality"])
+    else:
+        payload = chat_answer_payload(out, plan["personality"])
+    return finish_ask_payload(plan, payload), 200
+
+
+def pump_ask_stream(plan: dict, flight: StreamFlight) -> None:
+    upstream, failure = call_upstream(plan, stream=True)
+    if failure:
+        flight.fail(failure)
+        return
+    flight.start()
+    events = stream_answer_events(
+        upstream, deadline=plan.get("stream_deadline"), personality_key=plan["personality"], **ask_relay_options(plan, flight)
+    )
+    try:
+        for event in events:
+            if flight.abandoned:
+                break
+            flight.publish(event)
+    finally:
+        # Closing mid-answer drops the upstream connection, so the provider stops generating.
+        events.close()
+
+
+def recorded_events(plan: dict, events, payload: dict | None = None, flight=None):
+    """Pass SSE events through, then record the finished answer in the plan's conversation."""
+    yield from events
+    record_conversation_turn(plan, payload if flight is None else flight.result)
+
+
+class QuickQuestions:
+    """The quick-question list, read from the JSON file at ``path`` when there is one.
+
+    The file holds ``[{"title": ..., "prompt": ...}, ...]`` (or that list
+    under ``"questions"``). It is stat'ed at most once per ``interval``
+    seconds and re-read when its mtime or size changes, so the list can be
+    rotated without a redeploy. An invalid file keeps the last good list; a
+    missing one falls back to ``defaults``.
+    """
+
+    def __init__(self, path: str | None, defaults: list[dict[str, str]], interval: float):
+        self.path = path
+        self.defaults = defaults
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._checked = time.monotonic()
+        self._stamp: tuple | None = None
+        self._questions = defaults
+        self._prompts = frozenset(normalize_query(q["prompt"]) for q in defaults)
+        self.reloads = 0
+        self._refresh()
+
+    def _read(self) -> list[dict[str, str]] | None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as handle:
+                data = json.load(handle)
+        except (OSError, ValueError) as exc:
+            logger.warning("Unable to read quick questions from %s: %s", self.path, exc)
+            return None
+        if isinstance(data, dict):
+            data = data.get("questions")
+        questions = []
+        for item in data if isinstance(data, list) else []:
+            title = item.get("title") if isinstance(item, dict) else None
+            prompt = item.get("prompt") if isinstance(item, dict) else None
+            if isinstance(title, str) and isinstance(prompt, str) and title.strip() and prompt.strip():
+                questions.append({"title": title.strip(), "prompt": prompt.strip()})
+        if not questions:
+            logger.warning("No valid quick questions in %s, keeping the current list", self.path)
+            return None
+        return questions
+
+    def _refresh(self) -> None:
+        try:
+            info = os.stat(self.path) if self.path else None
+        except OSError:
+            info = None
+        stamp = (info.st_mtime_ns, info.st_size) if info else None
+        if stamp == self._stamp:
+            return
+        self._stamp = stamp
+        questions = self._read() if info else self.defaults
+        if questions is None or questions == self._questions:
+            return
+        if info or self._questions is not self.defaults:
+            self.reloads += 1
+            logger.info("Loaded %s quick questions from %s", len(questions), self.path if info else "defaults")
+        self._prompts = frozenset(normalize_query(q["prompt"]) for q in questions)
+        self._questions = questions
+
+    def _maybe_reload(self) -> None:
+        if self.interval <= 0:
+            return
+        now = time.monotonic()
+        if now - self._checked < self.interval or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._checked = now
+            self._refresh()
+        finally:
+            self._lock.release()
+
+    def get(self) -> list[dict[str, str]]:
+        self._maybe_reload()
+        return self._questions
+
+    def __contains__(self, query: str) -> bool:
+        self._maybe_reload()
+        return normalize_query(query) in self._prompts
+
+
+quick_questions_source = QuickQuestions(QUICK_QUESTIONS_PATH, QUICK_QUESTIONS, PERSONA_RELOAD_INTERVAL)
+
+
+class QuickAnswers(BackgroundWorker):
+    """Answers to every quick question x persona x mode, computed ahead of time.
+
+    A daemon thread per worker refreshes them every ``interval`` seconds,
+    give or take ``jitter`` (a fraction of the interval), with at most
+    ``concurrency`` provider calls at once. Each answer goes through the same
+    plan and answer path as /api/ask, so the response cache and citation
+    store are warmed as well. Answers are kept in a ``make_store`` backend
+    for ``max_age`` seconds along with when they were generated, and a failed
+    refresh leaves the previous answer in place until then. With a shared
+    backend a lease lets one worker per interval do the refresh for all.
+
+    ``lookup`` serves only plans identical to a precomputed one: the same
+    question (ignoring case and spacing), persona and mode, the default
+    model, and no history.
+    """
+
+    worker_name = "quick-answers"
+    STARTUP_DELAY = 5.0
+
+    def __init__(
+        self,
+        store,
+        questions: QuickQuestions,
+        *,
+        modes: list[str],
+        personalities: list[str],
+        interval: float,
+        jitter: float,
+        concurrency: int,
+        max_age: float,
+    ):
+        self.store = store
+        self.questions = questions
+        self.modes = modes
+        self.personalities = personalities
+        self.interval = interval
+        self.jitter = jitter
+        self.concurrency = concurrency
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self.last_refresh: dict | None = None
+        self.counters = {"refreshes": 0, "skipped_refreshes": 0, "computed": 0, "failed": 0, "hits": 0, "errors": 0}
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += amount
+
+    def lookup(self, plan: dict) -> dict | None:
+        cache = plan.get("cache")
+        if not cache or cache["directive"] != "use" or not cache.get("scope") or plan["query"] not in self.questions:
+            return None
+        try:
+            raw = self.store.get("answer:" + cache["key"])
+        except Exception as exc:
+            self._count("errors")
+            logger.warning("Quick answer read failed: %s", exc)
+            return None
+        if raw is None:
+            return None
+        self._count("hits")
+        entry = json.loads(raw)
+        payload = entry["payload"]
+        payload["generated_at"] = entry["generated_at"]
+        return payload
+
+    def plans(self) -> list[dict]:
+        keys = self.personalities or [persona["key"] for persona in personas.snapshot()["personas"]]
+        plans = []
+        for question in self.questions.get():
+            for key in keys:
+                for mode in self.modes:
+                    plan = plan_ask({"query": question["prompt"], "personality": key, "mode": mode})
+                    # Early replies (missing keys, knowledge cutoff) are already instant.
+                    if "response" not in plan:
+                        plans.append(plan)
+        return plans
+
+    def compute(self, plan: dict) -> bool:
+        plan["deadline"] = request_deadline()
+        try:
+            payload, status = answer_ask(plan)
+        except Exception:
+            logger.exception("Precomputing the %s answer to %r failed", plan["personality"], plan["query"])
+            payload, status = {}, 500
+        if status != 200 or "error" in payload or payload.get("web_search_disabled"):
+            self._count("failed")
+            return False
+        entry = {"payload": payload, "generated_at": int(time.time())}
+        self.store.set("answer:" + plan["cache"]["key"], json.dumps(entry, ensure_ascii=False), self.max_age)
+        self._count("computed")
+        return True
+
+    def refresh(self) -> None:
+        started = time.time()
+        plans = self.plans()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="quick-answers") as pool:
+            results = list(pool.map(self.compute, plans))
+        self._count("refreshes")
+        self.last_refresh = {
+            "started_at": int(started),
+            "duration_ms": round((time.time() - started) * 1000),
+            "answers": len(plans),
+            "failed": results.count(False),
+        }
+        logger.info("Precomputed %s/%s quick answers", results.count(True), len(plans))
+
+    def _run(self) -> None:
+        delay = random.uniform(0, self.STARTUP_DELAY)
+        while True:
+            time.sleep(delay)
+            delay = self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+            try:
+                # Workers sharing the store wake at different times; whoever wakes first refreshes for all.
+                if self.store.add("lease", str(os.getpid()), self.interval * (1 - self.jitter)):
+                    self.refresh()
+                else:
+                    self._count("skipped_refreshes")
+            except Exception:
+                self._count("errors")
+                logger.exception("Quick answer refresh failed")
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        counters["questions"] = len(self.questions.get())
+        counters["interval"] = self.interval
+        counters["last_refresh"] = self.last_refresh
+        return counters
+
+
+quick_answers = (
+    QuickAnswers(
+        make_store(RESPONSE_CACHE_BACKEND, "quick_answers", 1024),
+        quick_questions_source,
+        modes=QUICK_ANSWERS_MODES,
+        personalities=QUICK_ANSWERS_PERSONAS,
+        interval=QUICK_ANSWERS_INTERVAL,
+        jitter=QUICK_ANSWERS_JITTER,
+        concurrency=QUICK_ANSWERS_CONCURRENCY,
+        max_age=QUICK_ANSWERS_MAX_AGE,
+    )
+    if QUICK_ANSWERS_ENABLED
+    else None
+)
+
+
+def stored_answer(plan: dict) -> tuple[dict | None, str | None]:
+    """A precomputed quick answer or a response-cache hit for ``plan``, with its ``X-Cache`` status."""
+    payload = quick_answers.lookup(plan) if quick_answers is not None else None
+    if payload is not None:
+        status = "PRECOMPUTED"
+    else:
+        payload = response_cache.lookup(plan)
+        status = "HIT" if payload is not None else None
+    if payload is not None:
+        # The stored answer may come from a request that routed differently, or named its model.
+        payload.pop("routing", None)
+        if plan.get("routing"):
+            payload["routing"] = plan["routing"]
+    return payload, status
+
+
+BATCH_SHARED_FIELDS = ("mode", "model", "personality", "cache")
+
+
+def plan_batch(data: dict, cache_control: str | None = None) -> dict:
+    """Validate an /api/ask/batch body and plan every entry with ``plan_ask``.
+
+    ``queries`` holds strings or ``{"query", "id", "history"}`` objects; mode,
+    model, personality and cache directive come from the top level and are
+    shared by all entries. Entries are never streamed and never touch
+    server-side conversations. The batch plan carries the entry ``plans`` and
+    the ``concurrency`` to run them at, or a ``response`` when the batch as a
+    whole is invalid.
+    """
+    queries = data.get("queries")
+    if not isinstance(queries, list) or not queries:
+        return {"response": ({"error": "Provide 'queries' as a non-empty array"}, 400)}
+    if len(queries) > BATCH_MAX_ITEMS:
+        return {"response": ({"error": f"A batch holds at most {BATCH_MAX_ITEMS} queries"}, 413)}
+
+    shared = {field: data[field] for field in BATCH_SHARED_FIELDS if field in data}
+    plans = []
+    for index, entry in enumerate(queries):
+        item = {"query": entry} if not isinstance(entry, dict) else {
+            "query": entry.get("query"),
+            "history": entry.get("history", []),
+        }
+        plan = plan_ask(dict(shared, **item), cache_control)
+        plan["index"] = index
+        if isinstance(entry, dict) and entry.get("id") is not None:
+            plan["id"] = entry["id"]
+        plans.append(plan)
+
+    concurrency = BATCH_CONCURRENCY
+    requested = data.get("concurrency")
+    if isinstance(requested, int) and not isinstance(requested, bool) and requested > 0:
+        concurrency = min(concurrency, requested)
+    return {"plans": plans, "concurrency": concurrency}
+
+
+def batch_line(plan: dict, payload: dict, status: int, cache_status: str | None = None) -> str:
+    """One NDJSON result line: the item's answer payload under ``result``, or its failure under ``error``."""
+    line = {"index": plan["index"]}
+    if "id" in plan:
+        line["id"] = plan["id"]
+    line["status"] = status
+    if cache_status:
+        line["cache"] = cache_status
+    line["result" if status < 400 else "error"] = payload
+    return json.dumps(line, ensure_ascii=False) + "\n"
+
+
+def batch_summary(results: list[int], started: float) -> str:
+    succeeded = sum(1 for status in results if status < 400)
+    return json.dumps({
+        "done": True,
+        "items": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "elapsed_ms": round((time.monotonic() - started) * 1000),
+    }) + "\n"
+
+
+def plan_request_labels(plan: dict) -> dict[str, str]:
+    return {
+        "mode": "web" if plan["web"] else "chat",
+        "model": (plan.get("payload") or {}).get("model") or PPLX_MODEL,
+        "persona": plan["personality"],
     }
-    if INCLUDE_RAW:
-        payload["raw"] = out
 
-    return jsonify(payload)
 
+@contextmanager
+def batch_item_timings(plan: dict):
+    """Time one batch entry on its own so its upstream phases are not folded into the whole batch."""
+    if not metrics.enabled:
+        yield
+        return
+    timings = RequestTimings()
+    timings.labels.update(plan_request_labels(plan))
+    token = current_timings.set(timings)
+    try:
+        yield
+    finally:
+        current_timings.reset(token)
+        timings.finish()
+
+
+BATCH_CANCELLED = {"error": "Batch cancelled"}, 499
+
+
+def batch_item_cancelled(plan: dict, cancelled: threading.Event | None) -> bool:
+    if cancelled is None or not cancelled.is_set():
+        return False
+    cancellations.record("disconnect", "web" if plan.get("web") else "chat")
+    return True
+
+
+def answer_batch_item(
+    plan: dict, deadline_header: str | None = None, cancelled: threading.Event | None = None
+) -> tuple[dict, int, str | None]:
+    """Answer one planned batch entry through the response cache, single-flight and admission gate.
+
+    Once ``cancelled`` is set the entry stops before it would call the
+    provider, including after waiting for an admission slot.
+    """
+    if "response" in plan:
+        payload, status = plan["response"]
+        return payload, status, None
+    cached, stored_status = stored_answer(plan)
+    if cached is not None:
+        return cached, 200, stored_status
+    if batch_item_cancelled(plan, cancelled):
+        return (*BATCH_CANCELLED, None)
+    if not admission_gate.acquire():
+        payload, status, _headers = overloaded_payload()
+        return payload, status, None
+    try:
+        if batch_item_cancelled(plan, cancelled):
+            return (*BATCH_CANCELLED, None)
+        # Each entry gets its own deadline from when it starts, not from when the batch arrived.
+        plan["deadline"] = request_deadline(deadline_header)
+        with batch_item_timings(plan):
+            payload, status = ask_flights.do(plan["cache"]["key"], lambda: answer_ask(plan))
+    except Exception:
+        app.logger.exception("Batch entry %s failed", plan["index"])
+        payload, status = {"error": "Internal error while answering this query"}, 500
+    finally:
+        admission_gate.release()
+    return payload, status, cache_status_for(plan)
+
+
+def batch_results(plans: list[dict], concurrency: int, deadline_header: str | None = None):
+    """Yield an NDJSON line per entry as soon as it finishes, then a summary line.
+
+    At most ``concurrency`` entries run at once. If the client goes away,
+    entries not yet started are dropped and running ones stop before they
+    reach the provider; a provider call already under way is finished.
+    """
+    started = time.monotonic()
+    statuses = []
+    pending = {}
+    queued = iter(plans)
+    cancelled = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ask-batch")
+    try:
+        while True:
+            for plan in queued:
+                pending[executor.submit(answer_batch_item, plan, deadline_header, cancelled)] = plan
+                if len(pending) >= concurrency:
+                    break
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                plan = pending.pop(future)
+                payload, status, cache_status = future.result()
+                statuses.append(status)
+                yield batch_line(plan, payload, status, cache_status)
+        yield batch_summary(statuses, started)
+    finally:
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+@app.post("/api/ask")
+@admitted
+def ask():
+    data = request.get_json(silent=True) or {}
+    plan = plan_ask(data, request.headers.get("Cache-Control"))
+    plan["deadline"] = request_deadline(request.headers.get(REQUEST_TIMEOUT_HEADER))
+    plan["stream_deadline"] = stream_deadline(request.headers.get(REQUEST_TIMEOUT_HEADER))
+    if "response" in plan:
+        payload, status = plan["response"]
+        record_conversation_turn(plan, payload, status)
+        return jsonify(payload), status
+
+    cached, g.cache_status = stored_answer(plan)
+    if cached is not None:
+        if plan["stream"]:
+            return sse_response(recorded_events(plan, cached_answer_events(cached), cached))
+        record_conversation_turn(plan, cached)
+        return jsonify(cached)
+    g.cache_status = cache_status_for(plan)
+
+    flight_key = plan["cache"]["key"]
+    if plan["stream"]:
+        flight = ask_flights.stream(flight_key, lambda f: pump_ask_stream(plan, f))
+        failure = flight.wait_started()
+        if failure:
+            payload, status = failure
+            return jsonify(payload), status
+        return sse_response(recorded_events(plan, flight.subscribe(), flight=flight))
+
+    payload, status = ask_flights.do(flight_key, lambda: answer_ask(plan))
+    record_conversation_turn(plan, payload, status)
+    return jsonify(payload), status
+
+
+@app.post("/api/ask/batch")
+def ask_batch():
+    with timed("parse"):
+        data = request.get_json(silent=True) or {}
+    ip = client_ip(request.headers.get("X-Forwarded-For"), request.remote_addr)
+    refusal = batch_rate_limit(ip, request_session_id(data, request.headers.get(SESSION_ID_HEADER)), data)
+    if refusal:
+        payload, status, headers = refusal
+        return jsonify(payload), status, headers
+    batch = plan_batch(data, request.headers.get("Cache-Control"))
+    if "response" in batch:
+        payload, status = batch["response"]
+        return jsonify(payload), status
+    resp = Response(
+        batch_results(batch["plans"], batch["concurrency"], request.headers.get(REQUEST_TIMEOUT_HEADER)),
+        mimetype="application/x-ndjson",
+    )
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+
+@app.post("/api/conversations")
+def create_conversation():
+    body = request.get_json(silent=True) or {}
+    conversation_id = conversations.create(body.get("history"))
+    return jsonify({"conversation_id": conversation_id, "ttl": CONVERSATION_TTL}), 201
+
+
+@app.get("/api/conversations/<conversation_id>")
+def get_conversation(conversation_id: str):
+    turns = conversations.load(conversation_id)
+    if turns is None:
+        return jsonify({"error": "Conversation not found or expired", "conversation_expired": True}), 404
+    return jsonify({"conversation_id": conversation_id, "turns": turns})
+
+
+@app.delete("/api/conversations/<conversation_id>")
+def delete_conversation(conversation_id: str):
+    conversations.delete(conversation_id)
+    return "", 204
+
+@app.get("/api/search")
 @app.post("/api/search")
 def api_search():
-    return jsonify({
-        "error": "Search endpoint unavailable",
-        "details": "OpenAI's Chat Completions API does not provide web search results."
-    }), 501
+    """Full-text search over sources cited by earlier web answers (``q``/``query``, ``limit``, ``offset``, ``domain``)."""
+    if citation_store is None:
+        return jsonify({
+            "error": "Search endpoint unavailable",
+            "details": "The citation store is disabled (CITATION_STORE_ENABLED=false).",
+        }), 501
+    if not citation_store.ready():
+        return jsonify({"error": "Search endpoint unavailable", "details": citation_store.error}), 503
+    data = (request.get_json(silent=True) or {}) if request.method == "POST" else request.args
+    text = data.get("query") or data.get("q")
+    if not isinstance(text, str) or not search_terms(text):
+        return jsonify({"error": "Query is required as a string"}), 400
+    try:
+        limit = min(SEARCH_MAX_LIMIT, max(1, int(data.get("limit") or 10)))
+        offset = max(0, int(data.get("offset") or 0))
+    except (TypeError, ValueError):
+        return jsonify({"error": "limit and offset must be integers"}), 400
+    domain = data.get("domain")
+    try:
+        return jsonify(citation_store.search(text, limit=limit, offset=offset, domain=domain if isinstance(domain, str) else None))
+    except sqlite3.Error as exc:
+        app.logger.error("Citation search failed: %s", exc)
+        return jsonify({"error": "Search is unavailable right now."}), 503
+
+
+@app.get("/api/search/stats")
+@operator_only
+def search_stats():
+    if citation_store is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **citation_store.stats()})
+
+
+def conditional_json(payload, max_age: int = 0):
+    """``jsonify`` with an ETag, answering ``304`` when the client's copy is current."""
+    resp = jsonify(payload)
+    if max_age > 0:
+        resp.cache_control.public = True
+        resp.cache_control.max_age = max_age
+    else:
+        resp.cache_control.no_cache = True
+    resp.add_etag()
+    return resp.make_conditional(request)
+
+
+@app.get("/api/personas")
+def list_personas():
+    # Personas hot-reload, so clients revalidate every time and mostly get a 304.
+    return conditional_json(personas.snapshot())
+
+
+@app.get("/api/personas/<key>")
+def get_persona(key: str):
+    persona = personas.get(key.strip().lower())
+    if persona is None:
+        return jsonify({"error": "Unknown persona"}), 404
+    return conditional_json(persona.summary())
+
+
+@app.get("/api/raw/<raw_id>")
+def get_raw_response(raw_id: str):
+    body = raw_store.get(raw_id) if raw_store is not None else None
+    if body is None:
+        return jsonify({"error": "Raw response not found or expired"}), 404
+    return Response(body, mimetype="application/json")
 
 
 @app.get("/api/quick-questions")
 def quick_questions():
-    return jsonify({"questions": QUICK_QUESTIONS})
+    return conditional_json({"questions": quick_questions_source.get()}, QUICK_QUESTIONS_MAX_AGE)
 
 @app.post("/api/chat")
+@admitted
 def api_chat():
-    if not OPENAI_API_KEY and not OPENROUTER_API_KEY:
-        return jsonify({"error": "Server missing OPENAI_API_KEY or OPENROUTER_API_KEY"}), 500
-
     body = request.get_json(silent=True) or {}
-    messages = body.get("messages")
-    model = body.get("model") or CHAT_DEFAULT_MODEL
-    requested_personality = body.get("personality")
-    personality_key, system_prompt = resolve_personality(requested_personality)
-
-    if not isinstance(messages, list) or not messages:
-        return jsonify({"error": "Provide 'messages' array like [{role, content}]"}), 400
-
-    if INJECT_SYSTEM_PROMPT and system_prompt and body.get("inject_system", True):
-        first_role = messages[0].get("role") if messages else None
-        if first_role != "system":
-            messages = [{"role": "system", "content": system_prompt}] + messages
+    plan = plan_chat(body)
+    if "response" in plan:
+        payload, status = plan["response"]
+        return jsonify(payload), status
 
     try:
-        resp = post_chat_completion({
-            "model": model,
-            "messages": messages,
-            "temperature": body.get("temperature", 0.7),
-            "top_p": body.get("top_p", 1),
-        })
-        out = resp.json()
-        choice0 = (out.get("choices", []) or [None])[0] or {}
-        answer = (choice0.get("message") or {}).get("content") or ""
-        payload = {
-            "answer": strip_inline_citations(answer),
-            "personality": personality_key,
-        }
-        if INCLUDE_RAW:
-            payload["raw"] = out
-        return jsonify(payload)
+        client_timeout = request.headers.get(REQUEST_TIMEOUT_HEADER)
+        resp = post_chat_completion(plan["payload"], request_deadline(client_timeout))
+        if plan["stream"]:
+            return sse_response(
+                stream_answer_events(
+                    resp, deadline=stream_deadline(client_timeout), personality_key=plan["personality"], include_citations=False
+                )
+            )
+        return jsonify(chat_passthrough_payload(resp.json(), plan["personality"]))
     except requests.HTTPError as e:
-        err_resp = getattr(e, "response", None)
-        try:
-            err_json = err_resp.json() if err_resp is not None else {"message": str(e)}
-        except Exception:
-            err_json = {
-                "message": str(e),
-                "text": getattr(err_resp, "text", ""),
-            }
-        status_code = getattr(err_resp, "status_code", 502)
+        status_code, err_json = upstream_error_details(getattr(e, "response", None), e)
         app.logger.error("Chat completion HTTPError %s: %s", status_code, err_json)
         return jsonify({"error": "Chat completion API error", "details": err_json}), status_code
     except requests.RequestException as e:
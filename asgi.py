@@ -0,0 +1,954 @@
+import asyncio
+import contextlib
+import json
+import os
+import time
+
+import httpx
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from asgiref.wsgi import WsgiToAsgi
+
+import app as core
+
+ASYNC_MAX_INFLIGHT = int(os.getenv("ASYNC_MAX_INFLIGHT", "1000"))
+ASYNC_POOL_TIMEOUT = float(os.getenv("ASYNC_POOL_TIMEOUT", "10"))
+
+logger = core.app.logger
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    """``WsgiToAsgi`` that serves each request on a thread of its own.
+
+    asgiref runs thread-sensitive calls, the WSGI app included, on one shared
+    thread by default, which would serialize the Flask routes. Entering a
+    ``ThreadSensitiveContext`` per request gives each one a dedicated
+    executor instead.
+    """
+
+    async def __call__(self, scope, receive, send):
+        async with ThreadSensitiveContext():
+            await super().__call__(scope, receive, send)
+
+
+flask_app = ThreadedWsgiToAsgi(core.app)
+
+
+def connect_tracer(timings: core.RequestTimings):
+    """httpx ``trace`` hook adding TCP connect and TLS handshake time to ``upstream_connect``."""
+    mark = None
+
+    async def trace(event: str, info: dict) -> None:
+        nonlocal mark
+        if event == "connection.connect_tcp.started":
+            mark = time.perf_counter()
+        elif mark is not None and event in {"connection.connect_tcp.complete", "connection.start_tls.complete"}:
+            now = time.perf_counter()
+            timings.add("upstream_connect", now - mark)
+            mark = now
+
+    return trace
+
+
+class AsyncUpstreamClient:
+    """Async counterpart of ``core.UpstreamClient`` for the ASGI entry point.
+
+    A single ``httpx.AsyncClient`` keeps per-host keep-alive pools, and a
+    semaphore caps how many upstream requests a process has in flight so a
+    burst queues instead of exhausting sockets.
+    """
+
+    def __init__(self, *, max_inflight: int, max_keepalive: int, connect_timeout: float, read_timeout: float):
+        self.max_inflight = max(1, max_inflight)
+        self.max_keepalive = max(1, max_keepalive)
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout, pool=ASYNC_POOL_TIMEOUT)
+        self._client: httpx.AsyncClient | None = None
+        self._limit: asyncio.Semaphore | None = None
+        self.inflight = 0
+        self.requests = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_inflight,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=core.UPSTREAM_KEEPALIVE_IDLE or None,
+                ),
+            )
+        return self._client
+
+    @property
+    def limit(self) -> asyncio.Semaphore:
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(self.max_inflight)
+        return self._limit
+
+    @contextlib.asynccontextmanager
+    async def stream(self, url: str, headers: dict, payload: dict, timeout: httpx.Timeout | None = None, provider: str | None = None):
+        """POST and yield the response once its headers arrive, reporting upstream phases when ``provider`` is named."""
+        timings = core.current_timings.get() if provider else None
+        extensions = {}
+        if timings is not None:
+            timings.upstream_attempt(provider)
+            extensions["trace"] = connect_tracer(timings)
+        async with self.limit:
+            self.inflight += 1
+            self.requests += 1
+            try:
+                content = json.dumps(payload)
+                started = time.perf_counter()
+                async with self.client.stream(
+                    "POST", url, headers=headers, content=content, timeout=timeout or self.timeout, extensions=extensions
+                ) as resp:
+                    if timings is not None:
+                        timings.phases["upstream_ttfb"] = time.perf_counter() - started
+                    yield resp
+                    if timings is not None and not resp.is_error:
+                        timings.upstream_done()
+            finally:
+                self.inflight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "max_inflight": self.max_inflight,
+            "inflight": self.inflight,
+            "requests": self.requests,
+        }
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+upstream = AsyncUpstreamClient(
+    max_inflight=ASYNC_MAX_INFLIGHT,
+    max_keepalive=core.UPSTREAM_POOL_MAXSIZE,
+    connect_timeout=core.UPSTREAM_CONNECT_TIMEOUT,
+    read_timeout=core.UPSTREAM_READ_TIMEOUT,
+)
+
+
+def _header(scope, name: bytes) -> str:
+    for key, value in scope.get("headers", []):
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return ""
+
+
+def _response_headers(scope, content_type: str) -> list[tuple[bytes, bytes]]:
+    headers = [(b"content-type", content_type.encode("latin-1"))]
+    if _header(scope, b"origin") and not core.OPS_PATH_RE.fullmatch(scope["path"]):
+        headers.append((b"access-control-allow-origin", b"*"))
+    return headers
+
+
+async def read_json(scope, receive) -> dict:
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return {}
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    if "json" not in _header(scope, b"content-type"):
+        return {}
+    try:
+        data = json.loads(body or b"null")
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+async def wait_disconnect(receive) -> None:
+    """Return once the client has gone away (call after the request body has been read)."""
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def unless_disconnected(receive, awaitable) -> tuple[bool, object]:
+    """Await ``awaitable`` unless the client leaves first; returns ``(disconnected, result)``.
+
+    On a disconnect the awaitable is cancelled, which closes any upstream
+    request it has open.
+    """
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(wait_disconnect(receive))
+    try:
+        done, _ = await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if task in done:
+            return False, task.result()
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+        return True, None
+    finally:
+        watcher.cancel()
+        task.cancel()
+
+
+async def send_json(scope, send, payload: dict, status: int = 200, extra_headers=()) -> None:
+    body = f"{core.app.json.dumps(payload, separators=(',', ':'))}\n".encode("utf-8")
+    headers = _response_headers(scope, "application/json")
+    if core.COMPRESSION_ENABLED:
+        headers.append((b"vary", b"Accept-Encoding"))
+        encoding = core.negotiate_compression(_header(scope, b"accept-encoding"), len(body))
+        if encoding:
+            body = core.compress_body(body, encoding)
+            headers.append((b"content-encoding", encoding.encode("latin-1")))
+    headers.append((b"content-length", str(len(body)).encode("latin-1")))
+    headers.extend(extra_headers)
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def start_event_stream(scope, send, extra_headers=()) -> None:
+    headers = _response_headers(scope, "text/event-stream; charset=utf-8")
+    headers += [(b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")]
+    headers.extend(extra_headers)
+    await send({"type": "http.response.start", "status": 200, "headers": headers})
+
+
+async def send_events(scope, send, events: list[str], extra_headers=()) -> None:
+    """Send a complete, already-known SSE body (e.g. a cached answer replay)."""
+    await start_event_stream(scope, send, extra_headers)
+    await send({"type": "http.response.body", "body": "".join(events).encode("utf-8")})
+
+
+class AsyncStreamFlight:
+    """asyncio counterpart of ``core.StreamFlight``."""
+
+    def __init__(self):
+        self._cond = asyncio.Condition()
+        self.events: list[str] = []
+        self.response: tuple[dict, int] | None = None
+        self.result: dict | None = None
+        self.started = False
+        self.closed = False
+        self.subscribers = 0
+        self.abandoned = False
+
+    async def _notify(self) -> None:
+        async with self._cond:
+            self._cond.notify_all()
+
+    async def start(self) -> None:
+        self.started = True
+        await self._notify()
+
+    async def publish(self, events: list[str]) -> None:
+        if events:
+            self.events.extend(events)
+            await self._notify()
+
+    async def fail(self, response: tuple[dict, int]) -> None:
+        self.response = response
+        self.closed = True
+        await self._notify()
+
+    async def close(self) -> None:
+        self.closed = True
+        await self._notify()
+
+    async def wait_started(self) -> tuple[dict, int] | None:
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.started or self.closed)
+        if self.started:
+            return None
+        return self.response or ({"error": "Upstream stream unavailable"}, 502)
+
+    def join(self) -> None:
+        self.subscribers += 1
+
+    def leave(self) -> None:
+        """Drop a listener; the pump stops once the last one leaves an unfinished flight."""
+        self.subscribers -= 1
+        if not self.subscribers and not self.closed:
+            self.abandoned = True
+
+    async def subscribe(self):
+        index = 0
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: index < len(self.events) or self.closed)
+            batch = self.events[index:]
+            index += len(batch)
+            if batch:
+                yield batch
+            if self.closed and index >= len(self.events):
+                return
+
+
+class AsyncSingleFlight:
+    """asyncio counterpart of ``core.SingleFlight``; shares its switch and counters.
+
+    Leaders run as tasks and callers await them through ``asyncio.shield`` so a
+    disconnecting leader does not cancel the call its followers are waiting on;
+    once every caller has given up, the call is cancelled and ``on_cancel`` runs.
+    """
+
+    def __init__(self, shared):
+        self.shared = shared
+        self._calls: dict[str, asyncio.Task] = {}
+        self._waiters: dict[asyncio.Task, int] = {}
+        self._streams: dict[str, AsyncStreamFlight] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def do(self, key: str, factory, on_cancel=None):
+        if not self.shared.enabled:
+            try:
+                return await factory()
+            except asyncio.CancelledError:
+                if on_cancel is not None:
+                    on_cancel()
+                raise
+        task = self._calls.get(key)
+        leader = task is None
+        if leader:
+            task = asyncio.ensure_future(factory())
+            self._calls[key] = task
+            task.add_done_callback(lambda t, k=key: self._calls.pop(k, None) if self._calls.get(k) is t else None)
+        self.shared.count("leaders" if leader else "followers")
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                if not task.done():
+                    task.cancel()
+                    if on_cancel is not None:
+                        on_cancel()
+
+    def stream(self, key: str | None, pump) -> AsyncStreamFlight:
+        coalesce = self.shared.enabled and key is not None
+        flight = self._streams.get(key) if coalesce else None
+        if flight is not None and not flight.abandoned:
+            self.shared.count("followers")
+            return flight
+        flight = AsyncStreamFlight()
+        if coalesce:
+            self._streams[key] = flight
+            self.shared.count("leaders")
+        task = asyncio.ensure_future(self._pump(key if coalesce else None, flight, pump))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return flight
+
+    async def _pump(self, key: str | None, flight: AsyncStreamFlight, pump) -> None:
+        try:
+            await pump(flight)
+        except Exception:
+            logger.exception("Streaming pump failed")
+            if not flight.started:
+                await flight.fail(({"error": "Upstream stream unavailable"}, 502))
+            else:
+                await flight.publish([core.sse_event("error", {"error": "Upstream stream interrupted"})])
+        finally:
+            if key is not None and self._streams.get(key) is flight:
+                del self._streams[key]
+            await flight.close()
+
+
+flights = AsyncSingleFlight(core.ask_flights)
+
+
+def upstream_target(plan: dict, stream: bool = False) -> tuple[str, dict, dict]:
+    headers, payload = core.perplexity_request(plan["messages"], stream=stream)
+    return core.PPLX_API_URL, headers, payload
+
+
+def _status_of(exc: BaseException) -> int | None:
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None)
+
+
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+
+def attempt_timeout(deadline: float | None) -> httpx.Timeout:
+    connect, read = core.deadline_timeout(deadline)
+    return httpx.Timeout(read, connect=connect, pool=ASYNC_POOL_TIMEOUT)
+
+
+@contextlib.asynccontextmanager
+async def retrying_stream(policy: core.RetryPolicy, url: str, headers: dict, payload: dict, deadline: float | None, *, record=None, retry: bool = True):
+    """Async ``core.RetryPolicy.call``: yield the first successful upstream response.
+
+    Error responses that are not retried are raised as ``httpx.HTTPStatusError``.
+    ``record(seconds, status)`` is told about every attempt.
+    """
+    if retry:
+        policy.begin()
+    attempt = 1
+    while True:
+        stack = contextlib.AsyncExitStack()
+        started = time.perf_counter()
+        try:
+            resp = await stack.enter_async_context(
+                upstream.stream(url, headers, payload, attempt_timeout(deadline), provider=policy.name)
+            )
+        except RETRYABLE_ERRORS:
+            if record is not None:
+                record(time.perf_counter() - started, None)
+            delay = policy.next_delay(attempt, None, None, deadline) if retry else None
+            if delay is None:
+                raise
+        else:
+            if record is not None:
+                record(time.perf_counter() - started, resp.status_code)
+            if not resp.is_error:
+                async with stack:
+                    yield resp
+                return
+            async with stack:
+                await resp.aread()
+                retry_after = core.parse_retry_after(resp.headers.get("retry-after"))
+                delay = policy.next_delay(attempt, resp.status_code, retry_after, deadline) if retry else None
+                if delay is None:
+                    resp.raise_for_status()
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+async def fetch_json(policy: core.RetryPolicy, url: str, headers: dict, payload: dict, deadline: float | None, **options) -> dict:
+    async with retrying_stream(policy, url, headers, payload, deadline, **options) as resp:
+        await resp.aread()
+        return resp.json()
+
+
+def _provider_stream(provider: dict, payload: dict, deadline: float | None, retry: bool = True):
+    url, headers, body = core.provider_router.request_for(provider, payload)
+    name = provider["name"]
+    return retrying_stream(
+        core.retry_policies[name], url, headers, body, deadline,
+        record=lambda seconds, status: core.provider_router.record(name, seconds, status, payload.get("model"), bool(payload.get("stream"))),
+        retry=retry,
+    )
+
+
+async def _post_provider(provider: dict, payload: dict, deadline: float | None, retry: bool = True) -> dict:
+    async with _provider_stream(provider, payload, deadline, retry) as resp:
+        await resp.aread()
+        return resp.json()
+
+
+async def post_routed(payload: dict, deadline: float | None = None) -> dict:
+    """Async ``core.ProviderRouter.call``: failover across providers, hedging when enabled."""
+    router = core.provider_router
+    candidates = router.candidates()
+    delay = router.hedge_delay(candidates)
+    if delay is None:
+        for index, provider in enumerate(candidates):
+            last = index == len(candidates) - 1
+            try:
+                return await _post_provider(provider, payload, deadline, retry=last)
+            except httpx.HTTPError as exc:
+                if last or not core.should_failover(_status_of(exc)):
+                    raise
+                router.count("failovers")
+                logger.warning("Provider %s failed (%s); failing over", provider["name"], _status_of(exc) or exc)
+
+    primary, alternate = candidates[0], candidates[1]
+    tasks = {asyncio.ensure_future(_post_provider(primary, payload, deadline, retry=False)): primary}
+    done, pending = await asyncio.wait(tasks, timeout=delay)
+    if not done:
+        router.count("hedges")
+        tasks[asyncio.ensure_future(_post_provider(alternate, payload, deadline))] = alternate
+    pending = {task for task in tasks if not task.done()}
+    try:
+        while True:
+            for task in done:
+                if task.exception() is None:
+                    if tasks[task] is alternate:
+                        router.count("hedge_wins")
+                    return task.result()
+                last_exc = task.exception()
+            if not pending:
+                if alternate in tasks.values() or not core.should_failover(_status_of(last_exc)):
+                    raise last_exc
+                router.count("failovers")
+                task = asyncio.ensure_future(_post_provider(alternate, payload, deadline))
+                tasks[task] = alternate
+                pending = {task}
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+@contextlib.asynccontextmanager
+async def open_stream(plan: dict):
+    """Yield an open, non-error upstream stream, failing over chat providers before any byte is relayed."""
+    deadline = plan.get("deadline")
+    if plan["web"]:
+        url, headers, payload = upstream_target(plan, stream=True)
+        async with retrying_stream(core.retry_policies["perplexity"], url, headers, payload, deadline) as resp:
+            yield resp
+        return
+
+    router = core.provider_router
+    candidates = router.candidates()
+    for index, provider in enumerate(candidates):
+        last = index == len(candidates) - 1
+        stack = contextlib.AsyncExitStack()
+        try:
+            resp = await stack.enter_async_context(_provider_stream(provider, plan["payload"], deadline, retry=last))
+        except httpx.HTTPError as exc:
+            status = _status_of(exc)
+            if last or not core.should_failover(status):
+                raise
+            router.count("failovers")
+            logger.warning("Provider %s failed (%s); failing over", provider["name"], status or exc)
+            continue
+        async with stack:
+            yield resp
+        return
+
+
+def upstream_failure(plan: dict, exc: Exception) -> tuple[dict, int]:
+    """Map a provider error to the client reply, mirroring ``core.call_upstream``."""
+    if plan["web"]:
+        if isinstance(exc, RuntimeError):
+            if str(exc) != "missing_perplexity_key":
+                logger.error("Perplexity runtime error: %s", exc)
+            else:
+                logger.error("Perplexity key missing when web search requested")
+        elif isinstance(exc, httpx.HTTPStatusError):
+            status_code, err_json = core.upstream_error_details(exc.response, exc)
+            logger.error("Perplexity HTTPError %s: %s", status_code, err_json)
+        else:
+            logger.error("Perplexity RequestException: %s", exc)
+        return core.web_search_disabled_payload(plan["personality"]), 200
+
+    if isinstance(exc, httpx.HTTPStatusError):
+        status_code, err_json = core.upstream_error_details(exc.response, exc)
+        logger.error("Chat completion HTTPError %s: %s", status_code, err_json)
+        return {"error": "Chat completion API error", "details": err_json}, status_code
+    if isinstance(exc, httpx.HTTPError):
+        logger.error("Chat completion RequestException: %s", str(exc))
+        return {"error": "Network error", "details": str(exc)}, 502
+    if isinstance(exc, RuntimeError) and str(exc) == "missing_api_key":
+        return {"error": "Server missing OpenAI/OpenRouter API key"}, 500
+    raise exc
+
+
+def store_blocks(store) -> bool:
+    """True when calls into ``store`` do I/O (SQLite or Redis) rather than touch process memory."""
+    return store is not None and not isinstance(store, core.MemoryStore)
+
+
+async def off_loop(offload: bool, func, *args):
+    """``func(*args)``, on a worker thread when ``offload`` says it could block the event loop."""
+    if not offload:
+        return func(*args)
+    return await sync_to_async(func, thread_sensitive=False)(*args)
+
+
+async def cache_call(func, *args):
+    """``func(*args)``, off the loop when the response cache embeds queries (CPU-bound) or its store does I/O."""
+    cache = core.response_cache
+    return await off_loop(cache.semantic is not None or store_blocks(cache.store), func, *args)
+
+
+async def plan_ask(data: dict, cache_control: str) -> dict:
+    """``core.plan_ask``, off the loop when it loads a conversation from a store that does I/O."""
+    offload = bool(data.get("conversation_id")) and store_blocks(core.conversations.store)
+    return await off_loop(offload, core.plan_ask, data, cache_control)
+
+
+async def record_conversation_turn(plan: dict, payload: dict | None, status: int = 200) -> None:
+    offload = bool(plan.get("conversation_id")) and store_blocks(core.conversations.store)
+    await off_loop(offload, core.record_conversation_turn, plan, payload, status)
+
+
+async def answer(plan: dict, build_payload, finish=None) -> tuple[dict, int]:
+    try:
+        if plan["web"]:
+            url, headers, payload = upstream_target(plan)
+            out = await fetch_json(core.retry_policies["perplexity"], url, headers, payload, plan.get("deadline"))
+        else:
+            out = await post_routed(plan["payload"], plan.get("deadline"))
+    except (httpx.HTTPError, RuntimeError) as exc:
+        return upstream_failure(plan, exc)
+    # Answer payloads park the full provider body in ``raw_store`` when INCLUDE_RAW is on.
+    result = await off_loop(store_blocks(core.raw_store), build_payload, out, plan["personality"])
+    if finish is not None:
+        result = await cache_call(finish, plan, result)
+    return result, 200
+
+
+async def pump_stream(plan: dict, flight: AsyncStreamFlight, relay) -> None:
+    """Open the upstream stream and publish relayed SSE events into ``flight``.
+
+    Leaving the ``open_stream`` block early closes the upstream connection:
+    that happens once every listener is gone or the deadline has passed.
+    """
+    deadline = plan.get("stream_deadline")
+    source = relay.mode or "chat"
+    try:
+        async with open_stream(plan) as resp:
+            await flight.start()
+            try:
+                async for line in resp.aiter_lines():
+                    if flight.abandoned:
+                        core.cancellations.record("disconnect", source, relay.streamed)
+                        return
+                    if deadline is not None and time.monotonic() > deadline:
+                        core.cancellations.record("deadline", source, relay.streamed)
+                        await flight.publish(relay.fail(core.DEADLINE_EXCEEDED_ERROR))
+                        return
+                    chunk = core.decode_upstream_line(line)
+                    if chunk is core.STREAM_DONE:
+                        break
+                    if chunk:
+                        await flight.publish(relay.feed(chunk))
+            except httpx.HTTPError as exc:
+                logger.error("Upstream stream interrupted: %s", exc)
+                await flight.publish(relay.fail())
+            else:
+                await flight.publish(await cache_call(relay.finish))
+    except (httpx.HTTPError, RuntimeError) as exc:
+        if flight.started:
+            raise
+        await flight.fail(upstream_failure(plan, exc))
+
+
+async def send_flight(scope, receive, send, flight: AsyncStreamFlight, extra_headers=()) -> None:
+    async def relay_events() -> None:
+        failure = await flight.wait_started()
+        if failure:
+            await send_json(scope, send, *failure)
+            return
+        await start_event_stream(scope, send, extra_headers)
+        async for batch in flight.subscribe():
+            await send({"type": "http.response.body", "body": "".join(batch).encode("utf-8"), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    flight.join()
+    try:
+        await unless_disconnected(receive, relay_events())
+    finally:
+        flight.leave()
+
+
+class AsyncAdmissionGate:
+    """asyncio counterpart of ``core.AdmissionGate`` with the same limits.
+
+    The semaphore is FIFO, so queued requests are admitted in arrival order.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._sem: asyncio.Semaphore | None = None
+        self.active = 0
+        self.waiting = 0
+        self.counters = {"admitted": 0, "queued": 0, "rejected_queue_full": 0, "rejected_timeout": 0}
+
+    async def acquire(self) -> bool:
+        if self.max_concurrent <= 0:
+            return True
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_concurrent)
+        if self._sem.locked():
+            if self.waiting >= self.max_queue:
+                self.counters["rejected_queue_full"] += 1
+                return False
+            self.counters["queued"] += 1
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._sem.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.counters["rejected_timeout"] += 1
+            return False
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        self.counters["admitted"] += 1
+        return True
+
+    def release(self) -> None:
+        if self.max_concurrent <= 0:
+            return
+        self.active -= 1
+        self._sem.release()
+
+    def stats(self) -> dict:
+        return dict(
+            self.counters,
+            active=self.active,
+            waiting=self.waiting,
+            max_concurrent=self.max_concurrent,
+            max_queue=self.max_queue,
+        )
+
+
+gate = AsyncAdmissionGate(core.ADMISSION_MAX_CONCURRENT, core.ADMISSION_MAX_QUEUE, core.ADMISSION_QUEUE_TIMEOUT)
+
+
+def rate_limit_identity(scope, data: dict) -> tuple[str, str | None]:
+    client = scope.get("client") or ("", 0)
+    ip = core.client_ip(_header(scope, b"x-forwarded-for"), client[0])
+    return ip, core.request_session_id(data, _header(scope, core.SESSION_ID_HEADER.lower().encode("latin-1")))
+
+
+async def rate_limit_wait(scope, data: dict) -> float:
+    return await off_loop(store_blocks(core.rate_limiter.store), core.rate_limiter.check, *rate_limit_identity(scope, data))
+
+
+async def send_rate_limited(scope, send, reply: tuple[dict, int, dict[str, str]]) -> None:
+    payload, status, headers = reply
+    extra = [(key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in headers.items()]
+    await send_json(scope, send, payload, status, extra)
+
+
+def admitted(handler):
+    """Rate-limit and admission-gate a provider-calling handler, which receives the decoded body."""
+
+    async def wrapper(scope, receive, send) -> None:
+        with core.timed("parse"):
+            data = await read_json(scope, receive)
+        wait = await rate_limit_wait(scope, data)
+        if wait > 0:
+            payload, status, headers = core.rate_limited_payload(wait)
+        elif not await gate.acquire():
+            payload, status, headers = core.overloaded_payload()
+        else:
+            try:
+                await handler(scope, data, receive, send)
+            finally:
+                gate.release()
+            return
+        await send_rate_limited(scope, send, (payload, status, headers))
+
+    return wrapper
+
+
+async def ask(scope, data: dict, receive, send) -> None:
+    plan = await plan_ask(data, _header(scope, b"cache-control"))
+    client_timeout = _header(scope, core.REQUEST_TIMEOUT_HEADER.lower().encode("latin-1"))
+    plan["deadline"] = core.request_deadline(client_timeout)
+    plan["stream_deadline"] = core.stream_deadline(client_timeout)
+    if "response" in plan:
+        await record_conversation_turn(plan, *plan["response"])
+        await send_json(scope, send, *plan["response"])
+        return
+
+    cached, stored_status = await cache_call(core.stored_answer, plan)
+    if cached is not None:
+        hit = [(b"x-cache", stored_status.encode("latin-1"))]
+        if plan["stream"]:
+            await send_events(scope, send, core.cached_answer_events(cached), hit)
+        else:
+            await send_json(scope, send, cached, extra_headers=hit)
+        await record_conversation_turn(plan, cached)
+        return
+    cache_status = core.cache_status_for(plan)
+    extra_headers = [(b"x-cache", cache_status.encode("latin-1"))] if cache_status else []
+
+    flight_key = plan["cache"]["key"]
+    if plan["stream"]:
+
+        def pump(flight: AsyncStreamFlight):
+            relay = core.AnswerStreamRelay(personality_key=plan["personality"], **core.ask_relay_options(plan, flight))
+            return pump_stream(plan, flight, relay)
+
+        flight = flights.stream(flight_key, pump)
+        await send_flight(scope, receive, send, flight, extra_headers)
+        await record_conversation_turn(plan, flight.result)
+        return
+
+    build_payload = core.web_answer_payload if plan["web"] else core.chat_answer_payload
+    source = "web" if plan["web"] else "chat"
+    disconnected, result = await unless_disconnected(receive, flights.do(
+        flight_key,
+        lambda: answer(plan, build_payload, core.finish_ask_payload),
+        on_cancel=lambda: core.cancellations.record("disconnect", source),
+    ))
+    if disconnected:
+        return
+    payload, status = result
+    await record_conversation_turn(plan, payload, status)
+    await send_json(scope, send, payload, status, extra_headers)
+
+
+async def api_chat(scope, data: dict, receive, send) -> None:
+    plan = core.plan_chat(data)
+    if "response" in plan:
+        await send_json(scope, send, *plan["response"])
+        return
+    client_timeout = _header(scope, core.REQUEST_TIMEOUT_HEADER.lower().encode("latin-1"))
+    plan["deadline"] = core.request_deadline(client_timeout)
+    plan["stream_deadline"] = core.stream_deadline(client_timeout)
+    if plan["stream"]:
+        relay = core.AnswerStreamRelay(personality_key=plan["personality"], include_citations=False)
+        flight = flights.stream(None, lambda f: pump_stream(plan, f, relay))
+        await send_flight(scope, receive, send, flight)
+        return
+    disconnected, result = await unless_disconnected(receive, answer(plan, core.chat_passthrough_payload))
+    if disconnected:
+        core.cancellations.record("disconnect", "chat")
+        return
+    payload, status = result
+    await send_json(scope, send, payload, status)
+
+
+async def answer_batch_item(plan: dict, deadline_header: str) -> tuple[dict, int, str | None]:
+    """asyncio counterpart of ``core.answer_batch_item``."""
+    if "response" in plan:
+        payload, status = plan["response"]
+        return payload, status, None
+    cached, stored_status = await cache_call(core.stored_answer, plan)
+    if cached is not None:
+        return cached, 200, stored_status
+    if not await gate.acquire():
+        payload, status, _headers = core.overloaded_payload()
+        return payload, status, None
+    try:
+        plan["deadline"] = core.request_deadline(deadline_header)
+        build_payload = core.web_answer_payload if plan["web"] else core.chat_answer_payload
+        with core.batch_item_timings(plan):
+            payload, status = await flights.do(plan["cache"]["key"], lambda: answer(plan, build_payload, core.finish_ask_payload))
+    except Exception:
+        logger.exception("Batch entry %s failed", plan["index"])
+        payload, status = {"error": "Internal error while answering this query"}, 500
+    finally:
+        gate.release()
+    return payload, status, core.cache_status_for(plan)
+
+
+async def ask_batch(scope, receive, send) -> None:
+    """Answer ``/api/ask/batch`` entries concurrently, streaming an NDJSON line per finished entry."""
+    with core.timed("parse"):
+        data = await read_json(scope, receive)
+    refusal = await off_loop(store_blocks(core.rate_limiter.store), core.batch_rate_limit, *rate_limit_identity(scope, data), data)
+    if refusal:
+        await send_rate_limited(scope, send, refusal)
+        return
+    batch = core.plan_batch(data, _header(scope, b"cache-control"))
+    if "response" in batch:
+        await send_json(scope, send, *batch["response"])
+        return
+
+    started = time.monotonic()
+    deadline_header = _header(scope, core.REQUEST_TIMEOUT_HEADER.lower().encode("latin-1"))
+    slots = asyncio.Semaphore(batch["concurrency"])
+
+    async def run(plan: dict):
+        async with slots:
+            return (plan, *await answer_batch_item(plan, deadline_header))
+
+    tasks = {asyncio.ensure_future(run(plan)): plan for plan in batch["plans"]}
+    headers = _response_headers(scope, "application/x-ndjson")
+    headers += [(b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")]
+    statuses = []
+
+    async def stream_lines() -> None:
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        for finished in asyncio.as_completed(tasks):
+            plan, payload, status, cache_status = await finished
+            statuses.append(status)
+            line = core.batch_line(plan, payload, status, cache_status)
+            await send({"type": "http.response.body", "body": line.encode("utf-8"), "more_body": True})
+        summary = core.batch_summary(statuses, started)
+        await send({"type": "http.response.body", "body": summary.encode("utf-8")})
+
+    try:
+        # A client that leaves mid-batch cancels every entry still queued or calling the provider.
+        await unless_disconnected(receive, stream_lines())
+    finally:
+        for task, plan in tasks.items():
+            if not task.done():
+                task.cancel()
+                core.cancellations.record("disconnect", "web" if plan.get("web") else "chat")
+
+
+async def upstream_stats(scope, receive, send) -> None:
+    stats = core.upstream_stats_payload()
+    stats["async"] = upstream.stats()
+    await send_json(scope, send, stats)
+
+
+async def admission_stats(scope, receive, send) -> None:
+    concurrency = core.admission_gate.stats()
+    concurrency["async"] = gate.stats()
+    await send_json(scope, send, {"rate_limit": core.rate_limiter.stats(), "concurrency": concurrency})
+
+
+def operator_only(handler):
+    """Guard a stats handler with ``core.METRICS_TOKEN`` when one is configured."""
+
+    async def wrapper(scope, receive, send) -> None:
+        if not core.ops_authorized(_header(scope, b"authorization")):
+            payload, status, headers = core.OPS_UNAUTHORIZED
+            extra = [(key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in headers.items()]
+            await send_json(scope, send, payload, status, extra)
+            return
+        await handler(scope, receive, send)
+
+    return wrapper
+
+
+ROUTES = {
+    ("POST", "/api/ask"): admitted(ask),
+    ("POST", "/api/chat"): admitted(api_chat),
+    ("POST", "/api/ask/batch"): ask_batch,
+    ("GET", "/api/upstream/stats"): operator_only(upstream_stats),
+    ("GET", "/api/admission/stats"): operator_only(admission_stats),
+}
+
+
+def timed_send(send, timings: core.RequestTimings):
+    """Wrap ``send`` to add ``Server-Timing`` to the response start and finish ``timings`` on the last body chunk."""
+
+    async def wrapped(message: dict) -> None:
+        if message["type"] == "http.response.start":
+            timings.status = message["status"]
+            if core.METRICS_SERVER_TIMING:
+                headers = list(message.get("headers") or [])
+                headers.append((b"server-timing", timings.server_timing().encode("latin-1")))
+                message = dict(message, headers=headers)
+        await send(message)
+        if message["type"] == "http.response.body" and not message.get("more_body"):
+            timings.finish(timings.status)
+
+    return wrapped
+
+
+async def lifespan(scope, receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            if core.quick_answers is not None:
+                core.quick_answers.ensure_worker()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await upstream.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI entry point: provider-calling routes run natively async, the rest fall back to Flask."""
+    if scope["type"] == "lifespan":
+        await lifespan(scope, receive, send)
+        return
+    handler = ROUTES.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+    if handler is None:
+        await flask_app(scope, receive, send)
+        return
+    if not core.metrics.enabled:
+        await handler(scope, receive, send)
+        return
+    timings = core.RequestTimings(scope["path"], scope["method"])
+    core.current_timings.set(timings)
+    try:
+        await handler(scope, receive, timed_send(send, timings))
+    finally:
+        timings.finish(timings.status)
@@ -0,0 +1,74 @@
+"""Micro-benchmark: legacy multi-pass cutoff check vs. the combined ``CUTOFF_PATTERN``.
+
+Run from the repository root:
+
+    python bench/cutoff_bench.py [--repeat 200]
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("FLASK_SECRET_KEY", "bench")
+os.environ.setdefault("FEEDBACK_QUEUE_ENABLED", "false")
+
+import app  # noqa: E402
+
+LEGACY_MONTHS = {name: index for index, name in enumerate(app.MONTH_NAMES, start=1)}
+LEGACY_YEAR_PATTERN = re.compile(r"\b(20\d{2})\b")
+LEGACY_MONTH_YEAR_PATTERN = re.compile(
+    r"(january|february|march|april|may|june|july|august|september|october|november|december)\s+(20\d{2})",
+    re.IGNORECASE,
+)
+LEGACY_PHRASES = ["after october 2023", "beyond october 2023", "since october 2023", "post october 2023"]
+
+
+def legacy_references_post_cutoff(text):
+    """The pre-engine implementation, kept here for comparison."""
+    if not text:
+        return False
+    lower = text.lower()
+    if any(phrase in lower for phrase in LEGACY_PHRASES):
+        return True
+    for month_name, year_str in LEGACY_MONTH_YEAR_PATTERN.findall(text):
+        year = int(year_str)
+        month = LEGACY_MONTHS.get(month_name.lower())
+        if year > 2023 or (year == 2023 and month in {11, 12}):
+            return True
+    for year_str in LEGACY_YEAR_PATTERN.findall(text):
+        if int(year_str) >= 2024:
+            return True
+    return False
+
+
+PARAGRAPH = (
+    "In March 2019 the committee reviewed the 2021 budget and the May 2022 audit. "
+    "Members compared figures from 2018, 2020 and October 2023 before adjourning. "
+)
+CASES = {
+    "short query": "Explain how photosynthesis works in simple terms.",
+    "short post-cutoff": "Who won the election in 2024?",
+    "pasted document (60 KB, clean)": PARAGRAPH * 400,
+    "pasted document (60 KB, hit at end)": PARAGRAPH * 400 + "What changed in December 2023?",
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'case':40} {'legacy µs':>12} {'engine µs':>12} {'speedup':>8}")
+    for label, text in CASES.items():
+        assert legacy_references_post_cutoff(text) == app.references_post_cutoff(text), label
+        legacy = min(timeit.repeat(lambda: legacy_references_post_cutoff(text), number=args.repeat, repeat=5))
+        engine = min(timeit.repeat(lambda: app.references_post_cutoff(text), number=args.repeat, repeat=5))
+        legacy_us = 1e6 * legacy / args.repeat
+        engine_us = 1e6 * engine / args.repeat
+        print(f"{label:40} {legacy_us:12.1f} {engine_us:12.1f} {legacy_us / engine_us:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""Load generator: replay a realistic traffic mix and report throughput and p50/p95/p99.
+
+Run from the repository root against servers you started yourself:
+
+    python bench/load_test.py --target sync=http://127.0.0.1:8000 --target asgi=http://127.0.0.1:8001
+
+or let it start the mock provider and one server per mode, fully offline:
+
+    python bench/load_test.py --spawn sync,gthread,asgi [--duration 30] [--users 32]
+
+Scenarios are weighted with ``--mix`` (default
+``quick=3,long_history=2,web=2,stream=2,feedback=1``): quick questions from
+``/api/quick-questions``, chat with a long history, web (Perplexity) mode,
+streamed answers (TTFB is reported too) and feedback bursts. Every virtual user
+keeps one connection, one ``X-Session-Id`` and its own ``X-Forwarded-For``
+address, like a separate browser.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import mock_provider  # noqa: E402
+
+SCENARIOS = ("quick", "long_history", "web", "stream", "feedback")
+DEFAULT_MIX = "quick=3,long_history=2,web=2,stream=2,feedback=1"
+SERVER_MODES = {
+    "sync": ["-k", "sync", "app:app"],
+    "gthread": ["-k", "gthread", "--threads", "8", "app:app"],
+    "asgi": ["-k", "uvicorn.workers.UvicornWorker", "asgi:application"],
+}
+FALLBACK_QUESTIONS = [
+    "Give me a concise summary of the latest developments in Nigerian tech startups.",
+    "Compare the main arguments for and against remote work.",
+    "Explain how photosynthesis works in simple terms.",
+]
+TOPICS = ["solar subsidies", "river pollution", "mobile money", "rail freight", "school meals", "vaccine logistics"]
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of ``values`` (0.0 when empty)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def parse_mix(text: str) -> dict[str, float]:
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.strip().partition("=")
+        if name not in SCENARIOS:
+            raise SystemExit(f"unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Recorder:
+    """Thread-safe sample sink: ``(scenario, status, seconds, ttfb_seconds)``."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: list[tuple[str, int, float, float | None]] = []
+
+    def add(self, scenario: str, status: int, seconds: float, ttfb: float | None = None) -> None:
+        with self._lock:
+            self.samples.append((scenario, status, seconds, ttfb))
+
+    def report(self, elapsed: float) -> dict:
+        groups = defaultdict(list)
+        for sample in self.samples:
+            groups[sample[0]].append(sample)
+            groups["all"].append(sample)
+        report = {}
+        for scenario, samples in groups.items():
+            latencies = [seconds for _, status, seconds, _ in samples if status < 400]
+            ttfbs = [ttfb for _, status, _, ttfb in samples if status < 400 and ttfb is not None]
+            statuses = defaultdict(int)
+            for _, status, _, _ in samples:
+                statuses[status] += 1
+            report[scenario] = {
+                "requests": len(samples),
+                "errors": sum(count for status, count in statuses.items() if status >= 400 or status == 0),
+                "statuses": {str(status): count for status, count in sorted(statuses.items())},
+                "rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+                "p50_ms": round(1000 * percentile(latencies, 50), 1),
+                "p95_ms": round(1000 * percentile(latencies, 95), 1),
+                "p99_ms": round(1000 * percentile(latencies, 99), 1),
+                "ttfb_p50_ms": round(1000 * percentile(ttfbs, 50), 1) if ttfbs else None,
+                "ttfb_p95_ms": round(1000 * percentile(ttfbs, 95), 1) if ttfbs else None,
+            }
+        return report
+
+
+class VirtualUser:
+    """One simulated browser: a keep-alive session, a client address and a conversation of its own."""
+
+    def __init__(self, base_url: str, index: int, recorder: Recorder, questions: list[str], timeout: float):
+        self.base_url = base_url.rstrip("/")
+        self.recorder = recorder
+        self.questions = questions
+        self.timeout = timeout
+        self.rng = random.Random(index)
+        self.session = requests.Session()
+        self.session.headers.update({
+            "X-Forwarded-For": f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}",
+            "X-Session-Id": f"bench-{index}-{os.getpid()}",
+        })
+        self.history: list[dict] = []
+
+    def post(self, scenario: str, path: str, payload: dict) -> requests.Response | None:
+        started = time.perf_counter()
+        try:
+            resp = self.session.post(self.base_url + path, json=payload, timeout=self.timeout)
+        except requests.RequestException:
+            self.recorder.add(scenario, 0, time.perf_counter() - started)
+            return None
+        self.recorder.add(scenario, resp.status_code, time.perf_counter() - started)
+        return resp
+
+    def quick(self) -> None:
+        self.post("quick", "/api/ask", {"query": self.rng.choice(self.questions)})
+
+    def long_history(self) -> None:
+        if len(self.history) < 40:
+            self.history = []
+            for turn in range(40):
+                topic = self.rng.choice(TOPICS)
+                self.history.append({"role": "user", "content": f"Turn {turn}: what do recent reports say about {topic}? " * 3})
+                self.history.append({"role": "assistant", "content": f"Reports on {topic} disagree on scale but agree on direction. " * 8})
+        query = f"Following up on {self.rng.choice(TOPICS)}, what changed most recently?"
+        resp = self.post("long_history", "/api/ask", {"query": query, "history": self.history[-80:]})
+        if resp is not None and resp.ok:
+            self.history += [{"role": "user", "content": query}, {"role": "assistant", "content": resp.json().get("answer", "")}]
+
+    def web(self) -> None:
+        self.post("web", "/api/ask", {"query": f"Latest coverage of {self.rng.choice(TOPICS)} {self.rng.randint(1, 10**6)}", "mode": "web"})
+
+    def stream(self) -> None:
+        payload = {"query": f"Walk me through {self.rng.choice(TOPICS)} step by step ({self.rng.randint(1, 10**6)})", "stream": True}
+        started = time.perf_counter()
+        ttfb = None
+        try:
+            with self.session.post(self.base_url + "/api/ask", json=payload, timeout=self.timeout, stream=True) as resp:
+                for line in resp.iter_lines():
+                    if ttfb is None and line.startswith(b"data:"):
+                        ttfb = time.perf_counter() - started
+                status = resp.status_code
+        except requests.RequestException:
+            status = 0
+        self.recorder.add("stream", status, time.perf_counter() - started, ttfb)
+
+    def feedback(self) -> None:
+        started = time.perf_counter()
+        try:
+            resp = self.session.get(self.base_url + "/api/feedback/csrf", timeout=self.timeout)
+        except requests.RequestException:
+            self.recorder.add("feedback", 0, time.perf_counter() - started)
+            return
+        self.recorder.add("feedback", resp.status_code, time.perf_counter() - started)
+        token = resp.json().get("token") if resp.ok else None
+        if not token:
+            return
+        for _ in range(self.rng.randint(2, 4)):
+            resp = self.post("feedback", "/api/feedback", {
+                "name": "Load Test",
+                "message": f"Benchmark feedback {self.rng.getrandbits(64):x}: the answers were helpful.",
+                "csrf_token": token,
+            })
+            if resp is None or not resp.ok:
+                return
+            token = resp.json().get("csrf_token", token)
+
+    def run(self, mix: dict[str, float], stop_at: float, remaining: list[int], lock: threading.Lock) -> None:
+        names, weights = list(mix), list(mix.values())
+        try:
+            while time.perf_counter() < stop_at:
+                with lock:
+                    if remaining[0] == 0:
+                        return
+                    remaining[0] -= 1
+                getattr(self, self.rng.choices(names, weights)[0])()
+        finally:
+            self.session.close()
+
+
+
+def fetch_questions(base_url: str) -> list[str]:
+    try:
+        data = requests.get(base_url.rstrip("/") + "/api/quick-questions", timeout=5).json()
+        return [item["prompt"] for item in data.get("questions", []) if item.get("prompt")] or FALLBACK_QUESTIONS
+    except (requests.RequestException, ValueError, KeyError, TypeError):
+        return FALLBACK_QUESTIONS
+
+
+def run_load(base_url: str, mix: dict[str, float], users: int, duration: float, max_requests: int, timeout: float) -> dict:
+    recorder = Recorder()
+    questions = fetch_questions(base_url)
+    lock = threading.Lock()
+    remaining = [max_requests if max_requests > 0 else -1]
+    started = time.perf_counter()
+    stop_at = started + duration
+    threads = [
+        threading.Thread(target=VirtualUser(base_url, index, recorder, questions, timeout).run, args=(mix, stop_at, remaining, lock))
+        for index in range(users)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.report(time.perf_counter() - started)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_healthy(base_url: str, proc: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"server exited with status {proc.returncode} before becoming healthy")
+        try:
+            if requests.get(base_url + "/health", timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"{base_url} did not become healthy within {timeout:.0f}s")
+
+
+def spawn_server(mode: str, mock_url: str, workers: int, state_dir: str) -> tuple[subprocess.Popen, str]:
+    """Start ``gunicorn`` in ``mode`` against the mock provider; returns the process and its base URL."""
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "FLASK_SECRET_KEY": "bench",
+        "OPENAI_API_KEY": "mock",
+        "OPENAI_API_URL": f"{mock_url}/openai/v1/chat/completions",
+        "OPENROUTER_API_KEY": "mock",
+        "OPENROUTER_API_URL": f"{mock_url}/openrouter/api/v1/chat/completions",
+        "PPLX_API_KEY": "mock",
+        "PPLX_API_URL": f"{mock_url}/perplexity/chat/completions",
+        "TELEGRAM_BOT_TOKEN": "mock",
+        "TELEGRAM_CHAT_ID": "1",
+        "TELEGRAM_API_BASE": f"{mock_url}/telegram",
+        "STATE_DIR": os.path.join(state_dir, mode),
+    })
+    # Measure the server, not the per-client limits; export these to override.
+    env.setdefault("RATE_LIMIT_ENABLED", "false")
+    env.setdefault("TELEGRAM_MIN_INTERVAL", "0")
+    os.makedirs(env["STATE_DIR"], exist_ok=True)
+    cmd = [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(workers), "--log-level", "warning"]
+    proc = subprocess.Popen(cmd + SERVER_MODES[mode], cwd=ROOT_DIR, env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_healthy(base_url, proc)
+    except SystemExit:
+        proc.terminate()
+        raise
+    return proc, base_url
+
+
+def print_report(name: str, report: dict) -> None:
+    print(f"\n== {name}")
+    print(f"{'scenario':14} {'reqs':>6} {'errors':>6} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ttfb p50':>9}")
+    for scenario in (*SCENARIOS, "all"):
+        row = report.get(scenario)
+        if not row:
+            continue
+        ttfb = f"{row['ttfb_p50_ms']:9.1f}" if row["ttfb_p50_ms"] is not None else f"{'-':>9}"
+        print(
+            f"{scenario:14} {row['requests']:6d} {row['errors']:6d} {row['rps']:8.2f} "
+            f"{row['p50_ms']:9.1f} {row['p95_ms']:9.1f} {row['p99_ms']:9.1f} {ttfb}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", action="append", default=[], metavar="NAME=URL", help="an already running server")
+    parser.add_argument("--spawn", default="", help=f"comma-separated server modes to start: {', '.join(SERVER_MODES)}")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers per spawned server")
+    parser.add_argument("--mock", default="", help="use this mock provider URL instead of starting one in-process")
+    parser.add_argument("--users", type=int, default=16, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per target")
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many scenario runs per target (0 = no cap)")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--latency", type=float, default=mock_provider.DEFAULTS["latency"], help="in-process mock: ms to first byte")
+    parser.add_argument("--tokens-per-second", type=float, default=mock_provider.DEFAULTS["tokens_per_second"])
+    parser.add_argument("--error-rate", type=float, default=mock_provider.DEFAULTS["error_rate"])
+    parser.add_argument("--rate-limit-rate", type=float, default=mock_provider.DEFAULTS["rate_limit_rate"])
+    parser.add_argument("--json", dest="json_path", help="also write the full report to this file")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    targets = []
+    for item in args.target:
+        name, sep, url = item.partition("=")
+        targets.append((name, url) if sep else (item, item))
+    modes = [mode.strip() for mode in args.spawn.split(",") if mode.strip()]
+    unknown = [mode for mode in modes if mode not in SERVER_MODES]
+    if unknown or not (targets or modes):
+        parser.error(f"pass --target and/or --spawn with modes from: {', '.join(SERVER_MODES)}")
+
+    mock_server = None
+    mock_url = args.mock.rstrip("/")
+    if modes and not mock_url:
+        base = dict(mock_provider.DEFAULTS, latency=args.latency, tokens_per_second=args.tokens_per_second,
+                    error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate)
+        mock_server = mock_provider.start(settings=mock_provider.build_settings([], base))
+        mock_url = "http://127.0.0.1:%d" % mock_server.server_address[1]
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="sourcescout-bench-") as state_dir:
+        for name, url in targets:
+            results[name] = run_load(url, mix, args.users, args.duration, args.requests, args.timeout)
+            print_report(name, results[name])
+        for mode in modes:
+            proc, url = spawn_server(mode, mock_url, args.workers, state_dir)
+            try:
+                results[mode] = run_load(url, mix, args.users, args.duration, args.requests, args.timeout)
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+            print_report(f"{mode} ({args.workers} workers)", results[mode])
+
+    if mock_server is not None:
+        print(f"\nmock provider: {json.dumps(mock_server.RequestHandlerClass.state.stats())}")
+        mock_server.shutdown()
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""Mock LLM provider: OpenAI, OpenRouter, Perplexity and Telegram on one local port.
+
+Run from the repository root:
+
+    python bench/mock_provider.py [--port 8099] [--latency 300] [--tokens-per-second 60]
+
+then point the app at it:
+
+    OPENAI_API_URL=http://127.0.0.1:8099/openai/v1/chat/completions
+    OPENROUTER_API_URL=http://127.0.0.1:8099/openrouter/api/v1/chat/completions
+    PPLX_API_URL=http://127.0.0.1:8099/perplexity/chat/completions
+    TELEGRAM_API_BASE=http://127.0.0.1:8099/telegram
+
+Any API key works. Behaviour is set per provider with ``--set
+openrouter.error_rate=0.2`` (repeatable) or at runtime with ``POST
+/_mock/config`` and the same ``{"provider": {"field": value}}`` shape; ``GET
+/_mock/stats`` returns request counters. ``latency`` is the time to first
+byte, ``tokens_per_second`` paces streamed tokens, ``error_rate`` answers
+``500`` and ``rate_limit_rate`` answers ``429`` with ``Retry-After``.
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PROVIDERS = ("openai", "openrouter", "perplexity")
+DEFAULTS = {
+    "latency": 300.0,  # milliseconds to first byte
+    "jitter": 100.0,  # +/- milliseconds around ``latency``
+    "tokens_per_second": 60.0,
+    "answer_tokens": 120,
+    "error_rate": 0.0,
+    "rate_limit_rate": 0.0,
+    "retry_after": 1,
+}
+WORDS = (
+    "the source notes that primary evidence points toward a gradual shift in policy while "
+    "independent reviews describe mixed results across regions and several years of data"
+).split()
+CITATIONS = [
+    "https://www.example.org/report?utm_source=mock",
+    "https://example.org/report/",
+    "https://news.example.com/analysis",
+    "https://data.example.net/tables#summary",
+]
+TELEGRAM_PATH_RE = re.compile(r"^/telegram/bot[^/]+/sendMessage$")
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class MockState:
+    """Per-provider settings and counters, shared by every handler thread."""
+
+    def __init__(self, settings: dict[str, dict]):
+        self._lock = threading.Lock()
+        self.settings = settings
+        self.counters: dict[str, dict[str, int]] = {}
+        self.seen_prefixes: set[str] = set()
+        self.inflight = 0
+        self.peak_inflight = 0
+
+    def config(self, provider: str) -> dict:
+        with self._lock:
+            return dict(self.settings[provider])
+
+    def update(self, changes: dict) -> dict:
+        with self._lock:
+            for provider, values in changes.items():
+                if provider in self.settings and isinstance(values, dict):
+                    for field, value in values.items():
+                        if field in DEFAULTS:
+                            self.settings[provider][field] = type(DEFAULTS[field])(value)
+            return {name: dict(values) for name, values in self.settings.items()}
+
+    def count(self, source: str, outcome: str) -> None:
+        with self._lock:
+            totals = self.counters.setdefault(source, {})
+            totals[outcome] = totals.get(outcome, 0) + 1
+
+    def enter(self) -> None:
+        with self._lock:
+            self.inflight += 1
+            self.peak_inflight = max(self.peak_inflight, self.inflight)
+
+    def leave(self) -> None:
+        with self._lock:
+            self.inflight -= 1
+
+    def cached_prefix_tokens(self, messages: list) -> int:
+        """Report the leading system prompt as cached once it has been seen, like a warm provider cache."""
+        if not messages or not isinstance(messages[0], dict) or messages[0].get("role") != "system":
+            return 0
+        content = messages[0].get("content")
+        if isinstance(content, list):
+            content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+        digest = hashlib.sha256(str(content).encode("utf-8")).hexdigest()
+        with self._lock:
+            if digest in self.seen_prefixes:
+                return estimate_tokens(str(content))
+            self.seen_prefixes.add(digest)
+        return 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "inflight": self.inflight,
+                "peak_inflight": self.peak_inflight,
+                "requests": {source: dict(totals) for source, totals in self.counters.items()},
+            }
+
+
+def answer_words(count: int, web: bool) -> list[str]:
+    rng = random.Random(count)
+    words = []
+    for index in range(count):
+        word = rng.choice(WORDS)
+        if web and index and index % 25 == 0:
+            word += f" [{index // 25 % len(CITATIONS) + 1}]"
+        words.append(word)
+    return [(" " if index else "") + word for index, word in enumerate(words)]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "SourceScoutMock/1.0"
+    state: MockState
+
+    def log_message(self, format, *args):  # noqa: A002 - BaseHTTPRequestHandler signature
+        pass
+
+    def send_json(self, status: int, payload: dict, headers: dict | None = None) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def write_chunk(self, text: str) -> None:
+        data = text.encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return {}
+
+    def do_GET(self):
+        if self.path == "/_mock/stats":
+            return self.send_json(200, self.state.stats())
+        if self.path == "/health":
+            return self.send_json(200, {"status": "ok"})
+        return self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        body = self.read_json()
+        if self.path == "/_mock/config":
+            return self.send_json(200, self.state.update(body))
+        if TELEGRAM_PATH_RE.match(self.path):
+            self.state.count("telegram", "ok")
+            return self.send_json(200, {"ok": True, "result": {"message_id": random.randint(1, 10**6), "text": body.get("text", "")}})
+        provider = self.path.strip("/").split("/", 1)[0]
+        if provider not in PROVIDERS or not self.path.endswith("/chat/completions"):
+            return self.send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+        self.state.enter()
+        try:
+            self.complete(provider, body)
+        finally:
+            self.state.leave()
+
+    def complete(self, provider: str, body: dict) -> None:
+        config = self.state.config(provider)
+        delay = max(0.0, config["latency"] + random.uniform(-config["jitter"], config["jitter"])) / 1000
+        roll = random.random()
+        if roll < config["rate_limit_rate"]:
+            self.state.count(provider, "429")
+            return self.send_json(
+                429,
+                {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_exceeded"}},
+                {"Retry-After": str(config["retry_after"])},
+            )
+        time.sleep(delay)
+        if roll < config["rate_limit_rate"] + config["error_rate"]:
+            self.state.count(provider, "500")
+            return self.send_json(500, {"error": {"message": "Internal error (mock)", "type": "server_error"}})
+
+        messages = body.get("messages") or []
+        prompt_tokens = sum(estimate_tokens(str(m.get("content", ""))) for m in messages if isinstance(m, dict))
+        web = provider == "perplexity"
+        pieces = answer_words(config["answer_tokens"], web)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(pieces),
+            "total_tokens": prompt_tokens + len(pieces),
+            "prompt_tokens_details": {"cached_tokens": self.state.cached_prefix_tokens(messages)},
+        }
+        base = {"id": f"mock-{random.getrandbits(48):x}", "object": "chat.completion", "model": body.get("model", "mock")}
+        if web:
+            base["citations"] = CITATIONS
+
+        if not body.get("stream"):
+            self.state.count(provider, "ok")
+            interval = 1 / config["tokens_per_second"] if config["tokens_per_second"] > 0 else 0
+            time.sleep(interval * len(pieces))
+            return self.send_json(200, {
+                **base,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(pieces)}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        self.state.count(provider, "stream")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        interval = 1 / config["tokens_per_second"] if config["tokens_per_second"] > 0 else 0
+        try:
+            for piece in pieces:
+                chunk = {**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": piece}}]}
+                self.write_chunk(f"data: {json.dumps(chunk)}\n\n")
+                if interval:
+                    time.sleep(interval)
+            final = {**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            self.write_chunk(f"data: {json.dumps(final)}\n\n")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                self.write_chunk(f"data: {json.dumps({**base, 'choices': [], 'usage': usage})}\n\n")
+            self.write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.state.count(provider, "client_disconnect")
+            self.close_connection = True
+
+
+def build_settings(overrides: list[str], base: dict) -> dict[str, dict]:
+    settings = {provider: dict(base) for provider in PROVIDERS}
+    for item in overrides:
+        target, _, value = item.partition("=")
+        provider, _, field = target.partition(".")
+        if provider not in settings or field not in DEFAULTS or not value:
+            raise SystemExit(f"--set expects provider.field=value with provider in {PROVIDERS} and field in {tuple(DEFAULTS)}: {item!r}")
+        settings[provider][field] = type(DEFAULTS[field])(value)
+    return settings
+
+
+def start(host: str = "127.0.0.1", port: int = 0, settings: dict[str, dict] | None = None) -> ThreadingHTTPServer:
+    """Serve the mock on a daemon thread; ``server.server_address`` has the bound port."""
+    handler = type("BoundMockHandler", (MockHandler,), {"state": MockState(settings or build_settings([], DEFAULTS))})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=DEFAULTS["latency"], help="time to first byte in ms")
+    parser.add_argument("--jitter", type=float, default=DEFAULTS["jitter"], help="+/- ms around --latency")
+    parser.add_argument("--tokens-per-second", type=float, default=DEFAULTS["tokens_per_second"])
+    parser.add_argument("--answer-tokens", type=int, default=DEFAULTS["answer_tokens"])
+    parser.add_argument("--error-rate", type=float, default=DEFAULTS["error_rate"], help="fraction of 500 responses")
+    parser.add_argument("--rate-limit-rate", type=float, default=DEFAULTS["rate_limit_rate"], help="fraction of 429 responses")
+    parser.add_argument("--retry-after", type=int, default=DEFAULTS["retry_after"])
+    parser.add_argument("--set", action="append", default=[], metavar="PROVIDER.FIELD=VALUE")
+    args = parser.parse_args()
+
+    base = {field: getattr(args, field) for field in DEFAULTS}
+    server = start(args.host, args.port, build_settings(args.set, base))
+    host, port = server.server_address[:2]
+    print(f"mock provider on http://{host}:{port} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Shared test setup.
+
+``app`` reads its configuration at import time, so the bundled mock provider
+is started and the environment pointed at it (with a throwaway ``STATE_DIR``)
+before any test module imports the app.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "bench")]
+
+import mock_provider  # noqa: E402
+
+MOCK = mock_provider.start(
+    settings=mock_provider.build_settings(
+        [], {**mock_provider.DEFAULTS, "latency": 5.0, "jitter": 0.0, "tokens_per_second": 0.0, "answer_tokens": 20}
+    )
+)
+MOCK_URL = "http://127.0.0.1:%d" % MOCK.server_address[1]
+
+os.environ.update({
+    "FLASK_SECRET_KEY": "test-secret",
+    "STATE_DIR": tempfile.mkdtemp(prefix="sourcescout-tests-"),
+    "OPENAI_API_KEY": "test-key",
+    "OPENROUTER_API_KEY": "test-key",
+    "PPLX_API_KEY": "test-key",
+    "OPENAI_API_URL": f"{MOCK_URL}/openai/v1/chat/completions",
+    "OPENROUTER_API_URL": f"{MOCK_URL}/openrouter/api/v1/chat/completions",
+    "PPLX_API_URL": f"{MOCK_URL}/perplexity/chat/completions",
+    "TELEGRAM_API_BASE": f"{MOCK_URL}/telegram",
+    "APP_DEBUG": "false",
+})
+
+
+@pytest.fixture
+def mock_provider_url():
+    return MOCK_URL
+
+
+@pytest.fixture
+def mock_config():
+    """Change mock provider behaviour for one test; the defaults come back afterwards."""
+    state = MOCK.RequestHandlerClass.state
+    saved = {name: dict(values) for name, values in state.settings.items()}
+    yield state.update
+    state.settings.clear()
+    state.settings.update(saved)
+
+
+@pytest.fixture
+def state_dir(tmp_path):
+    return str(tmp_path)
+
+
+@pytest.fixture
+def asgi_request():
+    """Send one request through ``asgi.application`` on a fresh event loop; returns the httpx response."""
+    import asyncio
+
+    import httpx
+
+    import asgi
+
+    def send(method, path, **kwargs):
+        async def run():
+            transport = httpx.ASGITransport(app=asgi.application)
+            try:
+                async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+                    return await client.request(method, path, **kwargs)
+            finally:
+                await asgi.upstream.aclose()
+
+        return asyncio.run(run())
+
+    return send
@@ -0,0 +1,65 @@
+import threading
+import time
+
+import pytest
+
+import app
+
+
+def test_gate_admits_up_to_the_limit_then_queues():
+    gate = app.AdmissionGate(max_concurrent=1, max_queue=1, queue_timeout=5)
+    assert gate.acquire()
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(gate.acquire()))
+    waiter.start()
+    while gate.stats()["waiting"] < 1:
+        time.sleep(0.005)
+    # The queue is full, so a third caller is refused at once.
+    assert not gate.acquire()
+    gate.release()
+    waiter.join(5)
+    assert admitted == [True]
+    stats = gate.stats()
+    assert stats["active"] == 1 and stats["queued"] == 1 and stats["rejected_queue_full"] == 1
+
+
+def test_gate_gives_up_after_the_queue_timeout():
+    gate = app.AdmissionGate(max_concurrent=1, max_queue=4, queue_timeout=0.05)
+    assert gate.acquire()
+    assert not gate.acquire()
+    assert gate.stats()["rejected_timeout"] == 1
+
+
+def test_unlimited_gate_always_admits():
+    gate = app.AdmissionGate(max_concurrent=0, max_queue=0, queue_timeout=0)
+    assert all(gate.acquire() for _ in range(100))
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app, "rate_limiter", app.RateLimiter(app.MemoryStore(100)))
+    monkeypatch.setattr(app, "RATE_LIMIT_IP_PER_MINUTE", 0.6)
+    monkeypatch.setattr(app, "RATE_LIMIT_IP_BURST", 2.0)
+    return app.app.test_client()
+
+
+def test_ask_is_rate_limited_per_client(client):
+    body = {"query": "rate limited?", "mode": "chat", "cache": "bypass"}
+    assert client.post("/api/ask", json=body).status_code == 200
+    assert client.post("/api/ask", json=body).status_code == 200
+    resp = client.post("/api/ask", json=body)
+    assert resp.status_code == 429 and int(resp.headers["Retry-After"]) >= 1
+    # Another client has its own bucket.
+    other = client.post("/api/ask", json=body, environ_base={"REMOTE_ADDR": "10.0.0.2"})
+    assert other.status_code == 200
+
+
+def test_ask_is_refused_when_the_gate_is_full(client, monkeypatch):
+    gate = app.AdmissionGate(max_concurrent=1, max_queue=0, queue_timeout=0)
+    monkeypatch.setattr(app, "admission_gate", gate)
+    assert gate.acquire()
+    resp = client.post("/api/ask", json={"query": "busy?", "mode": "chat", "cache": "bypass"})
+    assert resp.status_code == 429 and "busy" in resp.get_json()["error"]
+    gate.release()
+    assert client.post("/api/ask", json={"query": "busy?", "mode": "chat", "cache": "bypass"}).status_code == 200
+    assert gate.stats()["active"] == 0
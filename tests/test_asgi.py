@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+
+import app
+
+
+class RecordingStore(app.SQLiteStore):
+    """SQLite store remembering which threads opened connections, i.e. did I/O."""
+
+    def __init__(self, *args):
+        self.threads = set()
+        super().__init__(*args)
+
+    def _conn(self):
+        self.threads.add(threading.get_ident())
+        return super()._conn()
+
+
+@pytest.fixture
+def sqlite_stores(monkeypatch, tmp_path):
+    path = str(tmp_path / "shared.sqlite3")
+    conversations, limits = RecordingStore(path, "conversations"), RecordingStore(path, "ratelimit")
+    monkeypatch.setattr(app.conversations, "store", conversations)
+    monkeypatch.setattr(app.rate_limiter, "store", limits)
+    return conversations, limits
+
+
+def test_store_io_stays_off_the_event_loop(asgi_request, sqlite_stores):
+    conversations, limits = sqlite_stores
+    conversation_id = app.conversations.create()
+    conversations.threads.clear()
+    limits.threads.clear()
+    loop_thread = threading.get_ident()  # asyncio.run drives the loop on the calling thread
+
+    resp = asgi_request("POST", "/api/ask", json={"query": "Off the loop?", "conversation_id": conversation_id, "cache": "bypass"})
+    assert resp.status_code == 200
+    assert conversations.threads and loop_thread not in conversations.threads
+    assert limits.threads and loop_thread not in limits.threads
+    assert len(app.conversations.load(conversation_id)) == 2
+
+    limits.threads.clear()
+    resp = asgi_request("POST", "/api/ask/batch", json={"queries": ["one", "two"], "mode": "chat", "cache": "bypass"})
+    assert resp.status_code == 200
+    assert limits.threads and loop_thread not in limits.threads
+
+
+def test_memory_stores_are_used_inline():
+    import asgi
+
+    assert not asgi.store_blocks(app.MemoryStore(4))
+    assert not asgi.store_blocks(None)
+
+
+def test_flask_routes_are_served_concurrently():
+    import asyncio
+
+    import httpx
+
+    import asgi
+
+    assert isinstance(asgi.flask_app, asgi.ThreadedWsgiToAsgi)
+    arrived = threading.Barrier(3, timeout=5)
+
+    def wsgi_app(environ, start_response):
+        # Fails unless all three requests are inside the app at the same time.
+        arrived.wait()
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return [str(threading.get_ident()).encode()]
+
+    async def run():
+        transport = httpx.ASGITransport(app=asgi.ThreadedWsgiToAsgi(wsgi_app))
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            return await asyncio.gather(*(client.get("/") for _ in range(3)))
+
+    responses = asyncio.run(run())
+    assert [r.status_code for r in responses] == [200] * 3
+    assert len({r.text for r in responses}) == 3
+
+
+def test_flask_fallback_routes_answer_through_asgi(asgi_request):
+    resp = asgi_request("POST", "/api/conversations", json={})
+    assert resp.status_code == 201 and resp.json()["conversation_id"]
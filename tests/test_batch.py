@@ -0,0 +1,53 @@
+import threading
+import time
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def gate(monkeypatch):
+    gate = app.AdmissionGate(max_concurrent=1, max_queue=10, queue_timeout=5)
+    monkeypatch.setattr(app, "admission_gate", gate)
+    return gate
+
+
+def test_leaving_a_batch_stops_running_entries(gate, monkeypatch):
+    calls = []
+    monkeypatch.setattr(app, "answer_ask", lambda plan: calls.append(plan["query"]) or ({"answer": "x"}, 200))
+    batch = app.plan_batch({"queries": ["", "still waiting for a slot"], "mode": "chat", "cache": "bypass"})
+    before = app.cancellations.stats()["disconnect"]
+
+    assert gate.acquire()  # every slot is busy, so the real entry queues on the gate
+    lines = app.batch_results(batch["plans"], concurrency=2)
+    assert '"status": 400' in next(lines)
+    while gate.stats()["waiting"] < 1:
+        time.sleep(0.005)
+    lines.close()  # the client went away
+    gate.release()
+
+    while gate.stats()["active"] or gate.stats()["waiting"]:
+        time.sleep(0.005)
+    assert calls == []
+    assert app.cancellations.stats()["disconnect"] == before + 1
+
+
+def test_cancelled_entry_does_not_take_a_slot(gate):
+    plan = app.plan_batch({"queries": ["anything"], "mode": "chat", "cache": "bypass"})["plans"][0]
+    cancelled = threading.Event()
+    cancelled.set()
+    payload, status, _ = app.answer_batch_item(plan, cancelled=cancelled)
+    assert (payload, status) == app.BATCH_CANCELLED
+    assert gate.stats()["admitted"] == 0
+
+
+def test_batch_streams_every_entry_and_a_summary(monkeypatch):
+    monkeypatch.setattr(app, "rate_limiter", app.RateLimiter(app.MemoryStore(10), enabled=False))
+    resp = app.app.test_client().post(
+        "/api/ask/batch", json={"queries": ["first", {"query": "second", "id": "b"}, ""], "mode": "chat", "cache": "bypass"}
+    )
+    lines = [app.json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    assert sorted(line["index"] for line in lines[:-1]) == [0, 1, 2]
+    assert next(line for line in lines if line.get("index") == 1)["id"] == "b"
+    assert lines[-1]["done"] and lines[-1]["succeeded"] == 2 and lines[-1]["failed"] == 1
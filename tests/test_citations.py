@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+import app
+
+SAMPLES = [
+    "Plain answer without any markers.",
+    "RAG combines retrieval [1] with generation [2][3].  It helps   grounding [1, 2].",
+    "  Leading space and a trailing marker [4]  ",
+    "[1] starts with a marker, then text [2].",
+    "Brackets that are not markers [see above] stay, [12] goes.\n\nNew paragraph [3].",
+    "See https://example.org/report?utm_source=x and https://news.example.com/a#b [1] for more.",
+    "Unterminated [ bracket at the end [",
+    "Tabs\tand\nnewlines [2]\n\n[5] everywhere ",
+]
+
+
+def run(text, chunks, collect_urls):
+    processor = app.CitationProcessor(collect_urls=collect_urls)
+    out = "".join(processor.feed(chunk) for chunk in chunks) + processor.flush()
+    return out, processor.markers, list(processor.urls), processor.length
+
+
+def chunkings(text):
+    yield [text]
+    yield list(text)
+    for cut in range(1, len(text)):
+        yield [text[:cut], text[cut:]]
+    rng = random.Random(len(text))
+    for _ in range(25):
+        cuts = sorted(rng.sample(range(1, len(text)), min(len(text) - 1, rng.randint(1, 6))))
+        yield [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+
+
+@pytest.mark.parametrize("collect_urls", [False, True])
+@pytest.mark.parametrize("text", SAMPLES)
+def test_chunk_boundaries_never_change_the_result(text, collect_urls):
+    expected = run(text, [text], collect_urls)
+    for chunks in chunkings(text):
+        assert run(text, chunks, collect_urls) == expected, chunks
+
+
+def test_markers_are_cut_and_their_positions_kept():
+    processor = app.CitationProcessor()
+    answer = processor.process("RAG combines retrieval [1] with generation [2][3].")
+    assert answer == "RAG combines retrieval with generation."
+    assert processor.markers == [[len("RAG combines retrieval"), [1]], [len("RAG combines retrieval with generation"), [2, 3]]]
+    assert processor.length == len(answer)
+
+
+def test_render_answer_maps_markers_to_deduplicated_sources():
+    citations = ["https://www.example.org/report?utm_source=mock", "https://example.org/report/", "https://news.example.com/analysis"]
+    payload = app.render_answer("First claim [1]. Second claim [2]. Third [3].", citations)
+    assert payload["answer"] == "First claim. Second claim. Third."
+    offsets = [marker["offset"] for marker in payload["citation_markers"]]
+    assert offsets == sorted(offsets) and all(0 <= o <= len(payload["answer"]) for o in offsets)
+    # The first two sources are one page, so markers [1] and [2] both point at it.
+    assert [c["url"] for c in payload["citations"]] == [citations[0], citations[2]]
+    assert [m["citations"] for m in payload["citation_markers"]] == [[1], [1], [2]]
+
+
+def test_link_fallback_collects_urls_from_the_answer():
+    payload = app.render_answer("Read https://example.org/a and https://example.net/b for more.", link_fallback=True)
+    assert [c["url"] for c in payload["citations"]] == ["https://example.org/a", "https://example.net/b"]
@@ -0,0 +1,49 @@
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def test_ask_with_a_conversation_records_both_turns(client):
+    created = client.post("/api/conversations", json={"history": [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]})
+    assert created.status_code == 201
+    conversation_id = created.get_json()["conversation_id"]
+
+    resp = client.post("/api/ask", json={"query": "What is RAG?", "conversation_id": conversation_id, "cache": "bypass"})
+    assert resp.status_code == 200
+    answer = resp.get_json()["answer"]
+
+    turns = client.get(f"/api/conversations/{conversation_id}").get_json()["turns"]
+    assert turns[-2:] == [{"role": "user", "content": "What is RAG?"}, {"role": "assistant", "content": answer}]
+    assert len(turns) == 4
+
+
+def test_unknown_or_deleted_conversation_is_404(client):
+    assert client.post("/api/ask", json={"query": "q", "conversation_id": "doesnotexist1"}).status_code == 404
+    conversation_id = client.post("/api/conversations", json={}).get_json()["conversation_id"]
+    assert client.delete(f"/api/conversations/{conversation_id}").status_code == 204
+    resp = client.get(f"/api/conversations/{conversation_id}")
+    assert resp.status_code == 404 and resp.get_json()["conversation_expired"]
+
+
+def test_store_trims_oldest_turns_to_the_caps():
+    store = app.ConversationStore(app.MemoryStore(16), ttl=60, max_turns=4, max_bytes=1024)
+    conversation_id = store.create()
+    for i in range(5):
+        store.append(conversation_id, {"role": "user", "content": f"q{i}"}, {"role": "assistant", "content": f"a{i}"})
+    assert [t["content"] for t in store.load(conversation_id)] == ["q3", "a3", "q4", "a4"]
+
+    big = "x" * 400
+    for i in range(3):
+        store.append(conversation_id, {"role": "user", "content": big}, {"role": "assistant", "content": big})
+    assert len(store.load(conversation_id)) == 2
+
+
+def test_malformed_ids_are_rejected_without_touching_the_store():
+    store = app.ConversationStore(app.MemoryStore(4), ttl=60, max_turns=10, max_bytes=4096)
+    assert store.load("../etc/passwd") is None
+    assert store.load(None) is None
@@ -0,0 +1,99 @@
+import time
+
+import pytest
+
+import app
+from conftest import MOCK
+
+
+@pytest.fixture(autouse=True)
+def telegram(monkeypatch):
+    monkeypatch.setattr(app, "TELEGRAM_BOT_TOKEN", "test-token")
+    monkeypatch.setattr(app, "TELEGRAM_CHAT_ID", "42")
+
+
+def make_queue(path):
+    return app.FeedbackQueue(path, batch_max=10, max_attempts=3, retry_max_delay=1.0, min_interval=0.0)
+
+
+def telegram_sends():
+    return MOCK.RequestHandlerClass.state.stats()["requests"].get("telegram", {}).get("ok", 0)
+
+
+def wait_for(condition, timeout=5.0):
+    stop = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < stop, "timed out"
+        time.sleep(0.01)
+
+
+def test_pending_feedback_is_delivered_after_a_restart(tmp_path, monkeypatch):
+    path = str(tmp_path / "feedback.sqlite3")
+    with monkeypatch.context() as patched:
+        # The first process goes away before its worker sends anything.
+        patched.setattr(app.FeedbackQueue, "ensure_worker", lambda self: None)
+        first = make_queue(path)
+        for index in range(3):
+            first.enqueue(f"user {index}", f"user{index}@example.com", f"message {index}")
+        assert first.stats()["depth"] == 3
+
+    sent = telegram_sends()
+    second = make_queue(path)
+    second.ensure_worker()
+    wait_for(lambda: second.stats()["depth"] == 0)
+    stats = second.stats()
+    assert stats["delivered"] == 3 and stats["messages"] == 1
+    assert telegram_sends() == sent + 1
+
+
+def test_rows_leased_by_a_dead_worker_are_reclaimed(tmp_path, monkeypatch):
+    path = str(tmp_path / "feedback.sqlite3")
+    monkeypatch.setattr(app.FeedbackQueue, "ensure_worker", lambda self: None)
+    first = make_queue(path)
+    first.enqueue("someone", "someone@example.com", "claimed, never sent")
+    assert len(first.claim()) == 1
+
+    second = make_queue(path)
+    assert second.claim() == []
+    now = time.time()
+    monkeypatch.setattr(app.time, "time", lambda: now + app.FeedbackQueue.LEASE_SECONDS + 1)
+    assert [row[3] for row in second.claim()] == ["claimed, never sent"]
+
+
+def test_failed_sends_are_retried_then_parked(tmp_path, monkeypatch):
+    queue = make_queue(str(tmp_path / "feedback.sqlite3"))
+    monkeypatch.setattr(app.FeedbackQueue, "ensure_worker", lambda self: None)
+    monkeypatch.setattr(app, "TELEGRAM_API_BASE", "http://127.0.0.1:9/telegram")
+    queue.enqueue("someone", "someone@example.com", "undeliverable")
+    now = time.time()
+    for attempt in range(queue.max_attempts):
+        monkeypatch.setattr(app.time, "time", lambda: now + 10 * (attempt + 1))
+        assert queue.deliver_once()
+    stats = queue.stats()
+    assert stats["depth"] == 0 and stats["dead_letters"] == 1 and stats["failures"] == 3
+
+
+def test_worker_starts_once_per_process(tmp_path, monkeypatch):
+    queue = make_queue(str(tmp_path / "feedback.sqlite3"))
+    queue.ensure_worker()
+    worker = queue._worker
+    queue.ensure_worker()
+    assert queue._worker is worker and worker.name == "feedback-queue"
+    # In a forked child the parent's thread does not exist, so a new one is started.
+    monkeypatch.setattr(app.os, "getpid", lambda: -1)
+    queue.ensure_worker()
+    assert queue._worker is not worker
+
+
+def test_sqlite_connections_are_per_thread_and_use_wal(tmp_path):
+    import threading
+
+    path = str(tmp_path / "shared.sqlite3")
+    conn = app.sqlite_connect(path)
+    assert app.sqlite_connect(path) is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    other = []
+    thread = threading.Thread(target=lambda: other.append(app.sqlite_connect(path)))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
@@ -0,0 +1,55 @@
+import app
+
+
+def turns(count, words=50):
+    history = []
+    for i in range(count):
+        role = "user" if i % 2 == 0 else "assistant"
+        history.append({"role": role, "content": f"Turn {i} opens here. " + "word " * words})
+    return history
+
+
+def use_budget(monkeypatch, budget, mode="summarize"):
+    monkeypatch.setattr(app, "HISTORY_COMPACTION", mode)
+    monkeypatch.setattr(app, "HISTORY_TOKEN_BUDGET", budget)
+    monkeypatch.setattr(app, "HISTORY_TOKEN_BUDGETS", {})
+
+
+def test_history_within_budget_is_untouched(monkeypatch):
+    use_budget(monkeypatch, 10_000)
+    history = turns(4)
+    assert app.compact_history(history, "gpt-4o-mini") == (history, None)
+
+
+def test_trim_keeps_the_newest_turns_starting_on_a_user_turn(monkeypatch):
+    use_budget(monkeypatch, 200, mode="trim")
+    history = turns(10)
+    kept, report = app.compact_history(history, "gpt-4o-mini")
+    assert kept == history[-len(kept):]
+    assert kept[0]["role"] == "user"
+    assert report["trimmed_turns"] == len(history) - len(kept)
+    assert report["kept_tokens"] <= 200
+    assert not report["summarized"]
+
+
+def test_summarize_replaces_dropped_turns_with_a_system_note(monkeypatch):
+    use_budget(monkeypatch, 400)
+    history = turns(10)
+    kept, report = app.compact_history(history, "gpt-4o-mini")
+    assert report["summarized"]
+    assert kept[0]["role"] == "system"
+    assert "Turn 0 opens here." in kept[0]["content"] or "Turn 1 opens here." in kept[0]["content"]
+    assert kept[1:] == history[-(len(kept) - 1):]
+
+
+def test_off_sends_everything(monkeypatch):
+    use_budget(monkeypatch, 10, mode="off")
+    history = turns(10)
+    assert app.compact_history(history, "gpt-4o-mini") == (history, None)
+
+
+def test_per_model_budget_overrides_the_default(monkeypatch):
+    use_budget(monkeypatch, 10_000)
+    monkeypatch.setattr(app, "HISTORY_TOKEN_BUDGETS", {"tiny-model": 100})
+    kept, report = app.compact_history(turns(10), "tiny-model")
+    assert report is not None and len(kept) < 10
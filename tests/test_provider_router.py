@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+import app
+
+PAYLOAD = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "hello"}]}
+
+
+@pytest.fixture
+def router():
+    return app.ProviderRouter(app.configured_chat_providers())
+
+
+def later(monkeypatch, seconds):
+    now = time.monotonic()
+    monkeypatch.setattr(app.time, "monotonic", lambda: now + seconds)
+
+
+def test_consecutive_faults_open_the_circuit():
+    health = app.ProviderHealth("openai")
+    for _ in range(app.PROVIDER_BREAKER_FAILURES - 1):
+        health.record(0.1, ok=False)
+    assert health.state == "closed" and health.allow()
+    health.record(0.1, ok=False)
+    assert health.state == "open"
+    assert not health.allow()
+
+
+def test_windowed_error_rate_opens_the_circuit():
+    health = app.ProviderHealth("openai")
+    # Alternating outcomes never reach the consecutive limit but hold a 50% error rate.
+    for index in range(app.PROVIDER_BREAKER_MIN_SAMPLES):
+        health.record(0.1, ok=index % 2 == 0)
+    assert health.state == "open"
+
+
+def test_half_open_lets_one_probe_through(monkeypatch):
+    health = app.ProviderHealth("openai")
+    for _ in range(app.PROVIDER_BREAKER_FAILURES):
+        health.record(0.1, ok=False)
+    later(monkeypatch, app.PROVIDER_BREAKER_COOLDOWN - 1)
+    assert not health.allow()
+    later(monkeypatch, app.PROVIDER_BREAKER_COOLDOWN + 1)
+    assert health.allow()
+    assert health.state == "half_open"
+    assert not health.allow()  # only one probe at a time
+    health.record(0.1, ok=True)
+    assert health.state == "closed" and health.allow()
+
+
+def test_failed_probe_reopens_the_circuit(monkeypatch):
+    health = app.ProviderHealth("openai")
+    for _ in range(app.PROVIDER_BREAKER_FAILURES):
+        health.record(0.1, ok=False)
+    later(monkeypatch, app.PROVIDER_BREAKER_COOLDOWN + 1)
+    assert health.allow()
+    health.record(0.1, ok=False)
+    assert health.state == "open"
+    assert not health.allow()
+
+
+def test_failover_and_skipping_an_open_circuit(router, mock_config):
+    mock_config({"openai": {"error_rate": 1.0}})
+    for _ in range(app.PROVIDER_BREAKER_FAILURES):
+        resp = router.call(dict(PAYLOAD))
+        assert resp.status_code == 200
+        assert "openrouter" in resp.url
+    assert router.stats()["failovers"] == app.PROVIDER_BREAKER_FAILURES
+    assert router.health["openai"].state == "open"
+    # With the circuit open the failing provider is no longer tried at all.
+    assert [p["name"] for p in router.candidates()] == ["openrouter"]
+    router.call(dict(PAYLOAD))
+    assert router.stats()["failovers"] == app.PROVIDER_BREAKER_FAILURES
+
+
+def test_client_errors_do_not_fail_over(router):
+    for status in (400, 404, 422):
+        assert not app.should_failover(status)
+        router.record("openai", 0.1, status)
+    assert router.health["openai"].state == "closed"
+    assert app.should_failover(401) and app.should_failover(503) and app.should_failover(None)
+
+
+def test_every_circuit_open_still_tries_the_preferred_provider(router):
+    for health in router.health.values():
+        for _ in range(app.PROVIDER_BREAKER_FAILURES):
+            health.record(0.1, ok=False)
+    assert [p["name"] for p in router.candidates()] == [router.providers[0]["name"]]
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = app.RateLimiter(app.MemoryStore(100))
+    monkeypatch.setattr(app, "rate_limiter", limiter)
+    monkeypatch.setattr(app, "RATE_LIMIT_IP_PER_MINUTE", 0.6)
+    monkeypatch.setattr(app, "RATE_LIMIT_IP_BURST", 10.0)
+    return limiter
+
+
+def batch(size):
+    return {"queries": [f"batch question {i}" for i in range(size)], "mode": "chat", "cache": "bypass"}
+
+
+def test_token_bucket_takes_the_whole_cost_or_nothing():
+    state, wait = app.token_bucket(None, rate=1.0, burst=5.0, now=100.0, cost=3)
+    assert wait == 0 and state.startswith("2.000000:")
+    state, wait = app.token_bucket(state, rate=1.0, burst=5.0, now=100.0, cost=3)
+    assert wait == pytest.approx(1.0)
+    assert state.startswith("2.000000:")
+
+
+def test_session_and_ip_buckets_both_apply(limiter, monkeypatch):
+    monkeypatch.setattr(app, "RATE_LIMIT_SESSION_PER_MINUTE", 0.6)
+    monkeypatch.setattr(app, "RATE_LIMIT_SESSION_BURST", 2.0)
+    assert limiter.capacity("1.2.3.4") == 10.0
+    assert limiter.capacity("1.2.3.4", "session-a") == 2.0
+    assert limiter.check("1.2.3.4", "session-a", cost=2) == 0
+    assert limiter.check("1.2.3.4", "session-a") > 0
+    assert limiter.stats()["limited_session"] == 1
+
+
+@pytest.mark.parametrize("transport", ["flask", "asgi"])
+def test_batches_are_charged_per_entry(limiter, transport, asgi_request):
+    if transport == "flask":
+        client = app.app.test_client()
+
+        def post(body):
+            resp = client.post("/api/ask/batch", json=body)
+            return resp.status_code, resp.headers, resp.get_data(as_text=True)
+    else:
+
+        def post(body):
+            resp = asgi_request("POST", "/api/ask/batch", json=body)
+            return resp.status_code, resp.headers, resp.text
+
+    status, _, body = post(batch(4))
+    assert status == 200
+    assert json.loads(body.splitlines()[-1])["succeeded"] == 4
+    assert post(batch(4))[0] == 200
+    # Two tokens are left; a batch needing four is refused whole and nothing is charged.
+    status, headers, _ = post(batch(4))
+    assert status == 429 and int(headers["Retry-After"]) >= 1
+    assert post(batch(2))[0] == 200
+    # More entries than the burst can ever pay for is a client error, not a retry.
+    status, _, body = post(batch(11))
+    assert status == 413 and "at most 10" in json.loads(body)["error"]
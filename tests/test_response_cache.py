@@ -0,0 +1,78 @@
+import app
+
+
+def plan(query="What is RAG?", **fields):
+    return app.plan_ask({"query": query, "model": "gpt-4o-mini", **fields})
+
+
+def key(query="What is RAG?", **fields):
+    return plan(query, **fields)["cache"]["key"]
+
+
+def long_history(topic, turns=12):
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"Tell me about {topic} part {i}. " + "detail " * 60})
+        history.append({"role": "assistant", "content": f"{topic} answer {i}. " + "filler " * 60})
+    return history
+
+
+def test_key_ignores_case_and_spacing_of_the_query():
+    assert key("What is   RAG?") == key("what is rag?")
+
+
+def test_key_separates_model_persona_and_mode():
+    base = key()
+    assert key(model="gpt-4o") != base
+    assert key(mode="web") != base
+    assert key(personality="fluent") != key(personality="pidgin")
+
+
+def test_key_includes_history():
+    history = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+    assert key(history=history) != key()
+
+
+def test_compacted_conversations_with_a_shared_tail_do_not_collide(monkeypatch):
+    monkeypatch.setattr(app, "HISTORY_COMPACTION", "summarize")
+    monkeypatch.setattr(app, "HISTORY_TOKEN_BUDGET", 600)
+    monkeypatch.setattr(app, "HISTORY_TOKEN_BUDGETS", {})
+    tail = [
+        {"role": "user", "content": "And the next step? " + "step " * 70},
+        {"role": "assistant", "content": "Index the documents. " + "index " * 70},
+    ]
+    first = plan(history=long_history("solar panels") + tail)
+    second = plan(history=long_history("tax law") + tail)
+    # Both keep exactly the shared tail; only the summary of what was dropped differs.
+    assert first["context"]["kept_turns"] == second["context"]["kept_turns"] == len(tail)
+    assert first["messages"][-3:] == second["messages"][-3:]
+    assert first["messages"][-4]["role"] == "system" and first["messages"][-4] != second["messages"][-4]
+    assert first["cache"]["key"] != second["cache"]["key"]
+
+
+def test_persona_prompt_is_covered_by_its_hash_not_the_message():
+    messages = [{"role": "user", "content": "q"}]
+    one = app.response_cache_key("chat", "m", "fluent", "hash-a", messages)
+    assert one == app.response_cache_key("chat", "m", "fluent", "hash-a", list(messages))
+    assert one != app.response_cache_key("chat", "m", "fluent", "hash-b", messages)
+
+
+def test_cache_round_trip_ttl_and_lru(monkeypatch):
+    cache = app.ResponseCache(app.MemoryStore(2))
+    plans = [plan(f"question {i}") for i in range(3)]
+    for i, item in enumerate(plans):
+        cache.remember(item, {"answer": f"answer {i}"})
+    assert cache.lookup(plans[0]) is None  # evicted, least recently used
+    assert cache.lookup(plans[2]) == {"answer": "answer 2"}
+    now = app.time.time()
+    monkeypatch.setattr(app.time, "time", lambda: now + app.RESPONSE_CACHE_TTL_CHAT + 1)
+    assert cache.lookup(plans[2]) is None
+
+
+def test_refresh_and_bypass_directives():
+    cache = app.ResponseCache(app.MemoryStore(8))
+    cache.remember(plan(), {"answer": "cached"})
+    assert cache.lookup(plan(cache="refresh")) is None
+    assert cache.lookup(plan()) == {"answer": "cached"}
+    cache.remember(plan("other", cache="bypass"), {"answer": "not stored"})
+    assert cache.lookup(plan("other")) is None
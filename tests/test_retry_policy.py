@@ -0,0 +1,112 @@
+import time
+
+import pytest
+import requests
+
+import app
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def policy(**overrides):
+    options = {"max_attempts": 3, "base_delay": 0.0, "max_delay": 0.0, "ratio": 0.0, "reserve": 1.0}
+    options.update(overrides)
+    return app.RetryPolicy("test", **options)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(app.time, "sleep", slept.append)
+    return slept
+
+
+def sender(*outcomes):
+    calls = []
+
+    def send(timeout):
+        outcome = outcomes[min(len(calls), len(outcomes) - 1)]
+        calls.append(timeout)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return send, calls
+
+
+def test_retries_until_success(sleeps):
+    send, calls = sender(Response(503), Response(200))
+    assert policy().call(send).status_code == 200
+    assert len(calls) == 2 and len(sleeps) == 1
+
+
+def test_budget_exhaustion_stops_retrying(sleeps):
+    retry = policy(max_attempts=10, reserve=2.0)
+    send, calls = sender(Response(500))
+    assert retry.call(send).status_code == 500
+    # The reserve pays for two retries; the third is refused.
+    assert len(calls) == 3
+    stats = retry.stats()
+    assert stats["retries"] == 2 and stats["budget_exhausted"] == 1 and stats["budget"] == 0
+
+
+def test_first_attempts_refill_the_budget(sleeps):
+    retry = policy(max_attempts=10, ratio=0.5, reserve=1.0)
+    retry.call(sender(Response(500))[0])
+    assert retry.stats()["budget"] == 0
+    retry.call(sender(Response(200))[0])
+    retry.call(sender(Response(200))[0])
+    assert retry.stats()["budget"] == 1.0
+
+
+def test_max_attempts_gives_up(sleeps):
+    retry = policy(max_attempts=2, reserve=10.0)
+    send, calls = sender(Response(502))
+    assert retry.call(send).status_code == 502
+    assert len(calls) == 2 and retry.stats()["give_ups"] == 1
+
+
+def test_non_retryable_status_is_returned_at_once(sleeps):
+    send, calls = sender(Response(400))
+    assert policy().call(send).status_code == 400
+    assert len(calls) == 1 and not sleeps
+
+
+def test_retry_after_is_honoured(sleeps):
+    send, _ = sender(Response(429, {"Retry-After": "2"}), Response(200))
+    policy().call(send)
+    assert sleeps == [2.0]
+
+
+def test_retry_that_would_miss_the_deadline_is_abandoned(sleeps):
+    send, calls = sender(Response(429, {"Retry-After": "5"}), Response(200))
+    assert policy().call(send, deadline=time.monotonic() + 1).status_code == 429
+    assert len(calls) == 1 and not sleeps
+
+
+def test_connection_errors_are_retried_and_reraised(sleeps):
+    send, calls = sender(requests.ConnectionError("refused"))
+    with pytest.raises(requests.ConnectionError):
+        policy(reserve=5.0).call(send)
+    assert len(calls) == 3
+
+
+def test_read_timeouts_are_not_retried(sleeps):
+    send, calls = sender(requests.ReadTimeout("slow"))
+    with pytest.raises(requests.ReadTimeout):
+        policy().call(send)
+    assert len(calls) == 1
+
+
+def test_attempt_timeouts_shrink_toward_the_deadline():
+    connect, read = app.deadline_timeout(time.monotonic() + 0.5)
+    assert connect <= 0.5 and read <= 0.5
+    assert app.deadline_timeout(None) == (app.UPSTREAM_CONNECT_TIMEOUT, app.UPSTREAM_READ_TIMEOUT)
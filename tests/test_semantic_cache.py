@@ -0,0 +1,81 @@
+import importlib.util
+
+import pytest
+
+import app
+
+SCOPE = "chat|gpt-4o-mini|fluent|v1"
+
+
+def cache_with(embedder):
+    return app.SemanticCache(embedder, threshold=embedder.default_threshold, max_entries=100)
+
+
+def hit(cache, stored, asked, scope=SCOPE):
+    cache.remember(SCOPE, stored, "key-" + stored, ttl=60)
+    return cache.lookup(scope, asked)
+
+
+@pytest.fixture(scope="module")
+def sentence_embedder():
+    pytest.importorskip("sentence_transformers")
+    try:
+        return app.SentenceTransformerEmbedder(app.SEMANTIC_CACHE_DEFAULT_MODEL)
+    except Exception as exc:  # the model is downloaded on first use
+        pytest.skip(f"{app.SEMANTIC_CACHE_DEFAULT_MODEL} unavailable: {exc}")
+
+
+def test_paraphrase_hits_with_a_sentence_model(sentence_embedder):
+    cache = cache_with(sentence_embedder)
+    found = hit(cache, "What is the capital city of France?", "Which city is France's capital?")
+    assert found is not None and found[0] == "key-What is the capital city of France?"
+
+
+def test_word_overlap_alone_misses_with_a_sentence_model(sentence_embedder):
+    cache = cache_with(sentence_embedder)
+    assert hit(cache, "What is the capital city of France?", "What is the capital gains tax rate in France?") is None
+
+
+def test_hashing_embedder_matches_rewordings_of_the_same_words():
+    cache = cache_with(app.HashingEmbedder())
+    found = hit(cache, "Explain how photosynthesis works in simple terms.", "explain in simple terms how photosynthesis works")
+    assert found is not None and found[1]["similarity"] >= app.HashingEmbedder.default_threshold
+
+
+def test_numbers_negations_and_scope_must_agree():
+    cache = cache_with(app.HashingEmbedder())
+    assert hit(cache, "Best startups in 2019", "Best startups in 2022") is None
+    assert hit(cache, "Why is the sky blue", "Why is the sky not blue") is None
+    assert hit(cache, "Why is the sky blue", "why is the sky blue", scope="web|sonar|fluent|v1") is None
+
+
+def test_auto_uses_hashing_without_sentence_transformers(monkeypatch):
+    real_find_spec = importlib.util.find_spec
+    monkeypatch.setattr(
+        importlib.util, "find_spec", lambda name, *args: None if name == "sentence_transformers" else real_find_spec(name, *args)
+    )
+    embedder = app.make_embedder("auto", 256)
+    assert isinstance(embedder, app.HashingEmbedder) and embedder.dim == 256
+
+
+def test_auto_prefers_the_default_sentence_model(monkeypatch):
+    loaded = []
+
+    class Loaded:
+        default_threshold = app.SentenceTransformerEmbedder.default_threshold
+
+        def __init__(self, model_name):
+            loaded.append(model_name)
+
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name, *args: object())
+    monkeypatch.setattr(app, "SentenceTransformerEmbedder", Loaded)
+    assert isinstance(app.make_embedder("auto", 512), Loaded)
+    assert loaded == [app.SEMANTIC_CACHE_DEFAULT_MODEL]
+
+
+def test_a_model_that_fails_to_load_falls_back_to_hashing(monkeypatch):
+    def broken(model_name):
+        raise OSError("offline")
+
+    monkeypatch.setattr(app, "SentenceTransformerEmbedder", broken)
+    assert isinstance(app.make_embedder("some/model", 512), app.HashingEmbedder)
@@ -0,0 +1,103 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import app
+
+
+def wait_for_callers(flights, count):
+    while flights.stats()["leaders"] + flights.stats()["followers"] < count:
+        time.sleep(0.005)
+
+
+def test_concurrent_callers_share_one_call():
+    flights = app.SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return {"answer": 42}
+
+    with ThreadPoolExecutor(5) as pool:
+        futures = [pool.submit(flights.do, "k", fn) for _ in range(5)]
+        wait_for_callers(flights, 5)
+        release.set()
+        results = [f.result() for f in futures]
+    assert calls == [1]
+    assert results == [{"answer": 42}] * 5
+    assert flights.stats()["leaders"] == 1 and flights.stats()["followers"] == 4
+
+
+def test_leader_error_reaches_every_follower():
+    flights = app.SingleFlight()
+    release = threading.Event()
+
+    def fn():
+        release.wait(5)
+        raise RuntimeError("upstream down")
+
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(flights.do, "k", fn) for _ in range(4)]
+        wait_for_callers(flights, 4)
+        release.set()
+        errors = [f.exception() for f in futures]
+    assert all(isinstance(e, RuntimeError) and str(e) == "upstream down" for e in errors)
+    # The failed call is not cached: the next caller runs afresh.
+    assert flights.do("k", lambda: "recovered") == "recovered"
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_disabled_runs_every_call():
+    flights = app.SingleFlight(enabled=False)
+    calls = []
+    for _ in range(3):
+        flights.do("k", lambda: calls.append(1))
+    assert len(calls) == 3
+
+
+def test_stream_followers_replay_from_the_start():
+    flights = app.SingleFlight()
+    go = threading.Event()
+
+    def pump(flight):
+        flight.start()
+        flight.publish("a")
+        go.wait(5)
+        flight.publish("b")
+
+    leader = flights.stream("k", pump)
+    assert leader.wait_started() is None
+    follower = flights.stream("k", pump)
+    assert follower is leader
+    go.set()
+    assert list(leader.subscribe()) == ["a", "b"]
+    assert list(follower.subscribe()) == ["a", "b"]
+
+
+def test_stream_pump_failure_before_start_is_reported():
+    flights = app.SingleFlight()
+
+    def pump(flight):
+        raise RuntimeError("no connection")
+
+    flight = flights.stream("k", pump)
+    payload, status = flight.wait_started()
+    assert status == 502
+
+
+@pytest.mark.parametrize("subscribers", [1, 2])
+def test_stream_is_abandoned_only_when_every_subscriber_leaves(subscribers):
+    flight = app.StreamFlight()
+    flight.start()
+    flight.publish("a")
+    readers = [flight.subscribe() for _ in range(subscribers)]
+    for reader in readers:
+        assert next(reader) == "a"
+    for reader in readers:
+        assert not flight.abandoned
+        reader.close()
+    assert flight.abandoned
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client():
+    """The shared client (its pools report new sockets to it), with this test's sessions dropped afterwards."""
+    app.upstream_client.close()
+    yield app.upstream_client
+    app.upstream_client.close()
+
+
+def host_stats(client):
+    return dict(client.stats()["hosts"].get("127.0.0.1", {"requests": 0, "new_connections": 0, "idle_resets": 0}))
+
+
+def post(client, url):
+    resp = client.post(url, headers={"Content-Type": "application/json"}, data=json.dumps({"model": "m", "messages": []}))
+    assert resp.status_code == 200
+    return resp.content
+
+
+def test_connections_are_reused_per_host(client, mock_provider_url):
+    before = host_stats(client)
+    for _ in range(3):
+        post(client, f"{mock_provider_url}/openai/v1/chat/completions")
+    after = host_stats(client)
+    assert after["requests"] - before["requests"] == 3
+    assert after["new_connections"] - before["new_connections"] == 1
+
+
+def test_idle_sessions_are_recycled(client, mock_provider_url, monkeypatch):
+    monkeypatch.setattr(client, "idle_timeout", 10)
+    clock = [1000.0]
+    monkeypatch.setattr(app.time, "monotonic", lambda: clock[0])
+    before = host_stats(client)
+    post(client, f"{mock_provider_url}/openai/v1/chat/completions")
+    clock[0] += 11
+    post(client, f"{mock_provider_url}/openai/v1/chat/completions")
+    after = host_stats(client)
+    assert after["idle_resets"] - before["idle_resets"] == 1
+    assert after["new_connections"] - before["new_connections"] == 2
+
+
+def test_keepalive_off_opens_a_connection_per_request(client, mock_provider_url, monkeypatch):
+    monkeypatch.setattr(client, "keepalive", False)
+    before = host_stats(client)
+    for _ in range(2):
+        post(client, f"{mock_provider_url}/openai/v1/chat/completions")
+    assert host_stats(client)["new_connections"] - before["new_connections"] == 2